@@ -0,0 +1,389 @@
+'''
+    Benchmark harness for the neo_ml data pipeline
+    Intended to catch performance regressions (before they reach the nightly job that rebuilds the sample data)
+
+    Each "stage" of the pipeline is timed separately, for each of the sample sizes (1e4/1e5/1e6) ...
+    ... and, optionally, for synthetic scale-ups of the samples (every row is replicated, with suffixed IDs)
+     - Every stage runs in a freshly spawned process, so that the peak RSS reported is that of the stage alone
+     - Wall time, rows/s & peak RSS are appended to a JSON history file, & compared with the previous entry
+
+    Stages that need inputs which are not present (e.g. raw_data/ for sample_data_creation.py), or code that ...
+    ... is not available (e.g. the internal MPC libraries), are recorded as skipped
+
+    Usage (e.g.) ...
+    python benchmark.py --sizes 1e4 1e5 --scales 1 10 --stages read_detections check_tracklet_correspondance
+
+'''
+
+# ---------------------------------------
+# Third-party imports
+# ---------------------------------------
+import os, sys
+import io
+import time
+import json
+import shutil
+import platform
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+import concurrent.futures
+import resource
+import numpy as np
+
+# ---------------------------------------
+# Local imports
+# ---------------------------------------
+import data
+import columnar
+
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HISTORY     = os.path.join(BENCHMARK_DIRECTORY, 'benchmark_history.json')
+ID_FIELDS           = ('detID', 'trkID', 'objectID')
+
+
+# ---------------------------------------
+# Input files (& synthetic scale-ups)
+# ---------------------------------------
+
+def sample_filepath(numberString, dataType, directory=None, kind='real'):
+    '''
+        Path of one of the sample-data files (dataType = 'detections', 'tracklets' or 'objects')
+        kind = 'real' (from sample_data_creation.py) or 'synthetic' (from synthetic.py)
+    '''
+    directory = os.path.join(BENCHMARK_DIRECTORY, 'sample_data') if directory is None else directory
+    return os.path.join(directory, 'sample_data_%s_%s_%s.csv' % (numberString, kind, dataType))
+
+def raw_filepath(numberString, dataType, directory=None):
+    ''' Path of one of the raw input files used by sample_data_creation.py (dataType = 'obs' or 'orbits')'''
+    directory = os.path.join(BENCHMARK_DIRECTORY, 'raw_data') if directory is None else directory
+    return os.path.join(directory, 'sample_obs_%s_sorted.csv' % numberString if dataType == 'obs' else 'sample_orbit_large.csv')
+
+def _scale_up_sample_file(filepath, outpath, scale):
+    '''
+        Write a copy of a sample-data file with every body-line replicated scale times
+        - The ID fields of the n-th copy are given the suffix "_n", so that the IDs remain unique & consistent across files
+    '''
+    with open(filepath, 'r') as fh:
+        lines = fh.readlines()
+    headerKeys = [ _.strip() for _ in lines[0].strip()[1:].split(',') ]
+    idColumns  = [ n for n, key in enumerate(headerKeys) if key in ID_FIELDS ]
+    body       = [ columnar.tokenize_line(line) for line in lines[1:] if line.strip() != '' ]
+    with open(outpath, 'w') as fh:
+        fh.write(lines[0])
+        for copy in range(scale):
+            for fields in body:
+                fields = list(fields)
+                for n in idColumns:
+                    fields[n] = '%s_%d' % (fields[n], copy)
+                fh.write(" , ".join(fields) + "\n")
+
+def _scale_up_raw_file(filepath, outpath, scale, idColumns):
+    ''' As _scale_up_sample_file, but for the (comma-separated) raw input files'''
+    with open(filepath, 'r') as fh:
+        header = fh.readline()
+        lines  = fh.readlines()
+    with open(outpath, 'w') as fh:
+        fh.write(header)
+        for copy in range(scale):
+            for line in lines:
+                fields = line.split(',')
+                for n in idColumns:
+                    fields[n] = '%s_%d' % (fields[n], copy)
+                fh.write(",".join(fields))
+
+def prepare_inputs(numberString, scale, workDirectory, kind='real'):
+    '''
+        Returns a dictionary of the input filepaths for the given sample size & scale-up factor (missing files are omitted)
+        - For scale > 1, the scaled-up copies are written into workDirectory
+    '''
+    inputs = {}
+    for dataType in ('detections', 'tracklets', 'objects'):
+        inputs[dataType] = sample_filepath(numberString, dataType, kind=kind)
+    inputs['obs']    = raw_filepath(numberString, 'obs')
+    inputs['orbits'] = raw_filepath(numberString, 'orbits')
+    inputs = { k : v for k, v in inputs.items() if os.path.isfile(v) }
+
+    if scale > 1:
+        scaledDirectory = os.path.join(workDirectory, '%s_x%d' % (numberString, scale))
+        os.makedirs(scaledDirectory, exist_ok=True)
+        for dataType, filepath in list(inputs.items()):
+            outpath = os.path.join(scaledDirectory, os.path.basename(filepath))
+            if dataType == 'obs':
+                _scale_up_raw_file(filepath, outpath, scale, idColumns=(0,1,2))
+            elif dataType == 'orbits':
+                _scale_up_raw_file(filepath, outpath, scale, idColumns=(0,))
+            else:
+                _scale_up_sample_file(filepath, outpath, scale)
+            inputs[dataType] = outpath
+    return inputs
+
+
+# ---------------------------------------
+# Stages
+# ---------------------------------------
+# Each stage is a function (inputs, workDirectory) -> timed-function
+# - Any set-up (which is not timed) is done before returning the timed-function
+# - The timed-function returns the number of rows processed
+
+class SkipStage(Exception):
+    ''' Raised by a stage whose inputs (or dependencies) are unavailable'''
+    pass
+
+def _require(inputs, *dataTypes):
+    missing = [ _ for _ in dataTypes if _ not in inputs ]
+    if missing:
+        raise SkipStage('missing input(s) : %s' % ", ".join(missing))
+
+def _import_sample_data_creation():
+    try:
+        import sample_data_creation
+    except ImportError as e:
+        raise SkipStage('sample_data_creation.py could not be imported (%s)' % e)
+    return sample_data_creation
+
+def _neodata():
+    import ingest_demo
+    return ingest_demo.NEODATA()
+
+def stage_read_detections(inputs, workDirectory):
+    _require(inputs, 'detections')
+    N = _neodata()
+    return lambda : len(N.read_detection_data_into_dict(inputs['detections']))
+
+def stage_read_tracklets(inputs, workDirectory):
+    _require(inputs, 'tracklets')
+    N = _neodata()
+    return lambda : len(N.read_tracklet_data_into_dict(inputs['tracklets']))
+
+def stage_read_objects(inputs, workDirectory):
+    _require(inputs, 'objects')
+    N = _neodata()
+    return lambda : len(N.read_object_data_into_dict(inputs['objects']))
+
+def stage_read_detections_columnar(inputs, workDirectory):
+    _require(inputs, 'detections')
+    N = _neodata()
+    return lambda : len(N.read_detections_columnar(inputs['detections']))
+
+def stage_read_tracklets_columnar(inputs, workDirectory):
+    _require(inputs, 'tracklets')
+    N = _neodata()
+    return lambda : len(N.read_tracklets_columnar(inputs['tracklets']))
+
+def stage_check_tracklet_correspondance(inputs, workDirectory):
+    _require(inputs, 'detections', 'tracklets', 'objects')
+    N = _neodata()
+    detDict = N.read_detection_data_into_dict(inputs['detections'])
+    trkDict = N.read_tracklet_data_into_dict(inputs['tracklets'])
+    objDict = N.read_object_data_into_dict(inputs['objects'])
+    def _run():
+        N.check_tracklet_correspondance(detDict, trkDict, objDict)
+        return len(detDict) + len(trkDict) + len(objDict)
+    return _run
+
+def stage_process_orbits(inputs, workDirectory):
+    _require(inputs, 'orbits')
+    sdc = _import_sample_data_creation()
+    dataList = sdc._read_from_file(inputs['orbits'])[1:]
+    def _run():
+        sdc._process_orbits(dataList)
+        return len(dataList)
+    return _run
+
+def stage_process_detections(inputs, workDirectory):
+    _require(inputs, 'obs', 'orbits')
+    sdc = _import_sample_data_creation()
+    headerString, dict_of_Strings_keyed_on_orbitID = sdc._process_orbits( sdc._read_from_file(inputs['orbits'])[1:] )
+    outputDirectory = tempfile.mkdtemp(prefix='process_detections_', dir=workDirectory)
+    def _run():
+        nRows = 0
+        def _counted(lines):
+            nonlocal nRows
+            for line in lines:
+                nRows += 1
+                yield line
+        sdc._process_detections(_counted(sdc._iterate_over_file(inputs['obs'], nSkip=1)), 'benchmark', dict_of_Strings_keyed_on_orbitID, outputDirectory=outputDirectory)
+        return nRows
+    return _run
+
+def stage_tracklet_calculations(inputs, workDirectory):
+    '''
+        Times do_tracklet_calculations_on_contents_of_tracklet_dictionary ...
+        ... on a trkDict rebuilt from the (already processed) detection sample, so that no raw data is needed
+    '''
+    _require(inputs, 'detections')
+    sdc = _import_sample_data_creation()
+    detections = columnar.read_detections_columnar(inputs['detections'])
+    UV = np.column_stack( [detections.columns[key] for key in ('UV_X', 'UV_Y', 'UV_Z')] )
+    trkDict = {}
+    for trkID, timeUTC, uv in zip(detections.columns['trkID'].tolist(), detections.columns['timeUTC'].tolist(), UV):
+        trk = trkDict.setdefault(('', trkID.decode()), { 'timeUTC' : [] , 'UV': [] , 'objectID' : '' })
+        trk['timeUTC'].append(timeUTC)
+        trk['UV'].append(uv)
+    trackletKeys = sorted(data.tracklet_field_definitions.keys())
+    return lambda : len(sdc.do_tracklet_calculations_on_contents_of_tracklet_dictionary(trkDict, trackletKeys))
+
+def stage_build_feature_matrix(inputs, workDirectory):
+    ''' Times FeatureMatrixBuilder.build (reading the csv files & joining them), without the cache'''
+    _require(inputs, 'detections', 'tracklets', 'objects')
+    import feature_matrix
+    builder = feature_matrix.FeatureMatrixBuilder(cacheDirectory=None)
+    return lambda : len(builder.build(inputs['detections'], inputs['tracklets'], inputs['objects']).y)
+
+STAGES = {
+    'process_orbits'                : stage_process_orbits,
+    'process_detections'            : stage_process_detections,
+    'tracklet_calculations'         : stage_tracklet_calculations,
+    'read_detections'               : stage_read_detections,
+    'read_tracklets'                : stage_read_tracklets,
+    'read_objects'                  : stage_read_objects,
+    'read_detections_columnar'      : stage_read_detections_columnar,
+    'read_tracklets_columnar'       : stage_read_tracklets_columnar,
+    'check_tracklet_correspondance' : stage_check_tracklet_correspondance,
+    'build_feature_matrix'          : stage_build_feature_matrix,
+}
+
+
+# ---------------------------------------
+# Running the stages
+# ---------------------------------------
+
+def _peak_rss_MB():
+    ''' Peak resident set size of this process [MB] (N.B. ru_maxrss is in bytes on macOS, but kB on linux)'''
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024.**2 if sys.platform == 'darwin' else maxrss / 1024.
+
+def _run_stage_in_this_process(stageName, inputs, workDirectory, repeat):
+    '''
+        Set up & then time a single stage (repeat times), with the (very verbose) printing of the pipeline suppressed
+        Returns a dictionary of results
+    '''
+    result = { 'stage' : stageName }
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            run = STAGES[stageName](inputs, workDirectory)
+            result['setupRSS_MB'] = _peak_rss_MB()
+            times = []
+            for n in range(repeat):
+                start = time.perf_counter()
+                nRows = run()
+                times.append(time.perf_counter() - start)
+    except SkipStage as e:
+        result.update( { 'status' : 'skipped', 'message' : str(e) } )
+        return result
+    except Exception as e:
+        result.update( { 'status' : 'error', 'message' : '%s: %s' % (type(e).__name__, e) } )
+        return result
+    result.update( { 'status'     : 'ok',
+                     'rows'       : nRows,
+                     'wall_s'     : min(times),
+                     'rows_per_s' : nRows / min(times) if min(times) > 0 else None,
+                     'peakRSS_MB' : _peak_rss_MB() } )
+    return result
+
+def run_stage(stageName, inputs, workDirectory, repeat=1):
+    ''' Run a single stage in a freshly spawned process (so that the peak RSS is not polluted by any previous stage)'''
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_run_stage_in_this_process, stageName, inputs, workDirectory, repeat).result()
+
+
+# ---------------------------------------
+# History
+# ---------------------------------------
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIRECTORY, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def read_history(filepath):
+    if not os.path.isfile(filepath):
+        return []
+    with open(filepath, 'r') as fh:
+        return json.load(fh)
+
+def append_to_history(filepath, run):
+    history = read_history(filepath) + [run]
+    # write-then-rename, so that a crash never leaves a partially written history
+    with open(filepath + '.tmp', 'w') as fh:
+        json.dump(history, fh, indent=1)
+    os.replace(filepath + '.tmp', filepath)
+
+def compare_with_history(history, results, tolerance=1.2):
+    '''
+        Compare each result with the most recent (successful) result in the history for the same stage, size & scale
+        Returns a list of strings describing the regressions (wall time more than tolerance x slower)
+    '''
+    regressions = []
+    for result in results:
+        if result['status'] != 'ok':
+            continue
+        for run in reversed(history):
+            previous = [ r for r in run['results'] if r['status'] == 'ok' and all(r.get(k, 'real') == result.get(k, 'real') for k in ('stage', 'size', 'scale', 'kind')) ]
+            if previous:
+                ratio = result['wall_s'] / previous[0]['wall_s'] if previous[0]['wall_s'] > 0 else 1.
+                if ratio > tolerance:
+                    regressions.append('%s (size=%s, scale=%d) : %.3fs vs %.3fs (x%.2f) at %s' % (result['stage'], result['size'], result['scale'], result['wall_s'], previous[0]['wall_s'], ratio, run['commit']))
+                break
+    return regressions
+
+
+
+def main(argv=None, prog=None):
+    ''' Run the benchmarks, returning the exit status (non-zero if there was a regression)'''
+
+    import argparse
+    parser = argparse.ArgumentParser(prog=prog, description='Benchmark the stages of the neo_ml data pipeline')
+    parser.add_argument('--sizes',     nargs='+', default=['1e4', '1e5', '1e6'], help='Sample sizes (numberStrings) to benchmark')
+    parser.add_argument('--scales',    nargs='+', type=int, default=[1], help='Synthetic scale-up factors (1 => the sample as-is)')
+    parser.add_argument('--stages',    nargs='+', default=list(STAGES), choices=list(STAGES), help='Stages to benchmark')
+    parser.add_argument('--kind',      default='real', choices=['real', 'synthetic'], help='Use the real sample data, or the synthetic data generated by synthetic.py')
+    parser.add_argument('--repeat',    type=int, default=1, help='Number of times to repeat each timing (the minimum is recorded)')
+    parser.add_argument('--history',   default=DEFAULT_HISTORY, help='JSON file to which the results are appended')
+    parser.add_argument('--tolerance', type=float, default=1.2, help='Report a regression if a stage is more than this factor slower than in the history')
+    parser.add_argument('--noRecord',  action='store_true', help='Do not append the results to the history')
+    args = parser.parse_args(argv)
+
+    results = []
+    workDirectory = tempfile.mkdtemp(prefix='neo_ml_benchmark_')
+    try:
+        for numberString in args.sizes:
+            for scale in args.scales:
+                inputs = prepare_inputs(numberString, scale, workDirectory, kind=args.kind)
+                for stageName in args.stages:
+                    result = run_stage(stageName, inputs, workDirectory, repeat=args.repeat)
+                    result.update( { 'size' : numberString, 'scale' : scale, 'kind' : args.kind } )
+                    results.append(result)
+                    if result['status'] == 'ok':
+                        print('%-30s size=%-4s scale=%-3d rows=%10d  wall=%9.3fs  rows/s=%12.1f  peakRSS=%8.1fMB' % (stageName, numberString, scale, result['rows'], result['wall_s'], result['rows_per_s'] or 0., result['peakRSS_MB']), flush=True)
+                    else:
+                        print('%-30s size=%-4s scale=%-3d %s : %s' % (stageName, numberString, scale, result['status'], result['message']), flush=True)
+    finally:
+        shutil.rmtree(workDirectory, ignore_errors=True)
+
+    history = read_history(args.history)
+    regressions = compare_with_history(history, results, tolerance=args.tolerance)
+    for regression in regressions:
+        print('REGRESSION : %s' % regression)
+
+    if not args.noRecord:
+        run = { 'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'commit'    : _git_commit(),
+                'host'      : platform.node(),
+                'python'    : platform.python_version(),
+                'numpy'     : np.__version__,
+                'results'   : results }
+        append_to_history(args.history, run)
+        print('results appended to %s' % args.history)
+
+    # non-zero exit status, so that a regression can fail an automated job
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
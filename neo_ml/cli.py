@@ -0,0 +1,56 @@
+'''
+    Single command-line entry point for the neo_ml drivers
+    Each command is the main() of one of the modules, which is only imported when that command is run ...
+    ... so that (e.g.) "ingest" does not pay for importing the (MPC-internal) modules needed by "build-sample"
+
+    Usage (e.g.) ...
+    python cli.py ingest --numberString 1e4
+    python cli.py build-sample --workers 4 --compression gzip
+    python cli.py <command> --help
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys
+import importlib
+
+
+# command -> (module, description)
+COMMANDS = {
+    'ingest'         : ('ingest_demo',          'read, check & label one of the samples'),
+    'build-sample'   : ('sample_data_creation', 'create the sample data from the raw MPC data'),
+    'synthetic'      : ('synthetic',            'generate a synthetic sample'),
+    'build-features' : ('feature_matrix',       'build (and cache) the feature matrix for one of the samples'),
+    'load-batches'   : ('data_loader',          'write the feature-shards for one of the samples & time the loader'),
+    'benchmark'      : ('benchmark',            'benchmark the stages of the pipeline'),
+    'serve'          : ('scoring_service',      'serve isNEO scores for newly submitted tracklets'),
+}
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def usage(prog='neo-ml'):
+    lines = ['usage: %s <command> [options]' % prog, '', 'commands:']
+    lines.extend( '  %-16s %s' % (command, description) for command, (module, description) in COMMANDS.items() )
+    lines.extend( ['', 'use "%s <command> --help" for the options of each command' % prog] )
+    return "\n".join(lines)
+
+def main(argv=None, prog='neo-ml'):
+    ''' Run the command named by argv[0] (default: sys.argv[1:]), passing it the remaining arguments'''
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage(prog))
+        return 0
+    if argv[0] not in COMMANDS:
+        print('%s: unknown command %r\n\n%s' % (prog, argv[0], usage(prog)), file=sys.stderr)
+        return 2
+    module = importlib.import_module(COMMANDS[argv[0]][0])
+    return module.main(argv[1:], prog='%s %s' % (prog, argv[0]))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
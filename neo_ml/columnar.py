@@ -0,0 +1,351 @@
+'''
+    Columnar (numpy-backed) data structures for ingesting neo data
+    Intended for machine learning class with C. Nugent @ Olin
+
+    The dict-of-dicts approach used in ingest_demo.NEODATA stores every field of every row as a python string
+     - That is fine for the 1e4 sample, but costs gigabytes of memory for the 1e6 sample
+     - Here each field is instead stored as a single typed numpy array (one entry per row)
+     - The required data-types are defined alongside the field definitions in data.py
+
+    A dict-like view (keyed on the same dataKey as NEODATA uses) is provided so that code written for the ...
+    ... dict-of-dicts structures (e.g. NEODATA.check_tracklet_correspondance) continues to work
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import re
+import itertools
+from collections.abc import Mapping
+import numpy as np
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import data
+import output_writer
+
+
+# -----------------------------------
+# Define some useful class(es)
+# -----------------------------------
+
+class RaggedArray():
+    '''
+        Container for variable-length vectors (e.g. vecAngSepn / vecAngRate)
+         - All of the vectors are concatenated into a single flat array of values
+         - The i-th vector is values[ offsets[i] : offsets[i+1] ]
+    '''
+
+    def __init__(self, values, offsets):
+        self.values  = np.asarray(values, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        assert self.offsets.ndim == 1 and len(self.offsets) >= 1, 'offsets must be a 1D array with at least one entry'
+        assert self.offsets[-1] == len(self.values), 'final offset (%d) must equal number of values (%d)' % (self.offsets[-1], len(self.values))
+
+    @classmethod
+    def from_lists(cls, listOfLists):
+        ''' Convenience function to construct a RaggedArray from a list of lists (/arrays) of floats'''
+        lengths = np.array([len(_) for _ in listOfLists], dtype=np.int64)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values  = np.fromiter((v for _ in listOfLists for v in _), dtype=np.float64, count=offsets[-1])
+        return cls(values, offsets)
+
+    @classmethod
+    def concatenate(cls, raggedArrays):
+        ''' Convenience function to join a sequence of RaggedArrays end-to-end'''
+        values  = np.concatenate([r.values for r in raggedArrays])
+        lengths = np.concatenate([r.lengths() for r in raggedArrays])
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(values, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, n):
+        return self.values[self.offsets[n]:self.offsets[n+1]]
+
+    def lengths(self):
+        ''' Number of values in each of the vectors'''
+        return np.diff(self.offsets)
+
+    def take(self, indices):
+        ''' Return a new RaggedArray containing only the vectors at the supplied (integer) indices'''
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.lengths()[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # index of every value to be kept: start-of-vector + position-within-vector
+        starts  = np.repeat(self.offsets[:-1][indices], lengths)
+        within  = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], lengths)
+        return RaggedArray(self.values[starts + within], offsets)
+
+    def tolist(self):
+        ''' The vectors as a list of lists of python floats (as in the dict-of-dicts from NEODATA.read_*_into_dict)'''
+        values, offsets = self.values.tolist(), self.offsets.tolist()
+        return [values[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class ColumnarData(Mapping):
+    '''
+        Container for a table of data (detections, tracklets or objects) stored column-by-column
+         - self.columns is a dictionary of numpy arrays (or RaggedArrays), keyed on field name
+         - All columns have one entry per row
+
+        For backward compatibility with the dict-of-dicts returned by NEODATA.read_*_into_dict ...
+         - ColumnarData behaves like a (read-only) dictionary keyed on dataKey
+         - Each "value" is a dictionary of the fields for that row
+    '''
+
+    def __init__(self, columns, dataKey):
+        assert dataKey in columns, 'dataKey %r not in columns %r' % (dataKey, list(columns))
+        lengths = { key : len(col) for key, col in columns.items() }
+        assert len(set(lengths.values())) == 1, 'columns have differing lengths : %r' % lengths
+        self.columns = columns
+        self.dataKey = dataKey
+        self._index  = None
+
+    def __len__(self):
+        return len(self.columns[self.dataKey])
+
+    def __iter__(self):
+        return iter(self.keys_as_strings())
+
+    def __getitem__(self, key):
+        return self.row(self._get_index()[key])
+
+    def __contains__(self, key):
+        return key in self._get_index()
+
+    def keys_as_strings(self):
+        ''' Convenience function to get the dataKey column as a list of python strings'''
+        return [_.decode() for _ in self.columns[self.dataKey]]
+
+    def _get_index(self):
+        ''' Lazily construct (and then cache) a mapping from dataKey to row-number'''
+        if self._index is None:
+            keys = self.keys_as_strings()
+            self._index = { key : n for n, key in enumerate(keys) }
+            assert len(self._index) == len(keys), 'not all entries in %s are unique' % self.dataKey
+        return self._index
+
+    def row(self, n):
+        ''' Return the n-th row as a dictionary of python values'''
+        d = {}
+        for key, col in self.columns.items():
+            value = col[n]
+            if isinstance(col, RaggedArray):
+                value = value.tolist()
+            elif isinstance(value, bytes):
+                value = value.decode()
+            elif isinstance(value, np.generic):
+                value = value.item()
+            d[key] = value
+        return d
+
+    def select(self, mask):
+        ''' Return a new ColumnarData containing only the rows selected by a boolean mask (or integer indices)'''
+        indices = np.flatnonzero(mask) if np.asarray(mask).dtype == bool else np.asarray(mask, dtype=np.int64)
+        columns = { key : (col.take(indices) if isinstance(col, RaggedArray) else col[indices]) for key, col in self.columns.items() }
+        return ColumnarData(columns, self.dataKey)
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def _find_header_keys(line, fieldDefinitions):
+    '''
+        Convenience function to check whether a '#'-line is the header line for the supplied fieldDefinitions
+        Returns the list of header keys (in the order they appear in the file) or None
+    '''
+    if len([key for key in fieldDefinitions if key in line]) != len(fieldDefinitions):
+        return None
+    headerKeys = [_.strip() for _ in line.strip()[1:].split(",") ]
+    assert len(headerKeys) == len(fieldDefinitions), ' differing lengths ... %r ,  %r' % (headerKeys , fieldDefinitions)
+    assert set(headerKeys) == set(fieldDefinitions), ' differing keys ... %r ,  %r' % (headerKeys , fieldDefinitions)
+    return headerKeys
+
+# a "[ ... ]" region, or a run of characters containing no commas/brackets
+_TOKEN_PATTERN = re.compile(r'\[[^\]]*\]|[^,\[\]]+')
+
+def tokenize_line(line):
+    '''
+        Split a line on commas, keeping the content of any "[ ... ]" regions together as a single field
+         - done in a single (regex) scan of the line
+         - the "[ ... ]" fields are returned including their brackets
+    '''
+    if "[" not in line:
+        return [_.strip() for _ in line.split(",") ]
+    # N.B. the whitespace-only runs between a "]" and the following comma are dropped
+    return [_ for _ in map(str.strip, _TOKEN_PATTERN.findall(line)) if _ != '']
+
+def _parse_ragged(strings):
+    '''
+        Convert a list of strings like "1.0, 2.0" (i.e. the contents of "[ ... ]") into a RaggedArray
+         - the offsets are calculated first, so that all of the values can be parsed into a single preallocated array
+    '''
+    stripped = list(map(str.strip, strings))
+    lengths  = np.fromiter(map(str.count, stripped, itertools.repeat(',')), dtype=np.int64, count=len(stripped)) + 1
+    lengths[ np.fromiter(map(len, stripped), dtype=np.int64, count=len(stripped)) == 0 ] = 0
+    offsets  = np.zeros(len(stripped) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values   = np.fromiter(map(float, ",".join(filter(None, stripped)).split(",")), dtype=np.float64, count=offsets[-1]) if offsets[-1] else np.array([], dtype=np.float64)
+    return RaggedArray(values, offsets)
+
+def convert_column(strings, dtype):
+    '''
+        Convert a list of strings into a typed numpy array
+         - "None" entries are replaced by the missing value defined in data.missing_values
+    '''
+    if dtype == 'ragged':
+        return _parse_ragged(strings)
+    if len(strings) == 0:
+        return np.array([], dtype=dtype)
+    if dtype == 'S':
+        return np.char.strip(np.array(strings, dtype='S'))
+    if dtype == 'bool':
+        return np.char.strip(np.array(strings)) == 'True'
+    try:
+        # N.B. float() ignores any surrounding whitespace
+        return np.fromiter(map(float, strings), dtype=dtype, count=len(strings))
+    except ValueError:
+        arr = np.char.strip(np.array(strings))
+        missing = arr == 'None'
+        arr[missing] = '0'
+        col = np.fromiter(map(float, arr.tolist()), dtype=dtype, count=len(arr))
+        col[missing] = data.missing_values[dtype]
+        return col
+
+def _split_block(lines, headerKeys, fieldDtypes, filepath):
+    '''
+        Split a block of body-lines into a list of string-columns (one list per header key)
+         - If there are no ragged ("[ ... ]") fields, the whole block is split in a single call ...
+         - ... and each column is then just a strided slice of the resulting list of tokens
+         - Otherwise the block is first split on the "[ ... ]" brackets (again in a single call), and then as above
+        Ragged fields are returned without their enclosing "[ ... ]"
+    '''
+    nFields = len(headerKeys)
+    isRagged = [fieldDtypes[key] == 'ragged' for key in headerKeys]
+    if not any(isRagged):
+        tokens = ",".join(lines).split(",")
+        if len(tokens) == nFields * len(lines):
+            return [ tokens[n::nFields] for n in range(nFields) ]
+    else:
+        # split the whole block on the brackets: the "[ ... ]" contents are then the odd-numbered pieces ...
+        # ... and the even-numbered pieces (joined) are the lines with the ragged fields emptied
+        nRagged = sum(isRagged)
+        pieces  = "".join(line if line.endswith("\n") else line + "\n" for line in lines).replace("]", "[").split("[")
+        if len(pieces) == 2 * nRagged * len(lines) + 1:
+            tokens = ",".join("".join(pieces[0::2]).splitlines()).split(",")
+            if len(tokens) == nFields * len(lines):
+                inner   = pieces[1::2]
+                strings = []
+                for n, ragged in enumerate(isRagged):
+                    if ragged:
+                        # check that this field really was a "[ ... ]" on every line
+                        assert "".join(tokens[n::nFields]).strip() == '', 'misplaced "[ ... ]" field(s) in block reading from %s' % filepath
+                        strings.append( inner[sum(isRagged[:n])::nRagged] )
+                    else:
+                        strings.append( tokens[n::nFields] )
+                return strings
+    # Fall through to the line-by-line split to identify the offending line
+
+    strings = [ [] for key in headerKeys ]
+    for line in lines:
+        lineSplit = tokenize_line(line)
+        assert len(lineSplit) == nFields, 'incorrect number of fields (%d != %d) in line %r reading from %s' % (len(lineSplit), nFields, line, filepath)
+        for col, value, ragged in zip(strings, lineSplit, isRagged):
+            col.append(value.strip()[1:-1] if ragged else value)
+    return strings
+
+def parse_lines(lines, headerKeys, fieldDtypes, filepath=''):
+    '''
+        Convert a list of body-lines (in the format written by sample_data_creation.py) into typed columns
+        Returns a dictionary of numpy arrays (or RaggedArrays), keyed on the headerKeys
+    '''
+    strings = _split_block(lines, headerKeys, fieldDtypes, filepath)
+    return { key : convert_column(col, fieldDtypes[key]) for key, col in zip(headerKeys, strings) }
+
+def concatenate_chunks(chunks, dtype):
+    if dtype == 'ragged':
+        return RaggedArray.concatenate(chunks)
+    if not chunks:
+        return np.array([], dtype=dtype)
+    return np.concatenate(chunks)
+
+def iterate_over_blocks(filepath, fieldDefinitions, fieldDtypes, chunkSize=100000):
+    '''
+        Read one of the sample-data files in blocks of (approximately) chunkSize body-lines
+        (i) find the header line & check that it matches the fieldDefinitions
+        (ii) split each block into columns of strings (see _split_block)
+        Yields (headerKeys, strings) : strings is a list of string-columns, in the order of headerKeys
+         - at least one (possibly empty) block is yielded, so that a file with no body-lines still has its headerKeys
+        The file may be compressed (see output_writer.open_text)
+    '''
+    assert os.path.isfile(filepath), 'filepath could not be found : %r ' % filepath
+    assert set(fieldDtypes) == set(fieldDefinitions), 'fieldDtypes do not match fieldDefinitions'
+
+    headerKeys = None
+    nBlocks    = 0
+
+    with output_writer.open_text(filepath) as fh:
+        # N.B. readlines(hint) returns whole lines totalling ~hint characters: use the first line to estimate the line-length
+        # (the first line is then kept, rather than seeking back to it, as compressed files cannot be seeked cheaply)
+        firstLine  = fh.readline()
+        lineLength = max(len(firstLine), 1)
+        while True:
+            lines = fh.readlines(chunkSize * lineLength)
+            if firstLine:
+                lines, firstLine = [firstLine] + lines, ''
+            if not lines:
+                break
+
+            # header line(s)
+            for line in [line for line in lines if line.lstrip()[:1] == '#']:
+                if headerKeys is None:
+                    headerKeys = _find_header_keys(line.strip(), fieldDefinitions)
+
+            # body line(s)
+            block = [line for line in lines if line.lstrip()[:1] not in ('#', '')]
+            if block:
+                assert headerKeys is not None, 'could not find correct header line (before body) in ... \n \t %r ' % fieldDefinitions
+                nBlocks += 1
+                yield headerKeys, _split_block(block, headerKeys, fieldDtypes, filepath)
+
+    assert headerKeys is not None, 'could not find correct header line in ... \n \t %r ' % fieldDefinitions
+    if nBlocks == 0:
+        yield headerKeys, [ [] for key in headerKeys ]
+
+def read_columnar(filepath, fieldDefinitions, fieldDtypes, dataKey, chunkSize=100000):
+    '''
+        Read one of the sample-data files into a ColumnarData object
+         - the file is read in blocks of (approximately) chunkSize lines (see iterate_over_blocks) ...
+         - ... & each block is converted into typed numpy arrays
+         - this keeps the number of python strings in memory at any one time bounded by ~chunkSize
+    '''
+    chunks = None
+    for headerKeys, strings in iterate_over_blocks(filepath, fieldDefinitions, fieldDtypes, chunkSize=chunkSize):
+        if chunks is None:
+            chunks = { key : [] for key in headerKeys }
+        for key, col in zip(headerKeys, strings):
+            chunks[key].append( convert_column(col, fieldDtypes[key]) )
+
+    columns = { key : concatenate_chunks(chunks[key], fieldDtypes[key]) for key in headerKeys }
+    return ColumnarData(columns, dataKey)
+
+def read_detections_columnar(filepath, chunkSize=100000):
+    ''' Read detection-data into a ColumnarData object: keyed on detID'''
+    return read_columnar(filepath, data.detection_field_definitions, data.detection_field_dtypes, 'detID', chunkSize=chunkSize)
+
+def read_tracklets_columnar(filepath, chunkSize=100000):
+    ''' Read tracklet-data into a ColumnarData object: keyed on trkID'''
+    return read_columnar(filepath, data.tracklet_field_definitions, data.tracklet_field_dtypes, 'trkID', chunkSize=chunkSize)
+
+def read_objects_columnar(filepath, chunkSize=100000):
+    ''' Read object-data into a ColumnarData object: keyed on objectID'''
+    return read_columnar(filepath, data.object_field_definitions, data.object_field_dtypes, 'objectID', chunkSize=chunkSize)
@@ -42,7 +42,7 @@ tracklet_field_definitions = {
     'vecAngSepn'    : 'Vector of angular separations between adjacent observations [radians]',
     'vecAngRate'    : 'Vector of angular rates between adjacent observations [radians / s]',
     'meanAngRate'   : 'Mean angular rate for the entire tracklet [radians / s]',
-    'rms'           : 'RMS deviation from best-fit straight line',
+    'rms'           : 'RMS deviation from best-fit straight line (constant angular velocity) [radians]',
 }
 object_field_definitions = {
     'objectID'      : 'Unique Object ID',
@@ -55,3 +55,72 @@ object_field_definitions = {
     'orbit_LAN'	    : 'Nominal/best-fit Keplerian orbit for the object: long. asc. node [rad]',
     'orbit_TP'      : 'Nominal/best-fit Keplerian orbit for the object: time peri. pass [JDUTC]',
 }
+
+# The integer values of objectType (as assigned by orbit_classification.classify_orbits)
+# - a = semi-major axis, q = perihelion distance, Q = aphelion distance [au], e = eccentricity, i = inclination, T_J = Tisserand parameter w.r.t. Jupiter
+# - the classes are tested in the order listed : the first that matches is assigned
+object_type_definitions = {
+    -1              : 'Unknown    : orbit missing / could not be classified',
+    0               : 'Hyperbolic : e >= 1',
+    1               : 'Atira      : NEO with a < 1.0 & Q < 0.983',
+    2               : 'Aten       : NEO with a < 1.0 & Q >= 0.983',
+    3               : 'Apollo     : NEO with a >= 1.0 & q < 1.017',
+    4               : 'Amor       : NEO with a >= 1.0 & 1.017 <= q < 1.3',
+    5               : 'Hungaria   : 1.78 <= a < 2.0, e < 0.18, 16 <= i < 34 [deg]',
+    6               : 'Mars-crosser : 1.3 <= q < 1.666 & a < 3.2',
+    7               : 'MBA        : Main-belt, 1.78 <= a < 3.3',
+    8               : 'Hilda      : 3.7 <= a < 4.2, e < 0.3, i < 20 [deg]',
+    9               : 'Trojan     : Jupiter Trojan, 5.05 <= a < 5.35, e < 0.25',
+    10              : 'JFC-like   : 2 <= T_J < 3, a < 5.5 (comet-like orbit)',
+    11              : 'Centaur    : 5.5 <= a < 30.1',
+    12              : 'TNO        : a >= 30.1',
+    13              : 'Other      : none of the above',
+}
+
+
+# -----------------------------------
+# Define column data-types for neo_ml
+# -----------------------------------
+# N.B. An unsized 'S' will be sized to the longest entry in the column at read-time
+# N.B. 'ragged' denotes a variable-length vector, stored as a flat array of values + an array of offsets
+detection_field_dtypes = {
+    'detID'         : 'S',
+    'trkID'         : 'S',
+    'timeUTC'       : 'float64',
+    'Obs_X'         : 'float64',
+    'Obs_Y'         : 'float64',
+    'Obs_Z'         : 'float64',
+    'UV_X'          : 'float64',
+    'UV_Y'          : 'float64',
+    'UV_Z'          : 'float64',
+    'Vmag'          : 'float64',
+    'obsCode'       : 'S',
+    'eclipticLat'   : 'float64',
+    'solarElong'    : 'float64',
+}
+tracklet_field_dtypes = {
+    'trkID'         : 'S',
+    'objectID'      : 'S',
+    'vecAngSepn'    : 'ragged',
+    'vecAngRate'    : 'ragged',
+    'meanAngRate'   : 'float64',
+    'rms'           : 'float64',
+}
+object_field_dtypes = {
+    'objectID'      : 'S',
+    'isNEO'         : 'bool',
+    'objectType'    : 'int8',
+    'orbit_q'       : 'float64',
+    'orbit_e'       : 'float64',
+    'orbit_i'       : 'float64',
+    'orbit_AP'      : 'float64',
+    'orbit_LAN'     : 'float64',
+    'orbit_TP'      : 'float64',
+}
+
+# Values used to represent a missing entry (written as "None" in the csv files) in a typed column
+missing_values = {
+    'float64'       : np.nan,
+    'int8'          : -1,
+    'bool'          : False,
+}
@@ -0,0 +1,362 @@
+'''
+    Mini-batch data loader for training on the tracklet data
+    Intended for machine learning class with C. Nugent @ Olin
+
+    Training on 1e6+ tracklets should not need the whole of the data (let alone the dict-of-dicts from NEODATA) in memory ...
+    ... so the feature matrix (see feature_matrix.py) is written as a set of "shards" ...
+     - each shard is a binary dataset (see storage.py) holding the trkID, isNEO & X columns for a contiguous range of tracklets
+     - shards.json records the shards (in order), the number of rows in each, & the featureNames
+    ... which are memory-mapped by the loader, so that only the rows of the current batches are ever read from disk
+
+    Sampling
+     - block-shuffled : the rows are split into contiguous blocks (blockSize rows), the blocks are visited in a random order ...
+       ... and the rows from several blocks (shuffleBufferBlocks) are shuffled together before being cut into batches
+       => sequential reads from disk, but (close to) randomly ordered batches
+     - stratified     : NEOs are a tiny minority of the objects, so (with stratify=True) every batch contains the same ...
+       ... fraction of NEOs (neoFraction: by default, the fraction in the whole data set)
+       - an epoch is one pass over the non-NEOs : the NEOs are re-shuffled & re-used as needed (i.e. over-sampled if neoFraction is increased)
+     - the batches are assembled on a background thread, & up to prefetch batches are queued ahead of the training loop
+
+    The throughput of each epoch (rows/s, & the time the training loop spent waiting for data) is recorded in epochStats
+
+    Usage (e.g.) ...
+    write_feature_shards( feature_matrix.FeatureMatrixBuilder().build_for_sample('1e5'), 'shards_1e5' )
+    loader = MiniBatchLoader('shards_1e5', batchSize=1024, seed=1)
+    for epoch in range(10):
+        for batch in loader:
+            train(batch.X, batch.y)
+        print(loader.epochStats[-1])
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import json
+import time
+import queue
+import shutil
+import threading
+from collections import namedtuple
+import numpy as np
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import columnar
+import storage
+
+
+MANIFEST_FILENAME = 'shards.json'
+MANIFEST_VERSION  = 1
+
+Batch = namedtuple('Batch', [
+    'X',                # float32 array, shape (batchSize, nFeatures)
+    'y',                # bool array, shape (batchSize,) : isNEO
+    'indices',          # (global) row-numbers of the rows in the batch
+])
+
+EpochStats = namedtuple('EpochStats', [
+    'epoch',            # epoch number (starting from 0)
+    'nBatches',         # number of batches
+    'nRows',            # number of rows (summed over all of the batches)
+    'seconds',          # wall-time for the epoch (including the time spent by the training loop)
+    'rowsPerSecond',    # nRows / seconds
+    'waitSeconds',      # time the training loop spent waiting for batches : ~seconds => the training is I/O-bound
+])
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def write_feature_shards(featureMatrix, directory, shardSize=2**17):
+    '''
+        Write a FeatureMatrix (see feature_matrix.py) into a directory of shards, each of (up to) shardSize rows
+         - the shards are written into a temporary directory, which then replaces any existing directory
+    '''
+    assert shardSize > 0, 'shardSize must be positive'
+    tmpDirectory = directory.rstrip(os.sep) + '.tmp'
+    if os.path.isdir(tmpDirectory):
+        shutil.rmtree(tmpDirectory)
+    os.makedirs(tmpDirectory)
+
+    shards = []
+    for n, start in enumerate(range(0, len(featureMatrix.y), shardSize)):
+        name    = 'shard_%05d.npy.d' % n
+        columns = { 'trkID' : featureMatrix.trkIDs[start:start + shardSize],
+                    'isNEO' : featureMatrix.y[start:start + shardSize],
+                    'X'     : featureMatrix.X[start:start + shardSize] }
+        storage.write_columnar(os.path.join(tmpDirectory, name), columnar.ColumnarData(columns, 'trkID'))
+        shards.append( { 'name' : name, 'nRows' : len(columns['isNEO']) } )
+
+    manifest = { 'version'      : MANIFEST_VERSION,
+                 'featureNames' : list(featureMatrix.featureNames),
+                 'nRows'        : len(featureMatrix.y),
+                 'shards'       : shards }
+    with open(os.path.join(tmpDirectory, MANIFEST_FILENAME), 'w') as fh:
+        json.dump(manifest, fh, indent=1)
+
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.replace(tmpDirectory, directory)
+    return directory
+
+def read_manifest(directory):
+    filepath = os.path.join(directory, MANIFEST_FILENAME)
+    assert os.path.isfile(filepath), 'shard manifest could not be found : %r ' % filepath
+    with open(filepath, 'r') as fh:
+        manifest = json.load(fh)
+    assert manifest['version'] == MANIFEST_VERSION, 'unsupported shard manifest version %r in %s' % (manifest['version'], directory)
+    return manifest
+
+
+# -----------------------------------
+# Define some useful class(es)
+# -----------------------------------
+
+class _Failure():
+    ''' Wrapper used to pass an exception from the background thread to the training loop'''
+    def __init__(self, exception):
+        self.exception = exception
+
+_END_OF_EPOCH = object()
+
+
+class MiniBatchLoader():
+    '''
+        Iterate over (block-shuffled, stratified) mini-batches of a directory of shards (see write_feature_shards)
+        Each iteration over the loader is one epoch, yielding Batch objects
+
+        batchSize           : number of rows per batch
+        shuffle             : visit the blocks (& the rows within the shuffle-buffer) in a random order
+        blockSize           : number of contiguous rows read from disk at a time
+        shuffleBufferBlocks : number of blocks whose rows are shuffled together
+        stratify            : give every batch the same fraction of NEOs
+        neoFraction         : the fraction of NEOs per batch (stratify=True only). None => the fraction in the whole data set
+        prefetch            : number of batches queued ahead by the background thread (0 => no background thread)
+        dropLast            : drop the final (short) batch of each epoch
+        seed                : seed for the random number generator
+    '''
+
+    def __init__(self, directory, batchSize=1024, shuffle=True, blockSize=4096, shuffleBufferBlocks=8,
+                       stratify=True, neoFraction=None, prefetch=4, dropLast=False, seed=None):
+        assert batchSize > 0 and blockSize > 0 and shuffleBufferBlocks > 0 and prefetch >= 0, 'sizes must be positive'
+        manifest            = read_manifest(directory)
+        self.featureNames   = manifest['featureNames']
+        self.shards         = [ storage.read_columnar(os.path.join(directory, _['name']), mmap=True) for _ in manifest['shards'] ]
+        self.shardOffsets   = np.zeros(len(self.shards) + 1, dtype=np.int64)
+        np.cumsum([ len(_) for _ in self.shards ], out=self.shardOffsets[1:])
+        self.nRows          = int(self.shardOffsets[-1])
+
+        self.batchSize      = int(batchSize)
+        self.shuffle        = shuffle
+        self.shuffleBufferBlocks = int(shuffleBufferBlocks)
+        self.stratify       = stratify
+        self.prefetch       = int(prefetch)
+        self.dropLast       = dropLast
+        self.rng            = np.random.default_rng(seed)
+        self.epochStats     = []
+
+        # contiguous blocks of rows : (shard, start, stop), never straddling two shards
+        self.blocks = [ (s, start, min(start + blockSize, len(shard))) for s, shard in enumerate(self.shards) for start in range(0, len(shard), blockSize) ]
+
+        # the (few) NEOs are located up-front, so that they can be sampled separately
+        if self.stratify:
+            self.neoIndices  = np.concatenate( [np.flatnonzero(shard.columns['isNEO']) + offset for shard, offset in zip(self.shards, self.shardOffsets[:-1])] + [np.array([], dtype=np.int64)] )
+            naturalFraction  = len(self.neoIndices) / max(self.nRows, 1)
+            self.neoFraction = naturalFraction if neoFraction is None else float(neoFraction)
+            assert 0. <= self.neoFraction < 1., 'neoFraction must be in [0, 1)'
+            assert len(self.neoIndices) > 0 or self.neoFraction == 0., 'no NEOs to sample from'
+        else:
+            self.neoIndices  = np.array([], dtype=np.int64)
+            self.neoFraction = 0.
+
+    def __len__(self):
+        ''' Number of batches per epoch'''
+        nRows = (self.nRows - len(self.neoIndices)) / (1. - self.neoFraction)
+        return int(nRows // self.batchSize) if self.dropLast else int(np.ceil(nRows / self.batchSize))
+
+    def __iter__(self):
+        ''' One epoch of batches'''
+        batches = self._generate_batches()
+        if self.prefetch > 0:
+            batches = self._prefetched(batches)
+        return self._timed(batches)
+
+    # ---- Reading ------------
+
+    def _read_block(self, block):
+        s, start, stop = block
+        columns = self.shards[s].columns
+        return np.array(columns['X'][start:stop]), np.array(columns['isNEO'][start:stop]), np.arange(start, stop) + self.shardOffsets[s]
+
+    def _read_rows(self, indices):
+        ''' Read arbitrary rows (given their global row-numbers) : sorted, & grouped by shard, for locality'''
+        indices = np.sort(indices)
+        X = np.empty((len(indices), len(self.featureNames)), dtype=np.float32)
+        y = np.empty(len(indices), dtype=bool)
+        bounds = np.searchsorted(indices, self.shardOffsets)
+        for s, shard in enumerate(self.shards):
+            lo, hi = bounds[s], bounds[s + 1]
+            if hi > lo:
+                local = indices[lo:hi] - self.shardOffsets[s]
+                X[lo:hi] = shard.columns['X'][local]
+                y[lo:hi] = shard.columns['isNEO'][local]
+        return X, y, indices
+
+    # ---- Sampling ------------
+
+    def _neo_count(self, nBatch):
+        ''' Number of NEOs in the nBatch-th batch : the cumulative number tracks neoFraction * batchSize as closely as possible'''
+        cumulative = lambda n : int(np.floor( n * self.batchSize * self.neoFraction + 1e-9 ))
+        return cumulative(nBatch + 1) - cumulative(nBatch)
+
+    def _draw_neos(self, n, state):
+        ''' The next n NEOs from a shuffled (& when exhausted, re-shuffled) sequence of the NEOs'''
+        drawn = []
+        while n > 0:
+            if state['position'] >= len(state['order']):
+                state['order'], state['position'] = (self.rng.permutation(self.neoIndices) if self.shuffle else self.neoIndices), 0
+            take = state['order'][ state['position'] : state['position'] + n ]
+            state['position'] += len(take)
+            drawn.append(take)
+            n -= len(take)
+        return np.concatenate(drawn) if drawn else np.array([], dtype=np.int64)
+
+    def _generate_batches(self):
+        ''' Generate the Batches for one epoch (this is what runs on the background thread)'''
+        blockOrder = self.rng.permutation(len(self.blocks)) if self.shuffle else np.arange(len(self.blocks))
+        neoState   = { 'order' : np.array([], dtype=np.int64), 'position' : 0 }
+        pending    = None
+        nBatch     = 0
+
+        for start in range(0, len(blockOrder), self.shuffleBufferBlocks):
+            # fill the shuffle-buffer (with only the non-NEOs, if stratifying)
+            X, y, indices = [ np.concatenate(_) for _ in zip(*[ self._read_block(self.blocks[b]) for b in blockOrder[start:start + self.shuffleBufferBlocks] ]) ]
+            if self.stratify:
+                X, y, indices = X[~y], y[~y], indices[~y]
+            if self.shuffle:
+                permutation = self.rng.permutation(len(y))
+                X, y, indices = X[permutation], y[permutation], indices[permutation]
+            if pending is not None:
+                X, y, indices = [ np.concatenate(_) for _ in zip(pending, (X, y, indices)) ]
+
+            # cut into batches, carrying the remainder forward
+            position = 0
+            while len(y) - position >= self.batchSize - self._neo_count(nBatch):
+                nNEO   = self._neo_count(nBatch)
+                nOther = self.batchSize - nNEO
+                yield self._assemble( (X[position:position + nOther], y[position:position + nOther], indices[position:position + nOther]), nNEO, neoState )
+                position += nOther
+                nBatch   += 1
+            pending = (X[position:], y[position:], indices[position:])
+
+        # final (short) batch
+        if pending is not None and len(pending[1]) and not self.dropLast:
+            nNEO = int(round( len(pending[1]) * self.neoFraction / (1. - self.neoFraction) ))
+            yield self._assemble(pending, nNEO, neoState)
+
+    def _assemble(self, others, nNEO, neoState):
+        ''' Combine a set of (non-NEO) rows with nNEO NEOs into a Batch (in a random order)'''
+        X, y, indices = others
+        if nNEO > 0:
+            X, y, indices = [ np.concatenate(_) for _ in zip(others, self._read_rows(self._draw_neos(nNEO, neoState))) ]
+            if self.shuffle:
+                permutation = self.rng.permutation(len(y))
+                X, y, indices = X[permutation], y[permutation], indices[permutation]
+        return Batch(X, y, indices)
+
+    # ---- Prefetching & timing ------------
+
+    def _prefetched(self, batches):
+        ''' Run the batch-generator on a background thread, queueing up to self.prefetch batches ahead'''
+        q    = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def _put(item):
+            # N.B. times out periodically, so that the thread can exit if the training loop stops early
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def _worker():
+            try:
+                for batch in batches:
+                    if not _put(batch):
+                        return
+                _put(_END_OF_EPOCH)
+            except BaseException as e:
+                _put(_Failure(e))
+
+        thread = threading.Thread(target=_worker, name='MiniBatchLoader-prefetch', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = q.get()
+                if item is _END_OF_EPOCH:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exception
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+    def _timed(self, batches):
+        ''' Pass the batches through, recording the throughput of the epoch in self.epochStats'''
+        nBatches, nRows, waitSeconds = 0, 0, 0.
+        start = time.perf_counter()
+        try:
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    batch = next(batches)
+                except StopIteration:
+                    break
+                finally:
+                    waitSeconds += time.perf_counter() - t0
+                nBatches += 1
+                nRows    += len(batch.y)
+                yield batch
+        finally:
+            # (also stops the background thread, if the training loop leaves the epoch early)
+            batches.close()
+        seconds = time.perf_counter() - start
+        self.epochStats.append( EpochStats(len(self.epochStats), nBatches, nRows, seconds, nRows / seconds if seconds > 0 else float('nan'), waitSeconds) )
+
+
+
+def main(argv=None, prog=None):
+    ''' Write the feature-shards for one of the samples, & report the throughput of the loader'''
+
+    import argparse
+    import feature_matrix
+    parser = argparse.ArgumentParser(prog=prog, description='Write the feature-shards for one of the samples, & report the throughput of the loader')
+    parser.add_argument('numberString', help='Sample size (e.g. 1e4)')
+    parser.add_argument('--kind',      default='real', choices=['real', 'synthetic'])
+    parser.add_argument('--directory', default=None, help='Directory for the shards (default: sample_data/feature_shards_<numberString>_<kind>)')
+    parser.add_argument('--shardSize', type=int, default=2**17)
+    parser.add_argument('--batchSize', type=int, default=1024)
+    parser.add_argument('--epochs',    type=int, default=3)
+    parser.add_argument('--noStratify',action='store_true')
+    parser.add_argument('--prefetch',  type=int, default=4)
+    args = parser.parse_args(argv)
+
+    directory = args.directory or os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data', 'feature_shards_%s_%s' % (args.numberString, args.kind) )
+    write_feature_shards( feature_matrix.FeatureMatrixBuilder().build_for_sample(args.numberString, kind=args.kind), directory, shardSize=args.shardSize )
+
+    loader = MiniBatchLoader(directory, batchSize=args.batchSize, stratify=not args.noStratify, prefetch=args.prefetch, seed=0)
+    for epoch in range(args.epochs):
+        nNEO = sum( int(batch.y.sum()) for batch in loader )
+        stats = loader.epochStats[-1]
+        print('epoch %d : %d batches, %d rows (%d NEOs) in %.3fs => %.1f rows/s (waited %.3fs)' % (stats.epoch, stats.nBatches, stats.nRows, nNEO, stats.seconds, stats.rowsPerSecond, stats.waitSeconds))
+
+
+if __name__ == '__main__':
+    main()
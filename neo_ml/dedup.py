@@ -0,0 +1,204 @@
+'''
+    Streaming detection of duplicate observations
+    Intended for use by sample_data_creation.py, to collapse duplicate detections (& tracklets) as the sample data is created
+
+    The MPC obs-table contains duplicates (e.g. see the notes at the end of sample_data_creation.py) ...
+     - exact duplicates  : the same detID appears more than once (e.g. a tracklet that is linked to more than one orbitID)
+     - near duplicates   : the same observation, submitted more than once (with a different detID) ...
+                           ... i.e. the same obsCode, & (to within the tolerances) the same time & position
+    The first occurrence (in input order) of each detection is kept, & the later ones are reported as duplicates
+     - a tracklet all of whose detections are duplicates is itself a duplicate (of the tracklet(s) in which they were first seen)
+
+    The duplicates are found in two steps, so that the result does not depend on how the input is split up (into shards or blocks)
+     - DuplicateIndex.find : a single, sequential pass over the keys of all of the detections (see DuplicateIndex.keys) ...
+       ... which can be calculated in parallel, as they only depend on each detection
+     - DuplicateFilter     : removes the duplicates so found, as the detections are processed (in any number of shards)
+
+    The index holds a 64-bit hash of each key (so uses ~120 bytes per detection, regardless of the length of the IDs) ...
+     - the keys of near duplicates are the (obsCode, time, unit-vector) rounded to the tolerances ...
+       ... N.B. so two detections that straddle the edge of a rounding-cell are not collapsed
+     - a (64-bit) hash collision would remove a detection in error, but is astronomically unlikely for the 1e6-1e8 detections of the samples
+
+    Usage (e.g.) ...
+    index   = dedup.DuplicateIndex()
+    reasons = index.find( *index.keys(detIDs, obsCodes, timeUTC, UV) )
+    ...
+    duplicateFilter = dedup.DuplicateFilter( dedup.reasons_by_tracklet(reasons, trackletKeys, trackletSizes) )
+    isDuplicate = duplicateFilter.filter(detIDs, trkIDs, orbitIDs, obsCodes, timeUTC)
+    duplicateFilter.removed, duplicateFilter.summary()
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+from collections import namedtuple
+import numpy as np
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import joins
+import instrumentation
+
+
+# Default tolerances for near duplicates
+TIME_TOLERANCE  = 1e-5      # [days] (~1 s)
+ANGLE_TOLERANCE = 2.5e-6    # [radians] (~0.5 arcsec)
+
+# Reasons for removing a row
+DUPLICATE_DETID     = 'duplicate_detID'
+NEAR_DUPLICATE      = 'near_duplicate'
+DUPLICATE_TRACKLET  = 'duplicate_tracklet'
+
+# Fields of the report of removed rows (see report_lines)
+REPORT_KEYS = ['reason', 'detID', 'trkID', 'orbitID', 'obsCode', 'timeUTC']
+
+RemovedRow = namedtuple('RemovedRow', REPORT_KEYS)
+
+
+# -----------------------------------
+# Define some useful class(es)
+# -----------------------------------
+
+class DuplicateIndex():
+    '''
+        Index of the detections seen so far, used to identify the duplicates amongst the detections that follow
+        timeTolerance  : [days]
+        angleTolerance : [radians]
+    '''
+
+    def __init__(self, timeTolerance=TIME_TOLERANCE, angleTolerance=ANGLE_TOLERANCE):
+        assert timeTolerance > 0 and angleTolerance > 0, 'the tolerances must be positive'
+        self.timeTolerance  = float(timeTolerance)
+        self.angleTolerance = float(angleTolerance)
+        self._detIDs        = set()
+        self._positions     = set()
+
+    def __len__(self):
+        ''' Number of (unique) detections in the index'''
+        return len(self._detIDs)
+
+    def position_hashes(self, obsCodes, timeUTC, UV):
+        ''' 64-bit hash of the (obsCode, time, unit-vector) of each detection, rounded to the tolerances'''
+        obsCodes = np.asarray(obsCodes, dtype='U')
+        words = np.empty((len(obsCodes), 5), dtype=np.int64)
+        words[:,0]  = joins.hash_keys(obsCodes, joins._hash_width(obsCodes)).view(np.int64)
+        words[:,1]  = np.round( np.asarray(timeUTC, dtype=np.float64) / self.timeTolerance )
+        words[:,2:] = np.round( np.asarray(UV, dtype=np.float64).reshape(-1,3) / self.angleTolerance )
+        return joins.hash_words(words)
+
+    def keys(self, detIDs, obsCodes, timeUTC, UV):
+        '''
+            The keys of a batch of detections : the hashes of their detIDs & of their positions (see position_hashes) ...
+            ... & a boolean mask of the detections with a finite time & UV (the others are only checked on their detID)
+            N.B. the keys only depend on each detection (not on the index), so can be calculated in parallel
+        '''
+        N = len(detIDs)
+        timeUTC = np.asarray(timeUTC, dtype=np.float64)
+        UV      = np.asarray(UV, dtype=np.float64).reshape(-1,3)
+        valid   = np.isfinite(timeUTC) & np.isfinite(UV).all(axis=1)
+        keys      = np.asarray(detIDs, dtype='U')
+        idHashes  = joins.hash_keys(keys, joins._hash_width(keys)) if N else np.zeros(0, dtype=np.uint64)
+        posHashes = np.zeros(N, dtype=np.uint64)
+        if valid.any():
+            posHashes[valid] = self.position_hashes(np.asarray(obsCodes)[valid], timeUTC[valid], UV[valid])
+        return idHashes, posHashes, valid
+
+    def find(self, idHashes, posHashes, valid):
+        '''
+            Identify the duplicates amongst a batch of detections (from their keys), & add the others to the index
+             - the detections are checked in order, so a duplicate of an earlier detection in the same batch is also found
+            Returns a list of the reason for removing each detection (None for the detections that are not duplicates)
+        '''
+        idHashes, posHashes, valid = np.asarray(idHashes).tolist(), np.asarray(posHashes).tolist(), np.asarray(valid).tolist()
+        reasons = [None] * len(idHashes)
+        seenIDs, seenPositions = self._detIDs, self._positions
+        for n in range(len(idHashes)):
+            if idHashes[n] in seenIDs:
+                reasons[n] = DUPLICATE_DETID
+            elif valid[n] and posHashes[n] in seenPositions:
+                reasons[n] = NEAR_DUPLICATE
+                seenIDs.add(idHashes[n])
+            else:
+                seenIDs.add(idHashes[n])
+                if valid[n]:
+                    seenPositions.add(posHashes[n])
+        return reasons
+
+
+class DuplicateFilter():
+    '''
+        Removes the duplicates found (beforehand) by DuplicateIndex.find, as the detections are processed
+         - reasons : dictionary, keyed on the (orbitID, trkID) of each tracklet with any duplicates (see reasons_by_tracklet) ...
+                     ... of the list of the reasons for removing each of its detections, in order (None => not a duplicate)
+        The removed rows are recorded in self.removed, in input order ...
+        ... with a duplicate_tracklet row after the last detection of each tracklet all of whose detections are duplicates
+        N.B. the detections must be those (& in the same order) from which the keys were calculated
+    '''
+
+    def __init__(self, reasons):
+        self.reasons   = reasons
+        self.removed   = []
+        self._position = {}
+
+    def filter(self, detIDs, trkIDs, orbitIDs, obsCodes, timeUTC):
+        ''' Returns a boolean mask of the duplicates amongst a batch of detections (which are also appended to self.removed)'''
+        isDuplicate = np.zeros(len(detIDs), dtype=bool)
+        for n in range(len(detIDs)):
+            key = (orbitIDs[n], trkIDs[n])
+            reasons = self.reasons.get(key)
+            if reasons is None:
+                continue
+            k = self._position.get(key, 0)
+            assert k < len(reasons), 'more detections than expected for tracklet %r (under %r)' % (trkIDs[n], orbitIDs[n])
+            self._position[key] = k + 1
+            if reasons[k] is None:
+                continue
+            isDuplicate[n] = True
+            self.removed.append( RemovedRow(reasons[k], detIDs[n], trkIDs[n], orbitIDs[n], obsCodes[n], timeUTC[n]) )
+            if k == len(reasons) - 1 and all( reason is not None for reason in reasons ):
+                self.removed.append( RemovedRow(DUPLICATE_TRACKLET, '', trkIDs[n], orbitIDs[n], '', '') )
+        return isDuplicate
+
+    def summary(self):
+        return summary(self.removed)
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def reasons_by_tracklet(reasons, trackletKeys, trackletSizes):
+    '''
+        Group the reasons (see DuplicateIndex.find) by tracklet, keeping only the tracklets that have any duplicates
+         - trackletKeys  : the (orbitID, trkID) of each (consecutive) run of detections
+         - trackletSizes : the number of detections in each run
+        N.B. the input must be sorted, so that all of the detections of a tracklet form a single run
+    '''
+    grouped, start = {}, 0
+    for key, size in zip(trackletKeys, trackletSizes):
+        if key in grouped or any( reason is not None for reason in reasons[start:start + size] ):
+            grouped.setdefault(key, []).extend( reasons[start:start + size] )
+        start += size
+    return grouped
+
+def count_removed(removed):
+    ''' Number of removed rows, keyed on reason'''
+    counts = { reason : 0 for reason in (DUPLICATE_DETID, NEAR_DUPLICATE, DUPLICATE_TRACKLET) }
+    for row in removed:
+        counts[row.reason] += 1
+    return counts
+
+def summary(removed):
+    return 'duplicates removed : ' + ', '.join( '%d %s' % (n, reason) for reason, n in count_removed(removed).items() )
+
+def record_counts(removed):
+    ''' Report the number of removed rows (of each reason) to instrumentation'''
+    for reason, n in count_removed(removed).items():
+        instrumentation.count('removed_%s' % reason, n)
+
+def report_lines(removed):
+    ''' The removed rows as csv lines (with a header line), in the style of the sample data files'''
+    return ["# " + " , ".join(REPORT_KEYS)] + [ " , ".join( str(_) for _ in row ) for row in removed ]
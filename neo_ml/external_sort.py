@@ -0,0 +1,155 @@
+'''
+    Out-of-core (external) merge sort of line-based text files
+    Intended for sorting raw (psql) dumps of the observations, which can be much larger than the available memory ...
+    ... into the (orbitID, trkID, time) order that sample_data_creation._process_detections requires
+
+     - The input is read in runs of (approximately) memoryBudget bytes, each of which is sorted in memory ...
+       ... & spilled to a temporary file, unless the whole input fits in a single run
+     - The spill files are then merged (heapq.merge), at most maxOpenFiles at a time ...
+       ... in several passes, if there are more spill files than that
+     - The output is written atomically (see output_writer.BufferedLineWriter), & the spill files are always removed
+     - The input may be compressed (see output_writer.open_text)
+
+    The sort is stable, so lines with equal keys keep their input order
+
+    Usage (e.g.) ...
+    external_sort.sort_file('sample_obs_large.csv', 'sample_obs_large_sorted.csv', key=lambda line: line.split(',')[:3], memoryBudget=2**30)
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import heapq
+import itertools
+import shutil
+import tempfile
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import output_writer
+import instrumentation
+
+
+# Approximate memory used by each line held in a run, in addition to its characters ...
+# ... (the str object, its slot in the list, & the key computed for it by list.sort)
+BYTES_PER_LINE = 400
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def _read_runs(lines, key, memoryBudget):
+    '''
+        Generator : sorted lists of lines, each using (approximately) no more than memoryBudget bytes
+        N.B. each line is given a trailing newline (the last line of a file may not have one) ...
+        ... so that no two lines can be joined together when they are re-ordered
+    '''
+    run, runBytes = [], 0
+    for line in lines:
+        if not line.endswith('\n'):
+            line += '\n'
+        run.append(line)
+        runBytes += len(line) + BYTES_PER_LINE
+        if runBytes >= memoryBudget:
+            run.sort(key=key)
+            yield run
+            run, runBytes = [], 0
+    if run:
+        run.sort(key=key)
+        yield run
+
+def _write_run(lines, directory):
+    ''' Write (spill) a list / iterable of lines to a new temporary file in directory, returning its path'''
+    fd, filepath = tempfile.mkstemp(prefix='run_', suffix='.txt', dir=directory)
+    with os.fdopen(fd, 'w') as fh:
+        fh.writelines(lines)
+    return filepath
+
+def _merge_runs(filepaths, key):
+    ''' Generator : the lines of the (sorted) files, merged into a single sorted sequence'''
+    handles = [ open(filepath, 'r') for filepath in filepaths ]
+    try:
+        yield from heapq.merge(*handles, key=key)
+    finally:
+        for fh in handles:
+            fh.close()
+
+def _batches(iterable, batchSize=10000):
+    ''' Generator : lists of (up to) batchSize consecutive items of iterable'''
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batchSize))
+        if not batch:
+            return
+        yield batch
+
+def sort_lines(lines, key, memoryBudget=2**28, maxOpenFiles=64, tmpDirectory=None):
+    '''
+        Generator : the lines (any iterable of strings), sorted on key (a function of the line), using bounded memory
+         - memoryBudget : (approximate) number of bytes of lines to sort in memory at once
+         - maxOpenFiles : maximum number of spill files merged at once
+         - tmpDirectory : directory in which to create the spill files (default: the system's temporary directory)
+        N.B. all of the lines are yielded with a trailing newline
+    '''
+    assert maxOpenFiles >= 2, 'maxOpenFiles must be at least 2'
+    directory = tempfile.mkdtemp(prefix='external_sort_', dir=tmpDirectory)
+    try:
+        runs = _read_runs(lines, key, memoryBudget)
+        first = next(runs, [])
+        second = next(runs, None)
+        if second is None:
+            # the whole input fits in memory : there is nothing to spill
+            yield from first
+            return
+
+        # spill all of the (sorted) runs
+        # - N.B. each run is emptied once it is written, so that it is freed before the next run is read
+        filepaths = []
+        with instrumentation.timer('external_sort_spill'):
+            for run in itertools.chain([first, second], runs):
+                filepaths.append( _write_run(run, directory) )
+                run.clear()
+        instrumentation.count('external_sort_spill_files', len(filepaths))
+
+        # merge (in several passes, if needs be) down to no more than maxOpenFiles files ...
+        while len(filepaths) > maxOpenFiles:
+            merged = []
+            for n in range(0, len(filepaths), maxOpenFiles):
+                group = filepaths[n:n + maxOpenFiles]
+                if len(group) == 1:
+                    merged.extend(group)
+                else:
+                    merged.append( _write_run(_merge_runs(group, key), directory) )
+                    for filepath in group:
+                        os.remove(filepath)
+            filepaths = merged
+            instrumentation.count('external_sort_merge_passes')
+
+        # ... & then merge those files as the lines are consumed
+        yield from _merge_runs(filepaths, key)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+@instrumentation.timed('external_sort')
+def sort_file(inputFilepath, outputFilepath, key, nHeader=1, memoryBudget=2**28, maxOpenFiles=64, tmpDirectory=None, compression=None):
+    '''
+        Sort the lines of inputFilepath on key (see sort_lines), writing the result to outputFilepath
+         - nHeader      : number of (header) lines at the top of the input, which are copied (unsorted) to the top of the output
+         - tmpDirectory : directory for the spill files (default: the directory of outputFilepath)
+         - compression  : compression of the output (N.B. that of the input is inferred from its suffix)
+        Returns the number of (sorted, non-header) lines
+    '''
+    assert os.path.isfile(inputFilepath), 'inputFilepath could not be found : %r ' % inputFilepath
+    tmpDirectory = tmpDirectory if tmpDirectory is not None else os.path.dirname(os.path.abspath(outputFilepath))
+    nLines = 0
+    with output_writer.open_text(inputFilepath) as fh, output_writer.BufferedLineWriter(outputFilepath, compression=compression) as writer:
+        writer.write_lines( line.rstrip('\n') for line in itertools.islice(fh, nHeader) )
+        for lines in _batches( sort_lines(fh, key, memoryBudget=memoryBudget, maxOpenFiles=maxOpenFiles, tmpDirectory=tmpDirectory) ):
+            writer.write_lines( line[:-1] for line in lines )
+            nLines += len(lines)
+    instrumentation.count('external_sort_lines', nLines)
+    return nLines
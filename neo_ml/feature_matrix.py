@@ -0,0 +1,313 @@
+'''
+    Construction of fixed-width (ML-ready) feature matrices from the detection, tracklet & object data
+    Intended for machine learning class with C. Nugent @ Olin
+
+    One row per tracklet
+     - the detections are joined to their tracklet (on trkID), and the tracklets to their object (on objectID)
+     - the variable-length quantities (e.g. vecAngRate, the per-detection eclipticLat) are summarized (min/max/mean/std) ...
+     - ... and the first few angular rates are also padded out to a fixed number of columns
+     - X : float32 array, shape (nTracklets, nFeatures), with the column names in featureNames
+     - y : boolean array of the isNEO labels
+
+    Building the matrix for the 1e6 sample means reading & joining several hundred MB of csv ...
+    ... so the results are cached on disk (as a single .npz file per matrix) ...
+    ... keyed on a hash of the contents of the input files & on the feature-spec (see FeatureMatrixBuilder.spec)
+     - FEATURE_SPEC_VERSION must be incremented whenever the definition of any existing feature is changed
+
+    Usage (e.g.) ...
+    builder = FeatureMatrixBuilder()
+    fm = builder.build_for_sample('1e5')
+    fm.X, fm.y
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import json
+import hashlib
+import tempfile
+from collections import namedtuple
+import numpy as np
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import columnar
+import storage
+import joins
+import instrumentation
+
+
+FEATURE_SPEC_VERSION    = 1
+DEFAULT_CACHE_DIRECTORY = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'feature_cache' )
+
+# Summarized quantities: (name-prefix, description)
+# - each is expanded into _min, _max, _mean & _std columns
+RAGGED_SUMMARIES = {
+    'angRate'       : 'angular rates between adjacent detections (vecAngRate) [radians / s]',
+    'angSepn'       : 'angular separations between adjacent detections (vecAngSepn) [radians]',
+    'eclipticLat'   : 'ecliptic latitude of the detections [radians]',
+    'solarElong'    : 'solar elongation of the detections [radians]',
+    'Vmag'          : 'V-band magnitude of the detections',
+}
+SUMMARY_STATISTICS = ('min', 'max', 'mean', 'std')
+
+FeatureMatrix = namedtuple('FeatureMatrix', [
+    'X',                # float32 array, shape (nTracklets, nFeatures)
+    'y',                # bool array, shape (nTracklets,) : isNEO
+    'featureNames',     # list of the names of the columns of X
+    'trkIDs',           # array of the trkIDs of the rows of X
+])
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def file_digest(path, blockSize=2**20):
+    '''
+        Hash of the contents of an input file
+        - or of every file within a binary (.npy.d) dataset (see storage.py)
+    '''
+    assert os.path.exists(path), 'path could not be found : %r ' % path
+    h = hashlib.blake2b(digest_size=16)
+    if os.path.isdir(path):
+        filepaths = sorted( os.path.join(root, f) for root, dirs, files in os.walk(path) for f in files )
+    else:
+        filepaths = [path]
+    for filepath in filepaths:
+        h.update( os.path.relpath(filepath, path).encode() )
+        with open(filepath, 'rb') as fh:
+            for block in iter(lambda : fh.read(blockSize), b''):
+                h.update(block)
+    return h.hexdigest()
+
+def segment_statistics(values, offsets):
+    '''
+        min, max, mean & (population) std of the values within each segment [ offsets[k] : offsets[k+1] ]
+        - non-finite values (i.e. missing entries) are ignored
+        - segments with no finite values get nan
+    '''
+    values   = np.asarray(values, dtype=np.float64)
+    offsets  = np.asarray(offsets, dtype=np.int64)
+    lengths  = np.diff(offsets)
+    nSeg     = len(lengths)
+    segIndex = np.repeat(np.arange(nSeg), lengths)
+    finite   = np.isfinite(values)
+    count    = np.bincount(segIndex, weights=finite, minlength=nSeg)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(segIndex, weights=np.where(finite, values, 0.), minlength=nSeg) / count
+        var  = np.bincount(segIndex, weights=np.where(finite, values - mean[segIndex], 0.)**2, minlength=nSeg) / count
+
+    # N.B. reduceat needs the start of every (non-empty) segment : the empty segments in between contribute nothing
+    lo, hi   = np.full(nSeg, np.nan), np.full(nSeg, np.nan)
+    nonEmpty = lengths > 0
+    if np.any(nonEmpty):
+        starts = offsets[:-1][nonEmpty]
+        lo[nonEmpty] = np.minimum.reduceat(np.where(finite, values,  np.inf), starts)
+        hi[nonEmpty] = np.maximum.reduceat(np.where(finite, values, -np.inf), starts)
+    lo[count == 0] = hi[count == 0] = np.nan
+    return { 'min' : lo, 'max' : hi, 'mean' : mean, 'std' : np.sqrt(var) }
+
+def padded_values(raggedArray, nColumns, fillValue=np.nan):
+    ''' The first nColumns values of each vector of a RaggedArray, as an (N, nColumns) array (short vectors are padded with fillValue)'''
+    lengths = raggedArray.lengths()
+    padded  = np.full((len(lengths), nColumns), fillValue, dtype=np.float64)
+    for n in range(nColumns):
+        has = lengths > n
+        padded[has, n] = raggedArray.values[ raggedArray.offsets[:-1][has] + n ]
+    return padded
+
+
+# -----------------------------------
+# Define some useful class(es)
+# -----------------------------------
+
+class FeatureMatrixBuilder():
+    '''
+        Builds (and caches) the feature matrix for a set of detection, tracklet & object data
+
+        nPaddedRates   : number of columns holding the (first few) individual angular rates of each tracklet
+        fillValue      : value used for any missing features (e.g. padding, or a tracklet with no Vmag)
+        dropUnlabelled : drop the tracklets whose object (or whose detections) could not be found
+                         - otherwise they are kept, with y = False
+        cacheDirectory : where the .npz files are cached (None => no caching)
+    '''
+
+    def __init__(self, nPaddedRates=4, fillValue=0., dropUnlabelled=True, cacheDirectory=DEFAULT_CACHE_DIRECTORY):
+        assert nPaddedRates >= 0, 'nPaddedRates must be non-negative'
+        self.nPaddedRates   = int(nPaddedRates)
+        self.fillValue      = float(fillValue)
+        self.dropUnlabelled = bool(dropUnlabelled)
+        self.cacheDirectory = cacheDirectory
+
+    def feature_names(self):
+        ''' Names of the columns of X (in order)'''
+        names  = ['nDetections', 'arcLength', 'meanAngRate', 'rms']
+        names += [ '%s_%s' % (prefix, stat) for prefix in RAGGED_SUMMARIES for stat in SUMMARY_STATISTICS ]
+        names += [ 'angRate_%d' % n for n in range(self.nPaddedRates) ]
+        return names
+
+    def spec(self):
+        ''' Everything that determines the contents of the feature matrix (other than the input data)'''
+        return { 'version'        : FEATURE_SPEC_VERSION,
+                 'featureNames'   : self.feature_names(),
+                 'fillValue'      : repr(self.fillValue),
+                 'dropUnlabelled' : self.dropUnlabelled }
+
+    def cache_key(self, *filepaths):
+        ''' Hash of the feature-spec & of the contents of the input files'''
+        h = hashlib.blake2b(digest_size=16)
+        h.update( json.dumps(self.spec(), sort_keys=True).encode() )
+        for filepath in filepaths:
+            h.update( file_digest(filepath).encode() )
+        return h.hexdigest()
+
+    def cache_filepath(self, *filepaths):
+        return os.path.join(self.cacheDirectory, 'features_v%d_%s.npz' % (FEATURE_SPEC_VERSION, self.cache_key(*filepaths)))
+
+    # ---- Building the matrix ------------
+
+    def build(self, detFilepath, trkFilepath, objFilepath):
+        '''
+            Build the feature matrix from the detection, tracklet & object files ...
+            ... or load it from the cache, if it has already been built from identical files with the same spec
+            The files can be csv files or binary (.npy.d) datasets (see storage.py)
+        '''
+        cacheFilepath = None if self.cacheDirectory is None else self.cache_filepath(detFilepath, trkFilepath, objFilepath)
+        if cacheFilepath is not None and os.path.isfile(cacheFilepath):
+            instrumentation.count('feature_cache_hits')
+            return self.load(cacheFilepath)
+        instrumentation.count('feature_cache_misses')
+
+        featureMatrix = self.build_from_data( *[ _read(filepath, reader) for filepath, reader in (
+                                                   (detFilepath, columnar.read_detections_columnar),
+                                                   (trkFilepath, columnar.read_tracklets_columnar),
+                                                   (objFilepath, columnar.read_objects_columnar)) ] )
+        if cacheFilepath is not None:
+            self.save(featureMatrix, cacheFilepath)
+        return featureMatrix
+
+    def build_for_sample(self, numberString, kind='real', directory=None):
+        ''' As build, for the files of one of the samples (e.g. numberString='1e5') in sample_data/ (or directory)'''
+        directory = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' ) if directory is None else directory
+        filepaths = [ os.path.join(directory, 'sample_data_%s_%s_%s.csv' % (numberString, kind, dataType)) for dataType in ('detections', 'tracklets', 'objects') ]
+        # use the binary datasets where they exist (see storage.py)
+        filepaths = [ storage.binary_path_from_csv_path(_) if storage.is_binary_dataset(storage.binary_path_from_csv_path(_)) else _ for _ in filepaths ]
+        return self.build(*filepaths)
+
+    @instrumentation.timed('build_feature_matrix')
+    def build_from_data(self, detections, tracklets, objects):
+        '''
+            Build the feature matrix (without any caching) from ColumnarData objects ...
+            ... e.g. from NEODATA.read_*_columnar
+        '''
+        trkIDs = tracklets.columns['trkID']
+        nTrk   = len(trkIDs)
+
+        # detections -> tracklets : group the detections by tracklet (in the order of the tracklets) & time
+        detToTrk = joins.lookup(detections.columns['trkID'], trkIDs)
+        found    = np.flatnonzero(detToTrk >= 0)
+        order    = found[ np.lexsort( (detections.columns['timeUTC'][found], detToTrk[found]) ) ]
+        nDet     = np.bincount(detToTrk[order], minlength=nTrk)
+        offsets  = np.zeros(nTrk + 1, dtype=np.int64)
+        np.cumsum(nDet, out=offsets[1:])
+
+        # tracklets -> objects
+        trkToObj = joins.lookup(tracklets.columns['objectID'], objects.columns['objectID'])
+        isNEO    = np.asarray(objects.columns['isNEO'], dtype=bool)
+        valid    = (trkToObj >= 0) & (nDet > 0)
+        y        = valid & isNEO[np.maximum(trkToObj, 0)] if len(isNEO) else np.zeros(nTrk, dtype=bool)
+
+        # fixed-width quantities
+        timeUTC   = np.asarray(detections.columns['timeUTC'], dtype=np.float64)[order]
+        timeRange = segment_statistics(timeUTC, offsets)
+        features  = {
+            'nDetections'   : nDet,
+            'arcLength'     : timeRange['max'] - timeRange['min'],
+            'meanAngRate'   : tracklets.columns['meanAngRate'],
+            'rms'           : tracklets.columns['rms'],
+        }
+
+        # summarized quantities
+        raggedSources = {
+            'angRate'       : (tracklets.columns['vecAngRate'].values, tracklets.columns['vecAngRate'].offsets),
+            'angSepn'       : (tracklets.columns['vecAngSepn'].values, tracklets.columns['vecAngSepn'].offsets),
+            'eclipticLat'   : (detections.columns['eclipticLat'][order], offsets),
+            'solarElong'    : (detections.columns['solarElong'][order], offsets),
+            'Vmag'          : (detections.columns['Vmag'][order], offsets),
+        }
+        for prefix, (values, segmentOffsets) in raggedSources.items():
+            for stat, column in segment_statistics(values, segmentOffsets).items():
+                features['%s_%s' % (prefix, stat)] = column
+
+        # padded quantities
+        padded = padded_values(tracklets.columns['vecAngRate'], self.nPaddedRates, fillValue=np.nan)
+        for n in range(self.nPaddedRates):
+            features['angRate_%d' % n] = padded[:,n]
+
+        featureNames = self.feature_names()
+        assert set(features) == set(featureNames), 'features do not match the feature-spec'
+        X = np.empty((nTrk, len(featureNames)), dtype=np.float32)
+        for n, name in enumerate(featureNames):
+            X[:,n] = features[name]
+        X[~np.isfinite(X)] = self.fillValue
+
+        if self.dropUnlabelled:
+            X, y, trkIDs = X[valid], y[valid], trkIDs[valid]
+        return FeatureMatrix(X, y, featureNames, np.asarray(trkIDs))
+
+    # ---- Cache ------------
+
+    def save(self, featureMatrix, filepath):
+        ''' Save a FeatureMatrix as a .npz file (written to a temporary file & then renamed, so the cache never holds a partial file)'''
+        directory = os.path.dirname(os.path.abspath(filepath))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmpFilepath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                np.savez(fh, X=featureMatrix.X, y=featureMatrix.y, featureNames=np.array(featureMatrix.featureNames), trkIDs=featureMatrix.trkIDs)
+            os.replace(tmpFilepath, filepath)
+        except BaseException:
+            os.remove(tmpFilepath)
+            raise
+
+    def load(self, filepath):
+        ''' Load a FeatureMatrix saved by save'''
+        with np.load(filepath, allow_pickle=False) as npz:
+            featureMatrix = FeatureMatrix(npz['X'], npz['y'], npz['featureNames'].tolist(), npz['trkIDs'])
+        assert featureMatrix.featureNames == self.feature_names(), 'cached featureNames do not match the feature-spec : %r' % filepath
+        return featureMatrix
+
+
+def _read(filepath, csvReader):
+    ''' Read a csv file (using csvReader), or a binary (.npy.d) dataset'''
+    if storage.is_binary_dataset(filepath):
+        return storage.read_columnar(filepath)
+    return csvReader(filepath)
+
+
+
+def main(argv=None, prog=None):
+    ''' Build (and cache) the feature matrix for one of the samples'''
+
+    import argparse
+    parser = argparse.ArgumentParser(prog=prog, description='Build (and cache) the feature matrix for one of the samples')
+    parser.add_argument('numberString', help='Sample size (e.g. 1e4)')
+    parser.add_argument('--kind',         default='real', choices=['real', 'synthetic'])
+    parser.add_argument('--nPaddedRates', type=int, default=4)
+    parser.add_argument('--noCache',      action='store_true', help='Do not read from (or write to) the cache')
+    args = parser.parse_args(argv)
+
+    builder = FeatureMatrixBuilder(nPaddedRates=args.nPaddedRates, cacheDirectory=None if args.noCache else DEFAULT_CACHE_DIRECTORY)
+    fm = builder.build_for_sample(args.numberString, kind=args.kind)
+    print('X : %r (%s), y : %d NEOs out of %d' % (fm.X.shape, fm.X.dtype, fm.y.sum(), len(fm.y)))
+    for name, column in zip(fm.featureNames, fm.X.T):
+        print('%-18s mean=%12.5g  std=%12.5g' % (name, column.mean(), column.std()))
+
+
+if __name__ == '__main__':
+    main()
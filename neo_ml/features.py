@@ -0,0 +1,234 @@
+'''
+    Vectorized calculation of the detection-level & tracklet-level quantities defined in data.py
+    Intended for use by sample_data_creation.py (and anything else that needs to recalculate these quantities)
+
+    Each function accepts whole arrays of detections (/tracklets) ...
+    ... so that tens of millions of observations can be processed without paying the per-row numpy call overhead
+
+'''
+
+# ----------------------------------------
+# Third-party imports
+# ----------------------------------------
+import numpy as np
+
+# ----------------------------------------
+# Local imports
+# ----------------------------------------
+import columnar
+
+
+# ----------------------------------------
+# Define some useful function(s)
+# ----------------------------------------
+
+def angle_unitvectors(uv1,uv2):
+    '''
+        Calculate the angle between two unit vectors
+        Returns angle in radians
+        '''
+    # Check the format is as required
+    assert (uv1.shape == (3,) or uv1.shape == (1,3)), 'The behavior of this routine has only been tested when uv1 is a single unit vector'
+    assert (uv2.shape == (3,) or uv2.shape[1] ==3 )
+
+    # Do the dot-products to get the angle
+    uv1.flatten()
+    uv2 = np.atleast_2d(uv2)
+    dot = np.dot( uv1,uv2.T )
+
+    # Return results in radians
+    return np.arccos( dot )
+
+def angle_unitvectors_pairwise(uv1, uv2):
+    '''
+        Calculate the angle between corresponding rows of two (N,3) arrays of unit vectors
+        Returns array of N angles in radians
+    '''
+    dot = np.einsum('ij,ij->i', np.atleast_2d(uv1), np.atleast_2d(uv2))
+    # Guard against rounding taking |dot| fractionally above 1
+    return np.arccos( np.clip(dot, -1., 1.) )
+
+def radec_to_unitvector_equatorial(RA_deg, DEC_deg):
+    ''' Accepts scalars (returns shape (3,)) or arrays of length N (returns shape (N,3))'''
+    return np.transpose(np.array([  np.cos(np.radians(RA_deg))*np.cos(np.radians(DEC_deg)),
+                                  np.sin(np.radians(RA_deg))*np.cos(np.radians(DEC_deg)),
+                                  np.sin(np.radians(DEC_deg))]))
+
+def _rot_mat():
+    '''
+        Rotation matrix from equatorial to ecliptic coords
+        - phys_const is internal to the MPC, so it is only imported when needed ...
+        - ... which allows the remaining functions to be used elsewhere (e.g. by synthetic.py)
+    '''
+    import phys_const as PHYS
+    return PHYS.rot_mat
+
+def unitvector_equatorial_to_unitvector_ecliptic(unitvector_equatorial):
+    ''' Accepts shape (3,) or (N,3): np.dot(v, R) is equivalent to np.dot(R.T, v) for each row v'''
+    return np.dot(unitvector_equatorial, _rot_mat() )
+
+def calc_heliocentric_position_of_observatory_in_ecliptic_coords(helio_eq_posn):
+    ''' Accepts shape (3,) or (N,3)'''
+    helio_ec_posn = np.dot(helio_eq_posn, _rot_mat() )
+    return helio_ec_posn
+
+def calc_ecliptic_latitude(UV):
+    ''' Latitude [RADIANS] of (N,3) ecliptic unit vector(s)'''
+    UV = np.atleast_2d(UV)
+    return np.arctan( UV[:,2] / ( UV[:,0]**2 + UV[:,1]**2 )**0.5 )
+
+def calc_solar_elongation(UV, obsPosn):
+    '''
+        Angular separation [RADIANS] between the Sun and the detection(s), with the observatory as the reference point
+         - UV      : (N,3) ecliptic unit vector(s) from the observatory to the detection
+         - obsPosn : (N,3) heliocentric ecliptic position(s) of the observatory
+    '''
+    obsPosn  = np.atleast_2d(obsPosn)
+    UobsPosn = obsPosn / np.sqrt( np.einsum('ij,ij->i', obsPosn, obsPosn) )[:,None]
+    return np.pi - angle_unitvectors_pairwise(UV, UobsPosn)
+
+def calc_detection_fields(RA_deg, Dec_deg, helio_eq_posn):
+    '''
+        Calculate all of the derived detection-level quantities in a single vectorized pass
+
+        Inputs:
+         - RA_deg, Dec_deg : arrays of length N (equatorial coords) [degrees]
+         - helio_eq_posn   : (N,3) heliocentric equatorial position of the observatory at each detection [au]
+
+        Returns:
+         - dictionary of length-N arrays, keyed on the field names used in data.detection_field_definitions
+         - rows for which any input is missing / non-finite come back as nan (see 'ACCEPT' to identify them)
+    '''
+    RA_deg        = np.asarray(RA_deg, dtype=np.float64)
+    Dec_deg       = np.asarray(Dec_deg, dtype=np.float64)
+    helio_eq_posn = np.asarray(helio_eq_posn, dtype=np.float64).reshape(-1,3)
+    assert RA_deg.shape == Dec_deg.shape == (len(helio_eq_posn),), 'inconsistent input lengths'
+
+    # convert RA, Dec to unit vector (ecliptic coords)
+    UV = unitvector_equatorial_to_unitvector_ecliptic( radec_to_unitvector_equatorial(RA_deg, Dec_deg).reshape(-1,3) )
+
+    # generate_observatory_position_Heliocentric_Ecliptic_Coordinates
+    obsPosn = calc_heliocentric_position_of_observatory_in_ecliptic_coords( helio_eq_posn )
+
+    # suppress the warnings from the rows of nans: these are flagged via ACCEPT
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fields = {
+            'UV_X'          : UV[:,0],
+            'UV_Y'          : UV[:,1],
+            'UV_Z'          : UV[:,2],
+            'Obs_X'         : obsPosn[:,0],
+            'Obs_Y'         : obsPosn[:,1],
+            'Obs_Z'         : obsPosn[:,2],
+            'eclipticLat'   : calc_ecliptic_latitude(UV),
+            'solarElong'    : calc_solar_elongation(UV, obsPosn),
+        }
+    fields['ACCEPT'] = np.isfinite(UV).all(axis=1) & np.isfinite(obsPosn).all(axis=1)
+    return fields
+
+
+# ----------------------------------------
+# Tracklet-level quantities
+# ----------------------------------------
+# The functions below operate on a single array of detections, sorted by (tracklet, time)
+# - Each tracklet is a contiguous "segment" of the arrays, delimited by an array of offsets
+# - The detections of the k-th tracklet are [ offsets[k] : offsets[k+1] ]
+
+def sort_by_tracklet_and_time(trkID, timeUTC):
+    ''' Return the indices that sort the detections by trkID and then (within each tracklet) by time'''
+    return np.lexsort( (np.asarray(timeUTC), np.asarray(trkID)) )
+
+def segment_offsets(sortedKeys):
+    ''' Return the offsets that delimit the runs of identical values in an array of sorted keys'''
+    sortedKeys = np.asarray(sortedKeys)
+    change = np.flatnonzero(sortedKeys[1:] != sortedKeys[:-1]) + 1
+    return np.concatenate( ([0], change, [len(sortedKeys)]) ).astype(np.int64)
+
+def _segment_mean(values, segIndex, counts):
+    ''' Mean of values within each segment (nan for empty segments)'''
+    sums = np.bincount(segIndex, weights=values, minlength=len(counts))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+def calc_tracklet_rms(offsets, timeUTC, UV):
+    '''
+        RMS deviation [RADIANS] of the detections from the best-fit straight line (constant angular velocity) ...
+        ... for every tracklet at once
+
+        The detections in each tracklet are projected onto the (gnomonic) tangent plane at the mean position of the tracklet
+        and a straight line in time is fitted (by least squares) to each of the two tangent-plane coordinates
+         - tracklets with fewer than 3 detections are fitted exactly, so their rms is set to exactly 0
+    '''
+    nDet     = np.diff(offsets)
+    segIndex = np.repeat(np.arange(len(nDet)), nDet)
+
+    # tangent-plane basis at the (normalized) mean position of each tracklet
+    centre = np.column_stack( [np.bincount(segIndex, weights=UV[:,j], minlength=len(nDet)) for j in range(3)] )
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centre /= np.sqrt( np.einsum('ij,ij->i', centre, centre) )[:,None]
+        pole = np.where( (np.abs(centre[:,2]) < 0.9)[:,None], [0.,0.,1.], [1.,0.,0.] )
+        e1 = np.cross(pole, centre)
+        e1 /= np.sqrt( np.einsum('ij,ij->i', e1, e1) )[:,None]
+        e2 = np.cross(centre, e1)
+
+        # gnomonic projection of each detection
+        c, e1, e2 = centre[segIndex], e1[segIndex], e2[segIndex]
+        w   = np.einsum('ij,ij->i', UV, c)
+        xi  = np.einsum('ij,ij->i', UV, e1) / w
+        eta = np.einsum('ij,ij->i', UV, e2) / w
+
+        # least-squares fit using coordinates relative to the mean of each tracklet
+        t   = timeUTC - _segment_mean(timeUTC, segIndex, nDet)[segIndex]
+        xi  = xi  - _segment_mean(xi,  segIndex, nDet)[segIndex]
+        eta = eta - _segment_mean(eta, segIndex, nDet)[segIndex]
+        Stt = np.bincount(segIndex, weights=t*t,   minlength=len(nDet))
+        Stx = np.bincount(segIndex, weights=t*xi,  minlength=len(nDet))
+        Sty = np.bincount(segIndex, weights=t*eta, minlength=len(nDet))
+        slope_xi  = np.where(Stt > 0, Stx / Stt, 0.)[segIndex]
+        slope_eta = np.where(Stt > 0, Sty / Stt, 0.)[segIndex]
+
+        residual2 = (xi - slope_xi*t)**2 + (eta - slope_eta*t)**2
+        return np.where(nDet < 3, 0., np.sqrt( _segment_mean(residual2, segIndex, nDet) ))
+
+def calc_tracklet_fields(offsets, timeUTC, UV):
+    '''
+        Calculate the tracklet-level quantities for every tracklet in a single vectorized pass
+
+        Inputs:
+         - offsets : delimits the tracklets (see segment_offsets)
+         - timeUTC : length-N array of detection times [JDUTC], sorted by (tracklet, time)
+         - UV      : (N,3) array of ecliptic unit vectors, in the same order
+
+        Returns:
+         - dictionary keyed on the field names used in data.tracklet_field_definitions
+         - vecAngSepn & vecAngRate are RaggedArrays: the k-th tracklet has nDet-1 entries
+    '''
+    offsets = np.asarray(offsets, dtype=np.int64)
+    timeUTC = np.asarray(timeUTC, dtype=np.float64)
+    UV      = np.asarray(UV, dtype=np.float64).reshape(-1,3)
+    nDet    = np.diff(offsets)
+    assert offsets[0] == 0 and offsets[-1] == len(timeUTC) == len(UV) and np.all(nDet >= 0), 'inconsistent offsets'
+
+    # pairs of adjacent detections, excluding those that straddle the boundary between two tracklets
+    samePair = np.ones(max(len(timeUTC) - 1, 0), dtype=bool)
+    boundary = offsets[1:-1] - 1
+    samePair[boundary[(boundary >= 0) & (boundary < len(samePair))]] = False
+
+    # get angles between adjacent observations
+    vecAngSepn = angle_unitvectors_pairwise(UV[:-1][samePair], UV[1:][samePair])
+    deltaTimes = (timeUTC[1:] - timeUTC[:-1])[samePair] * 3600. * 24.
+    # VECTOR OF ANGULAR RATES between adjacent observations
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vecAngRate = vecAngSepn / deltaTimes
+
+    # the k-th tracklet has max(nDet-1, 0) pairs
+    nPairs      = np.maximum(nDet - 1, 0)
+    pairOffsets = np.zeros(len(nDet) + 1, dtype=np.int64)
+    np.cumsum(nPairs, out=pairOffsets[1:])
+    pairIndex   = np.repeat(np.arange(len(nDet)), nPairs)
+
+    return {
+        'vecAngSepn'    : columnar.RaggedArray(vecAngSepn, pairOffsets),
+        'vecAngRate'    : columnar.RaggedArray(vecAngRate, pairOffsets),
+        'meanAngRate'   : _segment_mean(vecAngRate, pairIndex, nPairs),
+        'rms'           : calc_tracklet_rms(offsets, timeUTC, UV),
+    }
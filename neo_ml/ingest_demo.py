@@ -13,12 +13,20 @@
 # ---------------------------------------
 import os, sys
 from collections import namedtuple
-import re
+import itertools
+import numpy as np
 
 # ---------------------------------------
 # Local imports
 # ---------------------------------------
 import data
+import columnar
+import storage
+import spatial_index
+import joins
+import output_writer
+import instrumentation
+import lazy_dataset
 
 # ---------------------------------------
 # Define some useful class(es)
@@ -40,53 +48,185 @@ class NEODATA():
         '''
         assert os.path.isfile(filepath), 'filepath could not be found : %r ' % filepath
         try:
-            with open(filepath, 'r') as fh:
+            with output_writer.open_text(filepath) as fh:
                 dataList = fh.readlines()
         except:
             sys.exit('file could not be read : %r' % filepath )
         return dataList
     
+    def _iterate_over_file(self, filepath):
+        '''
+            Convience function to lazily read data from a file (after checking that the file exists)
+            Lines are yielded one at a time, so memory use does not grow with the size of the file
+            The file may be compressed (see output_writer.open_text)
+        '''
+        assert os.path.isfile(filepath), 'filepath could not be found : %r ' % filepath
+        with output_writer.open_text(filepath) as fh:
+            for line in fh:
+                yield line
 
-    def _read_data_into_dict(self, filepath, fieldDefinitions , dataKey):
+    def _iterate_over_data(self, filepath, fieldDefinitions , dataKey):
+        '''
+            Convenience function to lazily ...
+            (i) read data from a file
+            (ii) check that the data type is as expected
+            (iii) yield the data one row at a time, as a dictionary
+            
+            N.B. Unlike _check_imported_data_structure, the header line must precede the body
+        '''
+        headerKeys = ""
+        nRows = 0
+        for n, line in enumerate(self._iterate_over_file(filepath)):
+            if line.strip() == '':
+                continue
+            
+            # Check whether this is the header line, containing all required fields
+            if '#' == line.strip()[0]:
+                if headerKeys == "" and len([key for key in fieldDefinitions if key in line]) == len(fieldDefinitions):
+                    headerKeys = [_.strip() for _ in line[1:].split(",") ]
+                    assert len(headerKeys) == len(fieldDefinitions), ' differing lengths ... %r ,  %r' % (headerKeys , fieldDefinitions)
+                continue
+            assert headerKeys != "", 'could not find correct header line (before line %d) in ... \n \t %r ' % (n, fieldDefinitions)
+            
+            # split the line "intelligently" & check the number of fields is correct
+            lineSplit = self._split_intelligently(line)
+            assert len(lineSplit) == len(fieldDefinitions), 'incorrect number of fields (%d != %d) for %s-data in line %r' % (len(lineSplit), len(fieldDefinitions), dataKey, line)
+            nRows += 1
+            yield dict(zip(headerKeys, lineSplit))
+        assert headerKeys != "", 'could not find correct header line in ... \n \t %r ' % fieldDefinitions
+        instrumentation.count('%s_rows_read' % {'detID' : 'detection', 'trkID' : 'tracklet', 'objectID' : 'object'}.get(dataKey, dataKey), nRows)
+
+
+    @instrumentation.timed('read_data_into_dict')
+    def _read_data_into_dict(self, filepath, fieldDefinitions , dataKey, skipDuplicates=False):
         '''
             Convenience function to ...
             (i) read data from a file
             (ii) check that the data type is as expected
             (iii) return the data in an dictionary key-ed on the supplied dataKey
+            
+            If skipDuplicates, rows whose dataKey has already been read are skipped (& reported), rather than ...
+            ... aborting the whole read (e.g. for files created before duplicates were removed, see dedup.py)
         '''
-        # Read the data from file
-        dataArray = self._read_from_file(filepath)
-        
         # Get the expected data structure
         assert fieldDefinitions in [data.detection_field_definitions, data.tracklet_field_definitions , data.object_field_definitions], 'fieldDefinitions not recognized: %r' % fieldDefinitions
         
-        # Check the imported data has the expected structure
+        # Read the data from file, checking that the imported data has the expected structure
         # (if not, that implies that the person that made the data file did something wrong!)
-        headerKeys, dataList  = self._check_imported_data_structure(fieldDefinitions , dataKey, dataArray )
+        # - The file is read lazily, so that the raw lines are never all held in memory at once
         
         # Structure the data into an appropriatedly key-ed dictionary
         # While doing this, check for uniqueness
         dataDict = {}
-        for n, item in enumerate(dataList):
-            d = dict(zip(headerKeys, item))
+        duplicates = []
+        for n, d in enumerate(self._iterate_over_data(filepath, fieldDefinitions , dataKey)):
+            if skipDuplicates and d[dataKey] in dataDict:
+                duplicates.append(d[dataKey])
+                continue
             assert d[dataKey] not in dataDict, '%s already in dataDict (line %d reading from %s)' % (d[dataKey], n, filepath)
             dataDict[d[dataKey]] = d
         
+        if duplicates:
+            print('\n _read_data_into_dict skipped %d rows with a duplicate %s (e.g. %s) in %s' % (len(duplicates), dataKey, duplicates[:5], filepath))
+            instrumentation.count('%s_duplicate_rows_skipped' % {'detID' : 'detection', 'trkID' : 'tracklet', 'objectID' : 'object'}.get(dataKey, dataKey), len(duplicates))
         print('\n _read_data_into_dict successfuly imported data from %s' % filepath)
         
         return dataDict
 
-    def read_detection_data_into_dict(self, filepath):
+    def read_detection_data_into_dict(self, filepath, skipDuplicates=False):
         ''' Convenience function to read detection-data into a dictionary: keyed on detID'''
-        return self._read_data_into_dict(filepath , data.detection_field_definitions , 'detID')
+        return self._read_data_into_dict(filepath , data.detection_field_definitions , 'detID', skipDuplicates=skipDuplicates)
 
-    def read_tracklet_data_into_dict(self, filepath):
+    def read_tracklet_data_into_dict(self, filepath, skipDuplicates=False):
         '''Convenience function to read tracklet-data into a dictionary: keyed on trkID'''
-        return self._read_data_into_dict(filepath , data.tracklet_field_definitions , 'trkID')
+        return self._read_data_into_dict(filepath , data.tracklet_field_definitions , 'trkID', skipDuplicates=skipDuplicates)
 
-    def read_object_data_into_dict(self, filepath):
+    def read_object_data_into_dict(self, filepath, skipDuplicates=False):
         '''Convenience function to read object-data into a dictionary: keyed on objectID'''
-        return self._read_data_into_dict(filepath , data.object_field_definitions , 'objectID')
+        return self._read_data_into_dict(filepath , data.object_field_definitions , 'objectID', skipDuplicates=skipDuplicates)
+
+    def iterate_over_detection_data(self, filepath):
+        ''' Convenience function to lazily read detection-data: yields one dictionary per detection'''
+        return self._iterate_over_data(filepath , data.detection_field_definitions , 'detID')
+
+    def iterate_over_tracklet_data(self, filepath):
+        ''' Convenience function to lazily read tracklet-data: yields one dictionary per tracklet'''
+        return self._iterate_over_data(filepath , data.tracklet_field_definitions , 'trkID')
+
+    def iterate_over_object_data(self, filepath):
+        ''' Convenience function to lazily read object-data: yields one dictionary per object'''
+        return self._iterate_over_data(filepath , data.object_field_definitions , 'objectID')
+
+    def iterate_over_detections_grouped_by_tracklet(self, filepath):
+        '''
+            Convenience function to lazily read detection-data, grouped on the fly by trkID
+            Yields (trkID, list-of-detection-dictionaries) ...
+            ... so memory use is bounded by the largest tracklet, rather than by the size of the file
+            
+            N.B. Relies on the detections of each tracklet being contiguous in the file (as written by sample_data_creation.py)
+        '''
+        for trkID, detections in itertools.groupby(self.iterate_over_detection_data(filepath), key=lambda det: det['trkID']):
+            yield trkID, list(detections)
+
+    @instrumentation.timed('read_detections_columnar')
+    def read_detections_columnar(self, filepath):
+        '''
+            Convenience function to read detection-data into typed numpy arrays (see columnar.py)
+            The returned ColumnarData object can also be used like the dictionary from read_detection_data_into_dict
+            filepath can be either a csv file, or a binary (.npy.d) dataset (see storage.py), which is memory-mapped
+        '''
+        if storage.is_binary_dataset(filepath):
+            return storage.read_columnar(filepath)
+        return columnar.read_detections_columnar(filepath)
+
+    @instrumentation.timed('read_tracklets_columnar')
+    def read_tracklets_columnar(self, filepath):
+        '''
+            Convenience function to read tracklet-data into typed numpy arrays (see columnar.py)
+            The ragged vecAngSepn & vecAngRate columns are stored as RaggedArrays (values + offsets)
+        '''
+        if storage.is_binary_dataset(filepath):
+            return storage.read_columnar(filepath)
+        return columnar.read_tracklets_columnar(filepath)
+
+    @instrumentation.timed('read_objects_columnar')
+    def read_objects_columnar(self, filepath):
+        '''
+            Convenience function to read object-data into typed numpy arrays (see columnar.py)
+        '''
+        if storage.is_binary_dataset(filepath):
+            return storage.read_columnar(filepath)
+        return columnar.read_objects_columnar(filepath)
+
+    def lazy_detections(self, filepath, chunkSize=100000, **filters):
+        '''
+            Convenience function to lazily read detection-data: each column is only loaded (& cached) when first used
+            Filters (e.g. timeUTC=lazy_dataset.between(t0, t1), obsCode=['F51']) are applied as the columns are loaded
+            See lazy_dataset.py
+        '''
+        return lazy_dataset.lazy_detections(filepath, chunkSize=chunkSize, **filters)
+
+    def lazy_tracklets(self, filepath, chunkSize=100000, **filters):
+        ''' Convenience function to lazily read tracklet-data (see lazy_detections)'''
+        return lazy_dataset.lazy_tracklets(filepath, chunkSize=chunkSize, **filters)
+
+    def lazy_objects(self, filepath, chunkSize=100000, **filters):
+        ''' Convenience function to lazily read object-data (see lazy_detections), e.g. with isNEO=True'''
+        return lazy_dataset.lazy_objects(filepath, chunkSize=chunkSize, **filters)
+
+    def write_binary(self, columnarData, directory):
+        '''
+            Convenience function to save a ColumnarData object (from any of the read_*_columnar functions) as a binary dataset
+            Subsequent reads of the directory (via read_*_columnar) are memory-mapped & avoid re-parsing the csv file
+        '''
+        storage.write_columnar(directory, columnarData)
+
+    def build_detection_index(self, detections, **kwargs):
+        '''
+            Convenience function to build a spatio-temporal index over a ColumnarData object of detections (see spatial_index.py)
+            The index supports cone searches (angle & time-window) returning row-numbers into the detections
+        '''
+        return spatial_index.DetectionIndex.from_detections(detections, **kwargs)
 
     def _check_imported_data_structure(self, dataDefinitions , dataKey, dataArray ):
         '''
@@ -96,37 +236,31 @@ class NEODATA():
             - We import one of these into dataDefinitions
            
         '''
-        # Split into "head" & "body"
-        headArray = [line for line in dataArray if '#' == line.strip()[0]]
-        body      = [line for line in dataArray if '#' != line.strip()[0]]
-        
-        # Check that all required fields are in one of the header lines
+        # Single pass through the data, separating the "head" from the "body" as we go
+        # - Check that all required fields are in one of the header lines
+        # - Populate a list with the data from the body
         headerKeys = ""
-        for line in headArray:
-            if len([key for key in dataDefinitions if key in line]) == len(dataDefinitions):
-                headerKeys = [_.strip() for _ in line[1:].split(",") ]
-                assert len(headerKeys) == len(dataDefinitions), ' differing lengths ... %r ,  %r' % (headerKeys , dataDefinitions)
-                break
-        assert headerKeys != "", 'could not find correct header line in ... \n \t %r ' % dataDefinitions
-
-        # Check body
-        # Populate a dictionary with the data from the body
         dataList = []
-        for line in body:
+        for line in dataArray:
+            if '#' == line.strip()[0]:
+                if headerKeys == "" and len([key for key in dataDefinitions if key in line]) == len(dataDefinitions):
+                    headerKeys = [_.strip() for _ in line[1:].split(",") ]
+                    assert len(headerKeys) == len(dataDefinitions), ' differing lengths ... %r ,  %r' % (headerKeys , dataDefinitions)
+                continue
             
             # split the line "intelligently":
             # - look for content inside "[ ... ]" as well as splitting on commas
             lineSplit = self._split_intelligently(line)
             
             # (i) check the number of fields is correct
-            if dataKey != 'trkID':
-                assert len(lineSplit) == len(dataDefinitions), 'dataKey'
+            assert len(lineSplit) == len(dataDefinitions), 'incorrect number of fields (%d != %d) for %s-data in line %r' % (len(lineSplit), len(dataDefinitions), dataKey, line)
         
             # (ii) insert additional checks of content
             # ...
             
             # (iii) append into list
             dataList.append( lineSplit )
+        assert headerKeys != "", 'could not find correct header line in ... \n \t %r ' % dataDefinitions
             
         #print('\n _check_imported_data_structure executed successfully')
         return headerKeys, dataList
@@ -134,73 +268,31 @@ class NEODATA():
     def _split_intelligently(self, line):
         '''
             # - look for content inside "[ ... ]" as well as splitting on commas
+            # - done in a single scan of the line (see columnar.tokenize_line)
         '''
-        if "[" in line:
-            
-            # find positions of []
-            left  = [m.start() for m in re.finditer('\[', line.strip())]
-            right = [m.start() for m in re.finditer('\]', line)]
-            
-            # identify the different "portions" of the string, and label them as to whether they are within a bracket region "[ ... ]" or not
-            # (i) starting region ...
-            regions            = [ (0, left[0]) ]
-            region_is_bracket  = [ False ]
-            # (ii) bracket regions ...
-            for l,r in zip( left, right ):
-                regions.append( (l,r+1) )
-                region_is_bracket.append( True )
-            # (iii) gaps between the brackets
-            for r,l in zip(right[:-1],left[1:]):
-                regions.append( (r+1,l) )
-                region_is_bracket.append( False )
-        
-            # Ensure the regions are sorted
-            regions, region_is_bracket = zip(*sorted(zip(regions, region_is_bracket)))
-
-            # split the regions on commas is they are a non-bracket region
-            lineSplit = []
-            for region, is_bracket in zip(regions, region_is_bracket):
-                regionStr = line[region[0]:region[1]]
-                if is_bracket:
-                    lineSplit.append(regionStr)
-                else:
-                    # getting rid of any gap regions which contain ONLY commas/blank-spaces
-                    tmp_ = [_.replace(' ','') for _ in regionStr.split(",") if _.replace(' ','') != '']
-                    if len(tmp_):
-                        lineSplit.extend(tmp_)
-        else:
-            # Just do a simple split based on commas
-            lineSplit = [_.strip() for _ in line.split(",") ]
-        return lineSplit
+        return columnar.tokenize_line(line)
 
     def check_tracklet_correspondance(self, detDict, trkDict, objDict):
         '''
         Perform a test/check to see whether
         (a) all of the tracklet-IDs that are in the *detection* dict have corresponding entries in the *tracklet* dict (and vice-versa)
         (b) all of the tracklet-IDs that are in the *tracklet* dict have corresponding entries in the *object* dict (and vice-versa)
+        
+        The dicts can also be ColumnarData objects (from the read_*_columnar functions)
+        The checks are vectorized (see joins.py) & any violations are summarized, rather than printed one-by-one
+        N.B. As before, objectIDs (from the tracklets) that are missing from the objects are reported, but are not an error
         '''
+        report = joins.check_correspondance(detDict, trkDict, objDict)
+        print(joins.summarize_report(report))
 
         # Check all of the tracklet-IDs that are in the *detection* dict have corresponding entries in the *tracklet* dict (and vice-versa)
-        trkIDsFromDetectionDict = { det['trkID'] : True for det in detDict.values() }
-        for trkID in trkIDsFromDetectionDict:
-            assert trkID in trkDict, '%s not in trkDict' % trkID
-        for trkID in trkDict:
-            assert trkID in trkIDsFromDetectionDict, '%s not in trkIDsFromDetectionDict and hence not in detDict' % trkID
+        assert len(report.detTrkIDsNotInTracklets) == 0, '%d trkIDs (e.g. %s) not in trkDict' % (len(report.detTrkIDsNotInTracklets), report.detTrkIDsNotInTracklets[0])
+        assert len(report.trkIDsWithoutDetections) == 0, '%d trkIDs (e.g. %s) not in trkIDsFromDetectionDict and hence not in detDict' % (len(report.trkIDsWithoutDetections), report.trkIDsWithoutDetections[0])
 
         # Check all of the object-IDs that are in the *tracklet* dict have corresponding entries in the *object* dict (and vice-versa)
-        objectIDsFromTrackletDict = { trk['objectID'] : True for trk in trkDict.values() }
-        cntNOT, cntIN = 0,0
-        for objectID in objectIDsFromTrackletDict:
-            #assert objectID in objDict, '%s (from TrackletDict) not in objDict' % objectID
-            if objectID not in objDict:
-                cntNOT +=1
-                print( '%s (from TrackletDict) not in objDict' % objectID)
-            else:
-                cntIN += 1
-                print(objectID , ' in as desired ...')
-        print(cntNOT, cntIN)
-        for objectID in objDict:
-            assert objectID in objectIDsFromTrackletDict, '%s not in objectIDsFromTrackletDict and hence not in trkDict' % objectID
+        nObjectIDs = len(np.unique(joins.get_column(trkDict, 'objectID')))
+        print(len(report.trkObjectIDsNotInObjects), nObjectIDs - len(report.trkObjectIDsNotInObjects))
+        assert len(report.objectIDsWithoutTracklets) == 0, '%d objectIDs (e.g. %s) not in objectIDsFromTrackletDict and hence not in trkDict' % (len(report.objectIDsWithoutTracklets), report.objectIDsWithoutTracklets[0])
 
         print("\n check_tracklet_correspondance successfully executed")
 
@@ -214,57 +306,86 @@ class NEODATA():
         '''
             convenience function to use the data in the object table to label the detections (and tracklets) with the NEO status
             - i.e. as would presumably be required if one wants to use labelled data for 'training' in an ML routine
+            
+            The IDs are joined with the vectorized look-ups in joins.py (see also generate_label_arrays) ...
+            ... & the labels are the isNEO values of objDict, unchanged (i.e. the 'True'/'False' strings)
         '''
-        
-        # Use the objectID label in each tracklet in trkDict to query the objDict and hence attach an 'isNEO' label to the tracklet data
-        trackletLabels  = { trkID : objDict[trk['objectID']]['isNEO'] for trkID, trk in trkDict.items() }
+        trkToObj = joins.lookup(joins.get_column(trkDict, 'objectID'), joins.get_keys(objDict))
+        detToTrk = joins.lookup(joins.get_column(detDict, 'trkID'), joins.get_keys(trkDict))
+        assert np.all(trkToObj >= 0), '%d tracklets have an objectID that is not in objDict' % np.sum(trkToObj < 0)
+        assert np.all(detToTrk >= 0), '%d detections have a trkID that is not in trkDict' % np.sum(detToTrk < 0)
 
-        # Use the trkID label in each detection in detDict to query the trackletLabels and hence attach an 'isNEO' label to the detection data
-        detectionLabels = { detID : trackletLabels[det['trkID']]      for detID, det in detDict.items() }
+        # Use the objectID of each tracklet to attach the 'isNEO' label of its object to the tracklet data
+        objectLabels    = [ obj['isNEO'] for obj in objDict.values() ]
+        trackletLabels  = [ objectLabels[n] for n in trkToObj.tolist() ]
+
+        # Use the trkID of each detection to attach the 'isNEO' label of its tracklet to the detection data
+        detectionLabels = { detID : trackletLabels[n] for detID, n in zip(detDict, detToTrk.tolist()) }
+        trackletLabels  = dict(zip( trkDict, trackletLabels ))
 
         print("\n generate_label_dictionaries successfully executed ")
         return trackletLabels, detectionLabels
 
+    def generate_label_arrays(self, detections, tracklets, objects):
+        '''
+            As generate_label_dictionaries, but returns boolean arrays aligned with the rows of the tracklets & detections ...
+            ... (trackletLabels, detectionLabels, trackletValid, detectionValid) : see joins.generate_labels
+            Intended for use with the ColumnarData objects from the read_*_columnar functions
+        '''
+        return joins.generate_labels(detections, tracklets, objects)
+
 
 
 # ---------------------------------------
 # Implement some tests/examples of data-read
 # ---------------------------------------
 
-# Define a useful NEODATA-class object to use for the ingest of data
-N = NEODATA()
-
-# ----------- SELECT SOURCE FILE LENGTH ----
-numberString = '1e6'
-
-# (i) Read detection data into a dictionary
-filepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' , 'sample_data_%s_real_detections.csv' % numberString)
-detDict = N.read_detection_data_into_dict(filepath)
-print(' There are %d unique detections' % len(detDict))
-d=detDict; key0 = list(d.keys())[0]; print("An example detection looks like ...\n", key0, d[key0])
-
-# (ii) Read tracklet data into a dictionary
-filepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' , 'sample_data_%s_real_tracklets.csv' % numberString)
-trkDict = N.read_tracklet_data_into_dict(filepath)
-print(' There are %d unique tracklets' % len(trkDict))
-d=trkDict; key0 = list(d.keys())[0]; print("An example tracklet looks like ...\n", key0, d[key0])
-
-# (iii) Read object data into a dictionary
-filepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' , 'sample_data_%s_real_objects.csv' % numberString)
-objDict = N.read_object_data_into_dict(filepath)
-print(' There are %d unique objects' % len(objDict))
-d=objDict; key0 = list(d.keys())[0]; print("An example object looks like ...\n", key0, d[key0])
-
-# (iv) Perform a test/check to see whether
-# - (a) all of the tracklet-IDs that are in the *detection* table have corresponding entries in the *tracklet* table (and vice-versa)
-# - (b) all of the tracklet-IDs that are in the *tracklet* table have corresponding entries in the *object* table (and vice-versa)
-N.check_tracklet_correspondance(detDict, trkDict, objDict)
-
-# (v) Use the data in the object table to label the detections (and tracklets) with the NEO status
-#  - i.e. as would presumably be required if one wants to use labelled data for 'training' in an ML routine
-trackletLabels, detectionLabels = N.generate_label_dictionaries(detDict, trkDict, objDict)
-print("len(detectionLabels)", len(detectionLabels))
-print("len(trackletLabels) ", len(trackletLabels))
-for trk in trkDict:
-    print("trkID=%20s :\t isNEO = %6s " % (trk, trackletLabels[trk]) )
-
+def main(argv=None, prog=None):
+    ''' Demonstrate the ingest of one of the samples: read, check & label the detections, tracklets & objects'''
+
+    import argparse
+
+    # ----------- SELECT SOURCE FILE LENGTH ----
+    parser = argparse.ArgumentParser(prog=prog, description='Read, check & label one of the samples in neo_ml/neo_ml/sample_data')
+    parser.add_argument('--numberString', default='1e6', help='Selects the sample_data_<numberString>_real_*.csv files')
+    parser.add_argument('--skipDuplicates', action='store_true', help='Skip (& report) rows with a duplicate detID/trkID/objectID, rather than failing')
+    args = parser.parse_args(argv)
+    numberString = args.numberString
+
+    # Define a useful NEODATA-class object to use for the ingest of data
+    N = NEODATA()
+
+    # (i) Read detection data into a dictionary
+    filepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' , 'sample_data_%s_real_detections.csv' % numberString)
+    detDict = N.read_detection_data_into_dict(filepath, skipDuplicates=args.skipDuplicates)
+    print(' There are %d unique detections' % len(detDict))
+    d=detDict; key0 = list(d.keys())[0]; print("An example detection looks like ...\n", key0, d[key0])
+
+    # (ii) Read tracklet data into a dictionary
+    filepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' , 'sample_data_%s_real_tracklets.csv' % numberString)
+    trkDict = N.read_tracklet_data_into_dict(filepath, skipDuplicates=args.skipDuplicates)
+    print(' There are %d unique tracklets' % len(trkDict))
+    d=trkDict; key0 = list(d.keys())[0]; print("An example tracklet looks like ...\n", key0, d[key0])
+
+    # (iii) Read object data into a dictionary
+    filepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' , 'sample_data_%s_real_objects.csv' % numberString)
+    objDict = N.read_object_data_into_dict(filepath, skipDuplicates=args.skipDuplicates)
+    print(' There are %d unique objects' % len(objDict))
+    d=objDict; key0 = list(d.keys())[0]; print("An example object looks like ...\n", key0, d[key0])
+
+    # (iv) Perform a test/check to see whether
+    # - (a) all of the tracklet-IDs that are in the *detection* table have corresponding entries in the *tracklet* table (and vice-versa)
+    # - (b) all of the tracklet-IDs that are in the *tracklet* table have corresponding entries in the *object* table (and vice-versa)
+    N.check_tracklet_correspondance(detDict, trkDict, objDict)
+
+    # (v) Use the data in the object table to label the detections (and tracklets) with the NEO status
+    #  - i.e. as would presumably be required if one wants to use labelled data for 'training' in an ML routine
+    trackletLabels, detectionLabels = N.generate_label_dictionaries(detDict, trkDict, objDict)
+    print("len(detectionLabels)", len(detectionLabels))
+    print("len(trackletLabels) ", len(trackletLabels))
+    for trk in trkDict:
+        print("trkID=%20s :\t isNEO = %6s " % (trk, trackletLabels[trk]) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+'''
+    Lightweight instrumentation (timers, counters & gauges) for the ingest & sample-data creation pipeline
+    Intended to show which stage of a (production) run is slow, and why detections/tracklets are being dropped
+
+     - timer(name)       : context manager, accumulating the number of calls & the wall-time of a stage
+     - count(name, n)    : counter (e.g. lines read, parse failures, tracklets rejected via ACCEPT=False)
+     - gauge(name, value): latest value of a quantity (e.g. the hits/misses of the observatory cache)
+    Optionally, the whole run can be profiled (cProfile), & the peak (traced) memory of each stage recorded (tracemalloc)
+
+    Instrumentation is disabled by default ...
+    ... while disabled, timer/count/gauge are no-ops, so the instrumented code pays only for an empty function call
+     - N.B. call them as instrumentation.timer(...) etc (rather than importing the names), so that enable/disable take effect
+     - counts within per-line loops should be accumulated locally & reported once per block
+     - timers & counters may be used from several threads (e.g. the stages of pipeline.py)
+
+    The metrics can be written as a Prometheus-style text file, or appended to a structured (JSON-lines) log
+
+    Usage (e.g.) ...
+    instrumentation.enable(profile=True, tracemalloc=True)
+    with instrumentation.timer('process_detections'):
+        ...
+        instrumentation.count('lines_read', nLines)
+    instrumentation.write_metrics('metrics.prom')
+    instrumentation.write_profile('profile.pstats')
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import re
+import json
+import time
+import functools
+import threading
+import tracemalloc as _tracemalloc
+
+
+# -----------------------------------
+# Define some useful class(es)
+# -----------------------------------
+
+class Metrics():
+    '''
+        Container for the metrics collected while instrumentation is enabled
+         - timers   : name -> { 'calls', 'seconds', 'peakBytes' }   (peakBytes only if tracemalloc is enabled)
+         - counters : name -> integer
+         - gauges   : name -> number
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.timers   = {}
+        self.counters = {}
+        self.gauges   = {}
+
+    def snapshot(self):
+        ''' A (json-serializable) copy of the metrics'''
+        return { 'timers'   : { k : dict(v) for k, v in self.timers.items() },
+                 'counters' : dict(self.counters),
+                 'gauges'   : dict(self.gauges) }
+
+    def merge(self, snapshot):
+        '''
+            Add the metrics from a snapshot (e.g. from a worker process) into these metrics
+            - timers & counters are summed, & gauges take the largest value (e.g. the largest cache of any worker)
+        '''
+        for name, t in snapshot['timers'].items():
+            mine = self.timers.setdefault(name, { 'calls' : 0, 'seconds' : 0. })
+            mine['calls']   += t['calls']
+            mine['seconds'] += t['seconds']
+            if 'peakBytes' in t:
+                mine['peakBytes'] = max(mine.get('peakBytes', 0), t['peakBytes'])
+        for name, n in snapshot['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        for name, value in snapshot['gauges'].items():
+            self.gauges[name] = max(self.gauges[name], value) if name in self.gauges else value
+
+
+class _NullTimer():
+    ''' The (single, re-used) context manager returned by timer() while instrumentation is disabled'''
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        return False
+
+class _Timer():
+    ''' Context manager that records the calls, wall-time (& optionally the peak traced memory) of a stage'''
+
+    # one entry per (nested) timer that is recording memory, in each thread : see __enter__/__exit__
+    # N.B. the traced memory is that of the whole process, so the peaks of stages running concurrently (in other threads) overlap
+    _local = threading.local()
+
+    @classmethod
+    def _stack(cls):
+        if not hasattr(cls._local, 'stack'):
+            cls._local.stack = []
+        return cls._local.stack
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _state['tracemalloc'] and _tracemalloc.is_tracing():
+            # N.B. reset_peak() is global : the peak so far is handed to the enclosing timer before it is reset
+            current, peak = _tracemalloc.get_traced_memory()
+            stack = _Timer._stack()
+            if stack:
+                stack[-1]['childPeak'] = max(stack[-1]['childPeak'], peak)
+            _tracemalloc.reset_peak()
+            stack.append( { 'start' : current, 'childPeak' : 0 } )
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        seconds = time.perf_counter() - self.start
+        with _lock:
+            t = METRICS.timers.setdefault(self.name, { 'calls' : 0, 'seconds' : 0. })
+            t['calls']   += 1
+            t['seconds'] += seconds
+        stack = _Timer._stack()
+        if _state['tracemalloc'] and _tracemalloc.is_tracing() and stack:
+            frame = stack.pop()
+            peak  = max(_tracemalloc.get_traced_memory()[1], frame['childPeak'])
+            with _lock:
+                t['peakBytes'] = max(t.get('peakBytes', 0), peak - frame['start'])
+            if stack:
+                stack[-1]['childPeak'] = max(stack[-1]['childPeak'], peak)
+        return False
+
+
+# -----------------------------------
+# Module-level state
+# -----------------------------------
+
+METRICS  = Metrics()
+_state   = { 'enabled' : False, 'tracemalloc' : False, 'profiler' : None }
+_NULL_TIMER = _NullTimer()
+# guards the updates of the timers & counters (which may be made from several threads)
+_lock    = threading.Lock()
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def _null_timer(name):
+    return _NULL_TIMER
+
+def _null_count(name, n=1):
+    pass
+
+def _null_gauge(name, value):
+    pass
+
+def _timer(name):
+    return _Timer(name)
+
+def _count(name, n=1):
+    with _lock:
+        METRICS.counters[name] = METRICS.counters.get(name, 0) + n
+
+def _gauge(name, value):
+    METRICS.gauges[name] = value
+
+# The public names are re-bound by enable/disable
+timer, count, gauge = _null_timer, _null_count, _null_gauge
+
+def is_enabled():
+    return _state['enabled']
+
+def enable(profile=False, tracemalloc=False):
+    '''
+        Start collecting metrics
+         - profile     : also run cProfile over everything until disable() (see write_profile)
+         - tracemalloc : also record the peak (python-allocated) memory of each timed stage (slows everything down!)
+    '''
+    global timer, count, gauge
+    timer, count, gauge = _timer, _count, _gauge
+    _state['enabled']     = True
+    _state['tracemalloc'] = tracemalloc
+    if tracemalloc and not _tracemalloc.is_tracing():
+        _tracemalloc.start()
+    if profile and _state['profiler'] is None:
+        import cProfile
+        _state['profiler'] = cProfile.Profile()
+        _state['profiler'].enable()
+
+def disable():
+    ''' Stop collecting metrics (any metrics / profile already collected are kept)'''
+    global timer, count, gauge
+    timer, count, gauge = _null_timer, _null_count, _null_gauge
+    _state['enabled'] = False
+    if _state['tracemalloc'] and _tracemalloc.is_tracing():
+        _tracemalloc.stop()
+    _state['tracemalloc'] = False
+    if _state['profiler'] is not None:
+        _state['profiler'].disable()
+
+def reset():
+    ''' Discard the metrics (& profile) collected so far'''
+    METRICS.reset()
+    if _state['profiler'] is not None:
+        _state['profiler'].disable()
+        _state['profiler'] = None
+
+def timed(name=None):
+    ''' Decorator : time every call of the decorated function (using the function's name, by default)'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_stats(prefix, stats, previous=None, counters=()):
+    '''
+        Record a dictionary of numbers (e.g. from ObservatoryPositionCache.stats()) as metrics named <prefix>_<key>
+         - the keys in counters are counted : the increase since previous (if given) ...
+         - ... the remainder are recorded as gauges
+    '''
+    for key, value in stats.items():
+        if key in counters:
+            count('%s_%s' % (prefix, key), value - (previous or {}).get(key, 0))
+        elif isinstance(value, (int, float)):
+            gauge('%s_%s' % (prefix, key), value)
+
+def snapshot():
+    return METRICS.snapshot()
+
+def merge(snapshot):
+    ''' Merge the metrics from another process (see Metrics.snapshot) into the metrics of this process'''
+    if _state['enabled'] and snapshot is not None:
+        METRICS.merge(snapshot)
+
+
+# -----------------------------------
+# Output
+# -----------------------------------
+
+def _metric_name(name):
+    ''' Prometheus metric names may only contain [a-zA-Z0-9_:]'''
+    return 'neo_ml_' + re.sub(r'[^a-zA-Z0-9_:]', '_', name)
+
+def format_prometheus(metrics=None):
+    ''' The metrics in the Prometheus text exposition format'''
+    metrics = METRICS.snapshot() if metrics is None else metrics
+    lines = []
+    if metrics['timers']:
+        for suffix, key, kind in (('stage_calls_total', 'calls', 'counter'), ('stage_seconds_total', 'seconds', 'counter'), ('stage_peak_traced_bytes', 'peakBytes', 'gauge')):
+            values = [ (stage, t[key]) for stage, t in sorted(metrics['timers'].items()) if key in t ]
+            if values:
+                lines.append('# TYPE %s %s' % (_metric_name(suffix), kind))
+                lines.extend( '%s{stage="%s"} %r' % (_metric_name(suffix), stage, value) for stage, value in values )
+    for name, value in sorted(metrics['counters'].items()):
+        lines.append('# TYPE %s counter' % _metric_name(name + '_total'))
+        lines.append('%s %r' % (_metric_name(name + '_total'), value))
+    for name, value in sorted(metrics['gauges'].items()):
+        lines.append('# TYPE %s gauge' % _metric_name(name))
+        lines.append('%s %r' % (_metric_name(name), value))
+    return "\n".join(lines) + "\n"
+
+def write_metrics(filepath, **context):
+    '''
+        Write the metrics to filepath
+         - *.json / *.jsonl : append one line (a JSON object, including a timestamp, the pid & any context) to a structured log
+         - anything else    : (over-)write a Prometheus-style text file (e.g. for the node-exporter textfile collector)
+    '''
+    if os.path.splitext(filepath)[1] in ('.json', '.jsonl'):
+        record = { 'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S'), 'pid' : os.getpid(), 'argv' : sys.argv }
+        record.update(context)
+        record.update(METRICS.snapshot())
+        with open(filepath, 'a') as fh:
+            fh.write(json.dumps(record) + "\n")
+    else:
+        # write-then-rename, so that a scraper never sees a partially written file
+        tmppath = filepath + '.tmp'
+        with open(tmppath, 'w') as fh:
+            fh.write(format_prometheus())
+        os.replace(tmppath, filepath)
+
+def write_profile(filepath, nLines=25):
+    '''
+        Dump the cProfile statistics (readable with pstats / snakeviz) & return a summary of the hottest functions
+        Returns None if profiling was not enabled
+    '''
+    profiler = _state['profiler']
+    if profiler is None:
+        return None
+    profiler.disable()
+    profiler.dump_stats(filepath)
+    if _state['enabled']:
+        profiler.enable()
+    import io
+    import pstats
+    stream = io.StringIO()
+    pstats.Stats(filepath, stream=stream).sort_stats('cumulative').print_stats(nLines)
+    return stream.getvalue()
+
+def summary():
+    ''' A compact, human-readable summary of the metrics'''
+    lines = []
+    for stage, t in sorted(METRICS.timers.items(), key=lambda item: -item[1]['seconds']):
+        peak = '  peak=%8.1fMB' % (t['peakBytes'] / 2**20) if 'peakBytes' in t else ''
+        lines.append('%-32s calls=%8d  seconds=%10.3f%s' % (stage, t['calls'], t['seconds'], peak))
+    for name, value in sorted(METRICS.counters.items()):
+        lines.append('%-32s %d' % (name, value))
+    for name, value in sorted(METRICS.gauges.items()):
+        lines.append('%-32s %r' % (name, value))
+    return "\n".join(lines)
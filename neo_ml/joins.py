@@ -0,0 +1,220 @@
+'''
+    Vectorized joins between the detection, tracklet & object data
+    Intended to replace the (row-by-row, dictionary-based) checks & labelling in ingest_demo.NEODATA ...
+    ... so that the referential integrity of the 1e6+ products can be checked (and labels generated) in seconds
+
+    The ID columns (trkID, objectID) are converted into integer row-numbers of the table they refer to ...
+    ... by joining on 64-bit hashes of the IDs (a sort of the hashes of the referenced keys, followed by a binary search) ...
+    ... after which every check / label is a numpy array operation
+
+    The functions accept either ColumnarData objects (see columnar.py) or the dict-of-dicts from NEODATA.read_*_into_dict
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+from collections import namedtuple
+import numpy as np
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import columnar
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def get_column(table, key):
+    '''
+        Extract a column from a ColumnarData object, or from a dict-of-dicts, as a numpy array
+        - For a dict-of-dicts, the rows are in the (insertion) order of the dictionary
+    '''
+    if isinstance(table, columnar.ColumnarData):
+        return table.columns[key]
+    return np.array([ row[key] for row in table.values() ])
+
+def get_keys(table):
+    ''' The dataKey column (i.e. the keys of the dict-of-dicts), as a numpy array'''
+    if isinstance(table, columnar.ColumnarData):
+        return table.columns[table.dataKey]
+    return np.array(list(table.keys()))
+
+def _common_dtype(*arrays):
+    ''' IDs are compared as fixed-width strings: bytes (if possible) or unicode'''
+    arrays = [ np.asarray(_) for _ in arrays ]
+    if all(_.dtype.kind == 'S' for _ in arrays) or all(_.dtype.kind == 'U' for _ in arrays):
+        return arrays
+    return [ _.astype('U') for _ in arrays ]
+
+def hash_keys(keys, width):
+    '''
+        64-bit hash of each entry of an array of fixed-width strings
+         - the raw bytes of each (zero-padded) string are viewed as width/8 64-bit words ...
+         - ... which are mixed together (FNV-1a style, then a final avalanche) in a few whole-array operations
+         - the (all-zero) words of padding are skipped, so the hash of a string does not depend on width ...
+           ... & so the hashes of arrays hashed with different widths (e.g. successive batches) can be compared
+        N.B. width [bytes] must be enough to hold the widest string (see _hash_width)
+    '''
+    keys  = np.asarray(keys)
+    # N.B. each unicode character occupies 4 bytes
+    kind  = keys.dtype.kind
+    words = np.ascontiguousarray( keys.astype('%s%d' % (kind, width // 4 if kind == 'U' else width)) ).view(np.uint64).reshape(len(keys), -1)
+    return hash_words(words, skipZeroWords=True)
+
+def hash_words(words, skipZeroWords=False):
+    '''
+        64-bit hash of each row of an (N, nWords) array of 64-bit words (e.g. integer-valued composite keys)
+         - skipZeroWords : ignore the words that are zero (i.e. padding), rather than mixing them in
+    '''
+    words = np.ascontiguousarray(words).view(np.uint64).reshape(len(words), -1)
+    h = np.full(len(words), 0xcbf29ce484222325, dtype=np.uint64)
+    for n in range(words.shape[1]):
+        mixed  = h ^ words[:,n]
+        mixed *= np.uint64(0x100000001b3)
+        mixed ^= mixed >> np.uint64(29)
+        h = np.where(words[:,n] != 0, mixed, h) if skipZeroWords else mixed
+    h *= np.uint64(0xbf58476d1ce4e5b9)
+    h ^= h >> np.uint64(32)
+    return h
+
+def _hash_width(*arrays):
+    ''' Number of bytes (a multiple of 8) needed to hold the widest string in any of the arrays'''
+    return max( 8, *[ -(-np.asarray(_).dtype.itemsize // 8) * 8 for _ in arrays ] )
+
+def lookup(keys, tableKeys):
+    '''
+        For each entry of keys, find the row-number of the matching entry of tableKeys (a join)
+        - Returns -1 for keys that are not present in tableKeys
+        - If tableKeys contains duplicates, one of the matching rows is returned (see find_duplicates)
+        - The join is done on 64-bit hashes of the keys, & the matches are then verified against the keys themselves
+    '''
+    keys, tableKeys = _common_dtype(keys, tableKeys)
+    if len(tableKeys) == 0 or len(keys) == 0:
+        return np.full(len(keys), -1, dtype=np.int64)
+    width       = _hash_width(keys, tableKeys)
+    tableHashes = hash_keys(tableKeys, width)
+    order       = np.argsort(tableHashes)
+    sortedHashes= tableHashes[order]
+    if np.any( (sortedHashes[1:] == sortedHashes[:-1]) & (tableKeys[order[1:]] != tableKeys[order[:-1]]) ):
+        # (astronomically unlikely) hash collision between two different table keys : join on the strings themselves
+        order      = np.argsort(tableKeys, kind='stable')
+        sortedKeys = tableKeys[order]
+        position   = np.minimum(np.searchsorted(sortedKeys, keys), len(order) - 1)
+        return np.where(sortedKeys[position] == keys, order[position], -1).astype(np.int64)
+    hashes   = hash_keys(keys, width)
+    # N.B. searching for the keys in sorted order is several times faster (cache-friendly) than in random order
+    queryOrder = np.argsort(hashes)
+    position   = np.empty(len(hashes), dtype=np.int64)
+    position[queryOrder] = np.minimum(np.searchsorted(sortedHashes, hashes[queryOrder]), len(order) - 1)
+    rows     = order[position]
+    found    = (sortedHashes[position] == hashes) & (tableKeys[rows] == keys)
+    return np.where(found, rows, -1).astype(np.int64)
+
+def find_duplicates(keys):
+    ''' The (unique) values that appear more than once in keys'''
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return keys
+    # only the (few) keys with a repeated hash need to be compared as strings
+    hashes       = hash_keys(keys, _hash_width(keys))
+    sortedHashes = np.sort(hashes)
+    repeated     = sortedHashes[1:][ sortedHashes[1:] == sortedHashes[:-1] ]
+    if len(repeated) == 0:
+        return keys[:0]
+    candidates = keys[ np.isin(hashes, repeated) ]
+    uniques, counts = np.unique(candidates, return_counts=True)
+    return uniques[counts > 1]
+
+def _examples(values, nExamples=5):
+    ''' A few of the values, as python strings (for the summary)'''
+    return [ _.decode() if isinstance(_, bytes) else str(_) for _ in np.asarray(values)[:nExamples].tolist() ]
+
+
+# -----------------------------------
+# Referential integrity
+# -----------------------------------
+
+IntegrityReport = namedtuple('IntegrityReport', [
+    'duplicateDetIDs',          # detIDs appearing more than once in the detections
+    'duplicateTrkIDs',          # trkIDs appearing more than once in the tracklets
+    'duplicateObjectIDs',       # objectIDs appearing more than once in the objects
+    'detTrkIDsNotInTracklets',  # trkIDs of detections that have no tracklet
+    'trkIDsWithoutDetections',  # trkIDs of tracklets that have no detections
+    'trkObjectIDsNotInObjects', # objectIDs of tracklets that have no object
+    'objectIDsWithoutTracklets',# objectIDs of objects that have no tracklets
+])
+
+def check_correspondance(detections, tracklets, objects):
+    '''
+        Check (in both directions) the correspondance between ...
+        (a) the trkIDs of the detections & of the tracklets
+        (b) the objectIDs of the tracklets & of the objects
+        Returns an IntegrityReport : each field is a (unique) array of the offending IDs (empty => no problems)
+    '''
+    detTrkIDs, trkIDs = get_column(detections, 'trkID'), get_keys(tracklets)
+    trkObjectIDs, objectIDs = get_column(tracklets, 'objectID'), get_keys(objects)
+
+    # detections -> tracklets, & tracklets that are never referenced
+    detToTrk = lookup(detTrkIDs, trkIDs)
+    trkHasDetections = np.zeros(len(trkIDs), dtype=bool)
+    trkHasDetections[ detToTrk[detToTrk >= 0] ] = True
+
+    # tracklets -> objects, & objects that are never referenced
+    trkToObj = lookup(trkObjectIDs, objectIDs)
+    objHasTracklets = np.zeros(len(objectIDs), dtype=bool)
+    objHasTracklets[ trkToObj[trkToObj >= 0] ] = True
+
+    return IntegrityReport(
+        duplicateDetIDs           = find_duplicates(get_keys(detections)),
+        duplicateTrkIDs           = find_duplicates(trkIDs),
+        duplicateObjectIDs        = find_duplicates(objectIDs),
+        detTrkIDsNotInTracklets   = np.unique(detTrkIDs[detToTrk < 0]),
+        trkIDsWithoutDetections   = np.unique(trkIDs[~trkHasDetections]),
+        trkObjectIDsNotInObjects  = np.unique(trkObjectIDs[trkToObj < 0]),
+        objectIDsWithoutTracklets = np.unique(objectIDs[~objHasTracklets]),
+    )
+
+def report_is_ok(report):
+    ''' True if the IntegrityReport contains no violations at all'''
+    return all( len(_) == 0 for _ in report )
+
+def summarize_report(report, nExamples=5):
+    ''' A compact (multi-line) description of an IntegrityReport: one line per type of violation'''
+    if report_is_ok(report):
+        return 'no violations'
+    lines = []
+    for field, values in zip(report._fields, report):
+        if len(values):
+            lines.append('%-26s : %8d  e.g. %s' % (field, len(values), ", ".join(_examples(values, nExamples))))
+    return "\n".join(lines)
+
+
+# -----------------------------------
+# Labelling
+# -----------------------------------
+
+def _as_bool(values):
+    ''' isNEO is a bool column in ColumnarData, but a "True"/"False" string in the dict-of-dicts'''
+    values = np.asarray(values)
+    return values if values.dtype == bool else np.char.strip(values.astype(str)) == 'True'
+
+def generate_labels(detections, tracklets, objects, labelKey='isNEO'):
+    '''
+        Use the objects to label the tracklets & detections (e.g. with their NEO status)
+        Returns (trackletLabels, detectionLabels, trackletValid, detectionValid) ...
+        ... boolean arrays aligned with the rows of the tracklets & detections respectively
+         - the *Valid arrays are False for rows whose tracklet/object could not be found (their label is then False)
+    '''
+    objectLabels = _as_bool(get_column(objects, labelKey))
+    trkToObj = lookup(get_column(tracklets, 'objectID'), get_keys(objects))
+    trackletValid  = trkToObj >= 0
+    trackletLabels = trackletValid & objectLabels[np.maximum(trkToObj, 0)] if len(objectLabels) else np.zeros(len(trkToObj), dtype=bool)
+
+    detToTrk = lookup(get_column(detections, 'trkID'), get_keys(tracklets))
+    detectionValid  = (detToTrk >= 0) & trackletValid[np.maximum(detToTrk, 0)] if len(trkToObj) else np.zeros(len(detToTrk), dtype=bool)
+    detectionLabels = detectionValid & trackletLabels[np.maximum(detToTrk, 0)] if len(trkToObj) else np.zeros(len(detToTrk), dtype=bool)
+    return trackletLabels, detectionLabels, trackletValid, detectionValid
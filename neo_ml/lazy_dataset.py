@@ -0,0 +1,241 @@
+'''
+    Lazy (on-demand) access to the sample data : each column is only loaded (& parsed) when it is first used
+    Intended for analyses that only touch a handful of the columns (e.g. trkID, objectID & meanAngRate) ...
+    ... and so should not pay for reading all 13 of the detection fields
+
+     - LazyColumnarData behaves like the ColumnarData objects of columnar.py ...
+       ... but its columns (self.columns) are loaded on first access, & then cached
+     - Filters (e.g. a time-range, a list of obsCodes, or isNEO) are pushed down into the loading ...
+       ... so that the rows which do not match them are never converted into numpy arrays
+     - The data can be either a (possibly compressed) csv file, or a binary (.npy.d) dataset (see storage.py)
+
+    Usage (e.g.) ...
+    detections = NEODATA().lazy_detections(filepath).where(timeUTC=lazy_dataset.between(2458800., 2458900.), obsCode=['F51', 'F52'])
+    detections.columns['Vmag']          # only reads & parses the timeUTC, obsCode & Vmag columns
+    detections.load('detID', 'trkID')   # several columns can be loaded in a single pass over a csv file
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import itertools
+from collections.abc import Mapping
+import numpy as np
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import data
+import columnar
+import storage
+import instrumentation
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def between(lo=None, hi=None):
+    ''' Filter selecting lo <= value < hi (either limit can be None)'''
+    def _between(col):
+        mask = np.ones(len(col), dtype=bool)
+        if lo is not None:
+            mask &= col >= lo
+        if hi is not None:
+            mask &= col < hi
+        return mask
+    return _between
+
+def _as_filter(condition):
+    '''
+        Convert a condition into a function that maps a column onto a boolean mask
+         - a callable is used as it is (e.g. between(lo, hi), or lambda col: col < 20.)
+         - a list / tuple / set / array selects the rows whose value is any of those supplied
+         - anything else selects the rows whose value is equal to the condition
+        N.B. strings are compared with the (bytes) entries of 'S' columns
+    '''
+    if callable(condition):
+        return condition
+    def _encode(value):
+        return value.encode() if isinstance(value, str) else value
+    if isinstance(condition, (list, tuple, set, frozenset, np.ndarray)):
+        values = np.array([ _encode(_) for _ in condition ]) if not isinstance(condition, np.ndarray) else condition
+        if values.dtype.kind == 'U':
+            values = np.char.encode(values)
+        return lambda col: np.isin(col, values)
+    return lambda col: col == _encode(condition)
+
+
+# -----------------------------------
+# Define some useful class(es)
+# -----------------------------------
+
+class LazyColumns(Mapping):
+    ''' The columns of a LazyColumnarData : each is loaded when it is first accessed, & then cached'''
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __getitem__(self, key):
+        if key not in self.dataset.fieldDtypes:
+            raise KeyError(key)
+        return self.dataset.column(key)
+
+    def __iter__(self):
+        return iter(self.dataset.fields())
+
+    def __len__(self):
+        return len(self.dataset.fieldDtypes)
+
+
+class LazyColumnarData(columnar.ColumnarData):
+    '''
+        A ColumnarData object whose columns are loaded on demand (& cached), for the rows that pass the filters
+         - filepath  : a csv file (possibly compressed) or a binary (.npy.d) dataset
+         - filters   : dictionary of {field : condition} (see _as_filter), all of which must be satisfied
+         - chunkSize : approximate number of csv lines parsed at once (see columnar.iterate_over_blocks)
+
+        For a csv file, each (batch of) column(s) costs a pass over the file ...
+         - ... but only the requested columns (& the filter columns, the first time) are converted
+         - the mask of the rows that pass the filters is cached, so the filter columns are only converted once
+        For a binary dataset, the columns are memory-mapped, & only the selected rows are copied
+    '''
+
+    def __init__(self, filepath, fieldDefinitions, fieldDtypes, dataKey, filters=None, chunkSize=100000):
+        assert set(fieldDtypes) == set(fieldDefinitions), 'fieldDtypes do not match fieldDefinitions'
+        assert dataKey in fieldDtypes, 'dataKey %r not in fields %r' % (dataKey, list(fieldDtypes))
+        self.filepath         = filepath
+        self.fieldDefinitions = fieldDefinitions
+        self.fieldDtypes      = fieldDtypes
+        self.dataKey          = dataKey
+        self.filters          = dict(filters or {})
+        self.chunkSize        = chunkSize
+        for key in self.filters:
+            assert key in fieldDtypes, 'cannot filter on unknown field %r' % key
+            assert fieldDtypes[key] != 'ragged', 'cannot filter on ragged field %r' % key
+
+        self.isBinary = storage.is_binary_dataset(filepath)
+        assert self.isBinary or os.path.isfile(filepath), 'filepath could not be found : %r ' % filepath
+        self._source  = storage.read_columnar(filepath, mmap=True) if self.isBinary else None
+        self._mask    = None
+        self._cache   = {}
+        self._index   = None
+        self.columns  = LazyColumns(self)
+
+    def __len__(self):
+        if self._mask is None and not self.filters and self.isBinary:
+            return len(self._source)
+        return len(self.column(self.dataKey))
+
+    def fields(self):
+        ''' The names of all of the columns (loaded or not)'''
+        return list(self._source.columns) if self.isBinary else sorted(self.fieldDtypes)
+
+    def loaded(self):
+        ''' The names of the columns that have been loaded so far'''
+        return list(self._cache)
+
+    def where(self, **filters):
+        ''' A new LazyColumnarData, with the supplied filters added to those of this one'''
+        combined = dict(self.filters)
+        for key, condition in filters.items():
+            assert key not in combined, 'field %r is already filtered' % key
+            combined[key] = condition
+        return LazyColumnarData(self.filepath, self.fieldDefinitions, self.fieldDtypes, self.dataKey, filters=combined, chunkSize=self.chunkSize)
+
+    def column(self, key):
+        ''' The (filtered) column, loading it if necessary'''
+        if key not in self._cache:
+            self.load(key)
+        return self._cache[key]
+
+    def load(self, *keys):
+        ''' Load (in a single pass, for a csv file) any of the columns that have not yet been loaded'''
+        keys = [ key for key in dict.fromkeys(keys) if key not in self._cache ]
+        for key in keys:
+            assert key in self.fieldDtypes, 'unknown field %r' % key
+        if not keys:
+            return self
+        with instrumentation.timer('lazy_load'):
+            if self.isBinary:
+                self._load_binary(keys)
+            else:
+                self._load_csv(keys)
+        instrumentation.count('lazy_columns_loaded', len(keys))
+        return self
+
+    def mask(self):
+        ''' Boolean mask of the rows (of the file) that pass the filters'''
+        if self._mask is None:
+            if self.isBinary:
+                self._mask = np.ones(len(self._source), dtype=bool)
+                for key, condition in self.filters.items():
+                    self._mask &= _as_filter(condition)( np.asarray(self._source.columns[key]) )
+            else:
+                self._load_csv([])
+        return self._mask
+
+    def _load_binary(self, keys):
+        indices = None if not self.filters else np.flatnonzero(self.mask())
+        for key in keys:
+            col = self._source.columns[key]
+            if indices is None:
+                self._cache[key] = col
+            elif isinstance(col, columnar.RaggedArray):
+                self._cache[key] = col.take(indices)
+            else:
+                self._cache[key] = col[indices]
+
+    def _load_csv(self, keys):
+        '''
+            A single pass over the csv file, converting (only) the selected rows of the requested columns
+            The filter columns are converted on the first pass, to make the mask (which is then cached)
+        '''
+        makeMask = self._mask is None
+        chunks   = { key : [] for key in keys }
+        masks    = []
+        start    = 0
+        for headerKeys, strings in columnar.iterate_over_blocks(self.filepath, self.fieldDefinitions, self.fieldDtypes, chunkSize=self.chunkSize):
+            strings = dict(zip(headerKeys, strings))
+            nRows   = len(strings[self.dataKey])
+
+            # the rows of this block that pass the filters
+            if makeMask:
+                blockMask = np.ones(nRows, dtype=bool)
+                for key, condition in self.filters.items():
+                    blockMask &= _as_filter(condition)( columnar.convert_column(strings[key], self.fieldDtypes[key]) )
+                masks.append(blockMask)
+            else:
+                blockMask = self._mask[start:start + nRows]
+            start += nRows
+
+            # convert only the selected rows
+            selectAll = bool(blockMask.all())
+            for key in keys:
+                selected = strings[key] if selectAll else list(itertools.compress(strings[key], blockMask))
+                chunks[key].append( columnar.convert_column(selected, self.fieldDtypes[key]) )
+
+        if makeMask:
+            self._mask = np.concatenate(masks) if masks else np.zeros(0, dtype=bool)
+        for key in keys:
+            self._cache[key] = columnar.concatenate_chunks(chunks[key], self.fieldDtypes[key])
+
+    def materialize(self):
+        ''' Load all of the columns, returning an (ordinary) ColumnarData object'''
+        self.load(*self.fields())
+        return columnar.ColumnarData({ key : self._cache[key] for key in self.fields() }, self.dataKey)
+
+
+def lazy_detections(filepath, chunkSize=100000, **filters):
+    ''' Lazily read detection-data (keyed on detID), with any filters (see LazyColumnarData)'''
+    return LazyColumnarData(filepath, data.detection_field_definitions, data.detection_field_dtypes, 'detID', filters=filters, chunkSize=chunkSize)
+
+def lazy_tracklets(filepath, chunkSize=100000, **filters):
+    ''' Lazily read tracklet-data (keyed on trkID), with any filters (see LazyColumnarData)'''
+    return LazyColumnarData(filepath, data.tracklet_field_definitions, data.tracklet_field_dtypes, 'trkID', filters=filters, chunkSize=chunkSize)
+
+def lazy_objects(filepath, chunkSize=100000, **filters):
+    ''' Lazily read object-data (keyed on objectID), with any filters (see LazyColumnarData)'''
+    return LazyColumnarData(filepath, data.object_field_definitions, data.object_field_dtypes, 'objectID', filters=filters, chunkSize=chunkSize)
@@ -0,0 +1,205 @@
+'''
+    Vectorized parsing of (optical) observations in the MPC's 80-column (obs80) format
+    Intended for use by sample_data_creation.py, as a replacement for parsing each line with obs80.parseOpt
+
+     - A batch of records is converted into a single fixed-width array, which is then viewed as ...
+       ... (a) a 2D array of character codes, from which all of the numeric fields are parsed at once, by (exact) matrix products
+       ... (b) a structured dtype, from which the text fields (e.g. the obsCode) are taken as they are
+     - Instead of raising an exception, parse_obs80 returns a boolean mask of the records that were parsed successfully
+
+    The columns used are (1-based, inclusive, as in the MPC documentation) ...
+     - 15     : note 2 (records that are not optical RA/Dec observations, e.g. radar, are rejected)
+     - 16-32  : date of the observation (UTC) "YYYY MM DD.dddddd"
+     - 33-44  : RA  "HH MM SS.ddd" (or "HH MM.mmmm")
+     - 45-56  : Dec "sDD MM SS.dd" (or "sDD MM.mmm")
+     - 66-70  : magnitude (may be blank)
+     - 78-80  : observatory code
+
+    Usage (e.g.) ...
+    columns, ok = obs80_parser.parse_obs80(["     K17A00Z 5C2014 04 28.98950 13 24 42.05 -19 38 29.3                L~2ClrW84"])
+    columns['jdutc'][ok], columns['ra'][ok] ...
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import numpy as np
+
+
+# Width of an obs80 record (records may also carry a trailing newline)
+RECORD_LENGTH = 80
+
+# Text fields, as (0-based) [start, end) columns of the record
+TEXT_FIELDS = { 'note2' : (14, 15), 'cod' : (77, 80) }
+
+# Numeric fields, as (0-based) [start, end) columns of the record, & the column of the decimal point (None => integer)
+NUMERIC_FIELDS = { 'year'           : (15, 19, None),
+                   'month'          : (20, 22, None),
+                   'day'            : (23, 32, 25),
+                   'raHours'        : (32, 34, None),
+                   'raMinutes'      : (35, 37, None),
+                   'raSeconds'      : (38, 44, 40),
+                   'raDecMinutes'   : (35, 44, 37),
+                   'decDegrees'     : (45, 47, None),
+                   'decMinutes'     : (48, 50, None),
+                   'decSeconds'     : (51, 56, 53),
+                   'decDecMinutes'  : (48, 56, 50),
+                   'mag'            : (65, 70, 67) }
+
+# Values of note 2 that do not indicate an optical RA/Dec observation ...
+# ... radar observations (R, r) & the second lines of satellite / roving observations (s, v)
+NON_OPTICAL_NOTES = ['R', 'r', 's', 'v']
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def _record_dtype(width):
+    ''' Structured dtype viewing the text fields of records held as a 'U<width>' array'''
+    return np.dtype({ 'names'    : list(TEXT_FIELDS),
+                      'formats'  : [ 'U%d' % (end - start) for start, end in TEXT_FIELDS.values() ],
+                      'offsets'  : [ 4 * start for start, end in TEXT_FIELDS.values() ],
+                      'itemsize' : 4 * width })
+
+def _field_matrices():
+    '''
+        Matrices (nColumns, nFields) that combine the (per-character) quantities over the columns of each numeric field
+        (the columns being those of _NUMERIC_SPAN, the span of all of the NUMERIC_FIELDS)
+         - weights : the power of 10 of each digit-column (ignoring the decimal point)
+         - digits  : 1 for the digit-columns (i.e. all columns other than the decimal point)
+         - dots    : 1 for the column of the decimal point
+         - first   : 1 for the first column
+         - inner   : 1 for the remaining columns
+        & scales : the power of 10 by which the (integer) sum of the weighted digits must be divided
+    '''
+    # N.B. the counts are small integers, so are exact in float32 (which halves the cost of the matrix products)
+    shape    = (_NUMERIC_SPAN.stop - _NUMERIC_SPAN.start, len(NUMERIC_FIELDS))
+    matrices = { key : np.zeros(shape, dtype=np.float64 if key == 'weights' else np.float32) for key in ['weights', 'digits', 'dots', 'first', 'inner'] }
+    scales   = np.ones(len(NUMERIC_FIELDS))
+    for n, (start, end, dot) in enumerate(NUMERIC_FIELDS.values()):
+        start, end, dot = start - _NUMERIC_SPAN.start, end - _NUMERIC_SPAN.start, None if dot is None else dot - _NUMERIC_SPAN.start
+        positions = [ j for j in range(start, end) if j != dot ]
+        matrices['weights'][positions, n] = 10. ** np.arange(len(positions) - 1, -1, -1)
+        matrices['digits'][positions, n]  = 1
+        if dot is not None:
+            matrices['dots'][dot, n] = 1
+            scales[n] = 10. ** (end - 1 - dot)
+        matrices['first'][start, n]       = 1
+        matrices['inner'][start + 1:end, n] = 1
+    return matrices, scales
+
+_NUMERIC_SPAN = slice( min(start for start, end, dot in NUMERIC_FIELDS.values()), max(end for start, end, dot in NUMERIC_FIELDS.values()) )
+_FIELD_MATRICES, _FIELD_SCALES = _field_matrices()
+
+def _parse_numeric_fields(codes):
+    '''
+        Parse all of the (unsigned, decimal) NUMERIC_FIELDS of every record at once
+         - codes : (N, RECORD_LENGTH) array of character codes (of which only the _NUMERIC_SPAN is used)
+         - a field may have leading / trailing blanks, but the remaining characters must be contiguous digits ...
+           ... with a decimal point (if any) in the column given in NUMERIC_FIELDS (or a blank, if there are no digits after it)
+        Returns (values, valid, blank) : (N, nFields) arrays, with the values nan where the field is blank or invalid
+         - N.B. blanks count as zeros: the integer formed by the digits is accumulated exactly ...
+           ... & then divided once by a power of 10, so the values are identical to those given by float() of the field
+    '''
+    codes    = codes[:, _NUMERIC_SPAN]
+    digits   = codes - np.uint32(ord('0'))      # N.B. wraps around (to > 9) for the codes below '0'
+    isDigit  = digits <= 9
+    isDot    = codes == ord('.')
+    nonBlank = codes != ord(' ')
+    runStart = nonBlank.copy()
+    runStart[:, 1:] &= ~nonBlank[:, :-1]
+
+    # the quantities are summed over the columns of each field by (exact, as they are small integers) matrix products
+    M = _FIELD_MATRICES
+    values  = (digits * isDigit).astype(np.float64) @ M['weights'] / _FIELD_SCALES
+    nDigits = isDigit.astype(np.float32) @ M['digits']
+    nBad    = (nonBlank & ~isDigit).astype(np.float32) @ M['digits'] + (nonBlank & ~isDot).astype(np.float32) @ M['dots']
+    nRuns   = nonBlank.astype(np.float32) @ M['first'] + runStart.astype(np.float32) @ M['inner']
+
+    valid = (nBad == 0) & (nDigits > 0) & (nRuns == 1)
+    blank = nRuns == 0
+    values[~valid] = np.nan
+    return values, valid, blank
+
+def _sexagesimal(fields, codes, prefix):
+    '''
+        Combine the parts of a sexagesimal field (prefix 'ra' or 'dec') : "XX MM SS.sss" (the seconds may be blank) or "XX MM.mmmm"
+         - fields : name -> (values, valid, blank) of the NUMERIC_FIELDS
+        Returns (values, valid), with values in the units of the first (two-digit) part
+    '''
+    units,          unitsValid,          _            = fields['raHours' if prefix == 'ra' else 'decDegrees']
+    minutes,        minutesValid,        _            = fields[prefix + 'Minutes']
+    seconds,        secondsValid,        secondsBlank = fields[prefix + 'Seconds']
+    decimalMinutes, decimalMinutesValid, _            = fields[prefix + 'DecMinutes']
+
+    # N.B. the character after the (integer) minutes distinguishes the two forms
+    start, end, dot = NUMERIC_FIELDS[prefix + 'DecMinutes']
+    isDecimal = codes[:, dot] == ord('.')
+    values    = np.where(isDecimal, units + decimalMinutes / 60., units + minutes / 60. + np.nan_to_num(seconds) / 3600.)
+    valid     = np.where(isDecimal, decimalMinutesValid & (decimalMinutes < 60.),
+                                    minutesValid & (secondsValid | secondsBlank) & (codes[:, dot] == ord(' ')) & (minutes < 60.) & ~(seconds >= 60.))
+    valid    &= unitsValid & (codes[:, start - 1] == ord(' '))
+    return values, valid
+
+def julian_date(year, month, day):
+    '''
+        Julian date of (arrays of) the Gregorian calendar year, month & (fractional) day of the month
+        N.B. the day-number is calculated exactly, & the fraction of the day is added last
+    '''
+    a = (14 - month) // 12
+    y = year + 4800 - a
+    m = month + 12 * a - 3
+    dayNumber = np.floor(day)
+    jdn = dayNumber + (153 * m + 2) // 5 + 365 * y + y // 4 - y // 100 + y // 400 - 32045
+    return (jdn - 0.5) + (day - dayNumber)
+
+def parse_obs80(records):
+    '''
+        Parse a batch of obs80 records (strings, with or without a trailing newline)
+        Returns (columns, ok)
+         - columns : dictionary of arrays ...
+                     'jdutc' : Julian date (UTC)
+                     'ra'    : RA  [HOURS]
+                     'dec'   : Dec [DEGREES]
+                     'mag'   : magnitude (nan if blank)
+                     'cod'   : observatory code
+         - ok      : boolean mask of the records that were parsed successfully
+                     (the columns of the other records are nan / undefined)
+    '''
+    width   = RECORD_LENGTH + 2
+    strings = np.array(records, dtype='U%d' % width).reshape(-1)
+    codes   = strings.view(np.uint32).reshape(len(strings), width)
+
+    # the record must be exactly RECORD_LENGTH characters, other than a trailing newline
+    ok = (codes[:, RECORD_LENGTH - 1] != 0) & np.isin(codes[:, RECORD_LENGTH:], [0, ord('\n'), ord('\r')]).all(axis=1)
+    values, valid, blank = _parse_numeric_fields(codes[:, :RECORD_LENGTH])
+    fields = { name : (values[:, n], valid[:, n], blank[:, n]) for n, name in enumerate(NUMERIC_FIELDS) }
+
+    # text fields
+    text = strings.view(_record_dtype(width))
+    ok  &= ~np.isin(text['note2'], NON_OPTICAL_NOTES)
+
+    # date
+    (year, yearValid, _), (month, monthValid, _), (day, dayValid, _) = fields['year'], fields['month'], fields['day']
+    ok &= yearValid & monthValid & dayValid & (codes[:, 19] == ord(' ')) & (codes[:, 22] == ord(' '))
+    ok &= (month >= 1) & (month <= 12) & (day >= 1) & (day < 32)
+
+    # RA & Dec (N.B. the sign of the Dec is in its own column)
+    ra,  raValid  = _sexagesimal(fields, codes, 'ra')
+    dec, decValid = _sexagesimal(fields, codes, 'dec')
+    sign = codes[:, 44]
+    ok &= raValid & (ra < 24.) & decValid & (dec <= 90.) & ((sign == ord('+')) | (sign == ord('-')))
+    dec = np.where(sign == ord('-'), -dec, dec)
+
+    # magnitude (which may be blank)
+    mag, magValid, magBlank = fields['mag']
+    ok &= magValid | magBlank
+
+    columns = { 'jdutc' : julian_date(year, month, day),
+                'ra'    : ra,
+                'dec'   : dec,
+                'mag'   : mag,
+                'cod'   : text['cod'].astype(str) }
+    return columns, ok
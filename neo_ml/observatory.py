@@ -0,0 +1,113 @@
+'''
+    Cached calculation of the heliocentric position of the observatory at the time of each detection
+    Intended for use by sample_data_creation.py
+
+    Calculating an observatory position requires an ephemeris look-up (via the internal MPC_library) ...
+    ... but the detections from a single exposure all share the same (obsCode, JDutc), and a handful of survey sites dominate the data
+     - So we keep a single Observatory instance, and memoize the positions in an LRU cache keyed on (obsCode, JDutc)
+     - Positions can (optionally) be interpolated from a regular time-grid, so that nearby times share the same look-ups
+
+'''
+
+# ----------------------------------------
+# Third-party imports
+# ----------------------------------------
+import functools
+import numpy as np
+
+
+# ----------------------------------------
+# Define some useful class(es)
+# ----------------------------------------
+
+class ObservatoryPositionCache():
+    '''
+        Memoized look-up of heliocentric observatory positions (EQUATORIAL coords [au])
+
+        maxsize           : maximum number of (obsCode, JDutc) positions held in the LRU cache (None => unbounded)
+        interpolationStep : if not None, positions are interpolated (4-point Lagrange) from positions calculated ...
+                            ... on a regular grid of times with this spacing [days]
+                            - the observatory rotates with the Earth, so the step should be << 1 day (e.g. 1/24)
+    '''
+
+    def __init__(self, maxsize=2**17, interpolationStep=None):
+        self.interpolationStep = interpolationStep
+        self.nRequested        = 0
+        self._observatory      = None
+        self._lookup           = functools.lru_cache(maxsize=maxsize)(self._calculate_position)
+
+    @property
+    def observatory(self):
+        ''' A single (lazily created) Observatory instance, shared by all of the look-ups'''
+        if self._observatory is None:
+            # MPC_library is internal to the MPC (& slow to import), so it is only imported when a position is needed
+            import MPC_library as MPCL
+            self._observatory = MPCL.Observatory()
+        return self._observatory
+
+    def _calculate_position(self, obsCode, JDutc):
+        '''
+            The (uncached) calculation
+            Returns None if the position cannot be calculated (e.g. unknown obsCode), so that failures are cached too
+        '''
+        try:
+            return np.array( self.observatory.getObservatoryPosition(obsCode, JDutc) , dtype=np.float64)
+        except Exception:
+            return None
+
+    def _interpolate_position(self, obsCode, JDutc):
+        ''' 4-point Lagrange interpolation between the grid-times bracketing JDutc'''
+        step  = self.interpolationStep
+        k     = int(np.floor(JDutc / step))
+        x     = JDutc / step - k
+        nodes = [ self._lookup(obsCode, (k + j) * step) for j in (-1, 0, 1, 2) ]
+        if any(node is None for node in nodes):
+            return None
+        weights = [ -x*(x-1.)*(x-2.)/6. , (x+1.)*(x-1.)*(x-2.)/2. , -(x+1.)*x*(x-2.)/2. , (x+1.)*x*(x-1.)/6. ]
+        return sum(w * node for w, node in zip(weights, nodes))
+
+    def _get(self, obsCode, JDutc):
+        if self.interpolationStep is None:
+            return self._lookup(obsCode, JDutc)
+        return self._interpolate_position(obsCode, JDutc)
+
+    def get_position(self, obsCode, JDutc):
+        '''
+            Heliocentric equatorial position of the observatory [au] : shape (3,)
+            Raises a ValueError if the position cannot be calculated
+        '''
+        self.nRequested += 1
+        posn = self._get(obsCode, JDutc)
+        if posn is None:
+            raise ValueError('observatory position could not be calculated for obsCode=%r, JDutc=%r' % (obsCode, JDutc))
+        return posn.copy()
+
+    def get_positions(self, obsCodes, JDutcs):
+        '''
+            Batch version of get_position : returns an (N,3) array
+            - Duplicate (obsCode, JDutc) pairs are only looked-up once
+            - Rows for which the position cannot be calculated are returned as nan
+        '''
+        posns  = np.full((len(obsCodes), 3), np.nan)
+        unique = {}
+        for n, key in enumerate(zip(obsCodes, JDutcs)):
+            unique.setdefault(key, []).append(n)
+        for (obsCode, JDutc), rows in unique.items():
+            posn = self._get(obsCode, JDutc)
+            if posn is not None:
+                posns[rows] = posn
+        self.nRequested += len(posns)
+        return posns
+
+    def stats(self):
+        '''
+            Dictionary of counters
+            - nRequested : number of positions requested (by get_position/get_positions)
+            - hits/misses: of the LRU cache (N.B. duplicates within a single get_positions call are not counted as hits)
+        '''
+        info = self._lookup.cache_info()
+        return { 'nRequested' : self.nRequested, 'hits' : info.hits, 'misses' : info.misses, 'currsize' : info.currsize, 'maxsize' : info.maxsize }
+
+    def clear(self):
+        self._lookup.cache_clear()
+        self.nRequested = 0
@@ -0,0 +1,185 @@
+'''
+    Vectorized classification of orbits : NEO-status (isNEO) & dynamical class (objectType)
+    Intended for use by sample_data_creation.py (and anything else that needs to label orbits)
+
+    Each function accepts whole arrays of orbits ...
+    ... so that the millions of orbits in the MPC orbit file can be parsed, & classified, in a single pass
+
+    The orbits are those of the raw orbit file (raw_data/sample_orbit_large.csv) ...
+     - perihelion distance q [au], eccentricity e, & the angles (incl, arg_peri, asc_node) in [degrees]
+     - the integer values of objectType are defined in data.object_type_definitions
+
+'''
+
+# ----------------------------------------
+# Third-party imports
+# ----------------------------------------
+import itertools
+from collections.abc import Mapping
+import numpy as np
+
+# ----------------------------------------
+# Local imports
+# ----------------------------------------
+import data
+
+
+# Semi-major axis of Jupiter [au] (for the Tisserand parameter)
+A_JUPITER   = 5.2026
+# Perihelion distance below which an object is an NEO [au]
+Q_NEO       = 1.3
+
+# Fields of the raw orbit file (in order)
+ORBIT_FILE_FIELDS = ('objectID', 'orbit_q', 'orbit_e', 'orbit_i', 'orbit_AP', 'orbit_LAN', 'orbit_TP')
+
+
+# ----------------------------------------
+# Define some useful function(s)
+# ----------------------------------------
+
+def parse_orbit_lines(lines):
+    '''
+        Split the lines of the raw orbit file (without the header line) into columns
+        dataList looks like ...
+        K17A00000Z,1.860740581,0.327816993,11.9724421,24.3326162,353.2247911,2459182.9309837
+
+        Returns a dictionary keyed on ORBIT_FILE_FIELDS, each entry a list of the strings from the file
+         - all of the (valid) lines are split in a single call, rather than line-by-line
+         - lines that do not have exactly len(ORBIT_FILE_FIELDS) fields are skipped (& reported) ...
+           ... but a line with empty elements is kept : the elements become nan in classify_orbit_lines (objectType "Unknown")
+    '''
+    nFields = len(ORBIT_FILE_FIELDS)
+    lines   = [ line.rstrip('\r\n') for line in lines ]
+    valid   = [ line.count(',') == nFields - 1 for line in lines ]
+    if not all(valid):
+        # (blank lines are skipped silently)
+        malformed = [ line for line, isValid in zip(lines, valid) if not isValid and line.strip() != '' ]
+        if malformed:
+            print('skipping %d orbit line(s) that do not have %d fields, e.g. %r' % (len(malformed), nFields, malformed[0]), flush=True)
+        lines = list(itertools.compress(lines, valid))
+    # N.B. joining the lines with a "," means that a single split gives all of the fields
+    tokens  = ",".join(lines).split(',') if lines else []
+    columns = { key : tokens[n::nFields] for n, key in enumerate(ORBIT_FILE_FIELDS) }
+    # (rare) whitespace at the start / end of a line is stripped, as it would be by line.strip()
+    for key in ('objectID', 'orbit_TP'):
+        joined = "".join(columns[key])
+        if ' ' in joined or '\t' in joined:
+            columns[key] = [ _.strip() for _ in columns[key] ]
+    return columns
+
+def _as_floats(strings):
+    ''' Convert a list of strings to floats (with "None"/"" as nan)'''
+    try:
+        return np.fromiter(map(float, strings), dtype=np.float64, count=len(strings))
+    except ValueError:
+        return np.array([ float(_) if _.strip() not in ('', 'None') else np.nan for _ in strings ], dtype=np.float64)
+
+def derived_elements(q, e, i, AP):
+    '''
+        Quantities derived from the orbital elements (q [au], e, i & AP [degrees])
+        Returns a dictionary of arrays ...
+         - a          : semi-major axis [au] (nan for e >= 1)
+         - Q          : aphelion distance [au] (inf for e >= 1)
+         - tisserandJ : Tisserand parameter w.r.t. Jupiter
+         - moidProxy  : distance [au] between the Earth's orbit (taken to be circular, radius 1 au) & the nearer of the ...
+                        ... object's nodes : an upper limit on the MOID (& a good approximation for low-inclination orbits)
+    '''
+    q, e = np.asarray(q, dtype=np.float64), np.asarray(e, dtype=np.float64)
+    i, AP = np.radians(np.asarray(i, dtype=np.float64)), np.radians(np.asarray(AP, dtype=np.float64))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bound = e < 1.
+        a     = np.where(bound, q / (1. - e), np.nan)
+        Q     = np.where(bound, a * (1. + e), np.inf)
+
+        # N.B. written in terms of q & the semi-latus rectum p = q(1+e), so that it is valid for any e
+        p          = q * (1. + e)
+        tisserandJ = A_JUPITER * (1. - e) / q + 2. * np.cos(i) * np.sqrt(p / A_JUPITER)
+
+        # heliocentric distance at the ascending & descending nodes (inf if the node is never reached, for e >= 1)
+        denomAsc, denomDesc = 1. + e * np.cos(AP), 1. - e * np.cos(AP)
+        rAsc      = np.where(denomAsc  > 0, p / denomAsc,  np.inf)
+        rDesc     = np.where(denomDesc > 0, p / denomDesc, np.inf)
+        moidProxy = np.minimum( np.abs(rAsc - 1.), np.abs(rDesc - 1.) )
+
+    return { 'a' : a, 'Q' : Q, 'tisserandJ' : tisserandJ, 'moidProxy' : moidProxy }
+
+def classify_orbits(q, e, i, AP):
+    '''
+        Classify orbits (q [au], e, i & AP [degrees]) in a single vectorized pass
+        Returns (isNEO, objectType, derived) ...
+         - isNEO      : boolean array (q < 1.3 au)
+         - objectType : int8 array, using the values defined in data.object_type_definitions
+         - derived    : the dictionary from derived_elements
+    '''
+    q, e, i = np.asarray(q, dtype=np.float64), np.asarray(e, dtype=np.float64), np.asarray(i, dtype=np.float64)
+    derived = derived_elements(q, e, i, AP)
+    a, Q, TJ = derived['a'], derived['Q'], derived['tisserandJ']
+
+    with np.errstate(invalid='ignore'):
+        isNEO = q < Q_NEO
+        # N.B. the order matters : the first matching condition is used (see data.object_type_definitions)
+        conditions = [
+            ~( np.isfinite(q) & np.isfinite(e) & np.isfinite(i) ),
+            e >= 1.,
+            isNEO & (a < 1.) & (Q < 0.983),
+            isNEO & (a < 1.),
+            isNEO & (q < 1.017),
+            isNEO,
+            (a >= 1.78) & (a < 2.0) & (e < 0.18) & (i >= 16.) & (i < 34.),
+            (q < 1.666) & (a < 3.2),
+            (a >= 1.78) & (a < 3.3),
+            (a >= 3.7) & (a < 4.2) & (e < 0.3) & (i < 20.),
+            (a >= 5.05) & (a < 5.35) & (e < 0.25),
+            (TJ >= 2.) & (TJ < 3.) & (a < 5.5),
+            (a >= 5.5) & (a < 30.1),
+            a >= 30.1,
+        ]
+        choices = [data.missing_values['int8'], 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+        objectType = np.select(conditions, choices, default=13).astype(np.int8)
+
+    return isNEO, objectType, derived
+
+def classify_orbit_lines(lines):
+    '''
+        Parse & classify a block of lines from the raw orbit file
+        Returns a dictionary of columns: the strings from the file (see parse_orbit_lines), plus lists of isNEO & objectType
+    '''
+    columns = parse_orbit_lines(lines)
+    isNEO, objectType, derived = classify_orbits( *[ _as_floats(columns[_]) for _ in ('orbit_q', 'orbit_e', 'orbit_i', 'orbit_AP') ] )
+    columns['isNEO']      = isNEO.tolist()
+    columns['objectType'] = objectType.tolist()
+    return columns
+
+
+# ----------------------------------------
+# Define some useful class(es)
+# ----------------------------------------
+
+class ObjectStrings(Mapping):
+    '''
+        Read-only mapping from objectID to the output (csv) string for that object ...
+        ... i.e. a drop-in replacement for a dictionary of pre-formatted strings keyed on objectID
+         - the orbital elements are copied verbatim from the input, with the object-fields in the order given by keys
+         - the strings are only formatted when they are accessed, so only the objects that are written out ...
+         - ... (those with detections : a small fraction of the orbit file) pay the cost of formatting
+
+        As for a dictionary built row-by-row, a repeated objectID keeps its first position, but takes its last value
+    '''
+
+    def __init__(self, columns, keys):
+        self.columns = columns
+        self.keys_   = list(keys)
+        self._index  = dict( zip(columns['objectID'], range(len(columns['objectID']))) )
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __contains__(self, objectID):
+        return objectID in self._index
+
+    def __getitem__(self, objectID):
+        n = self._index[objectID]
+        return " , ".join( str(self.columns[key][n]) for key in self.keys_ )
@@ -0,0 +1,202 @@
+'''
+    Buffered, atomic writing of the sample-data (csv) files, with optional compression
+    Intended for use by sample_data_creation.py (and anything else that writes large line-based files)
+
+     - BufferedLineWriter keeps its file open for the whole run & accumulates the lines into large buffers ...
+       ... so that there is one write-call per ~bufferSize characters, rather than an open/write-per-line per block
+     - A new file is written to <filepath>.tmp & only renamed to filepath once it is complete (commit) ...
+       ... so that a crash never leaves a half-written csv file behind
+     - format_rows formats whole columns at once (rather than building each row from a dictionary)
+     - The files can be compressed with gzip (.gz) or zstd (.zst, which requires the zstandard package) ...
+       ... & read back with open_text, which is used by the readers in columnar.py & ingest_demo.py
+
+    Usage (e.g.) ...
+    with output_writer.BufferedLineWriter('sample_data_1e6_real_detections.csv', compression='gzip') as writer:
+        writer.write_lines(["# detID , ..."])
+        writer.write_lines(output_writer.format_rows(columns, keys))
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import io
+import gzip
+import shutil
+
+
+# Suffix (appended to the csv filepath) for each type of compression
+COMPRESSION_SUFFIXES = { None : '', 'gzip' : '.gz', 'zstd' : '.zst' }
+
+# Default compression levels: chosen for speed (the levels used by the gzip & zstd command-line tools are 6 & 3)
+DEFAULT_COMPRESSION_LEVELS = { 'gzip' : 6, 'zstd' : 3 }
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def _zstandard():
+    ''' zstd (de-)compression uses the (optional) zstandard package'''
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires the zstandard package (pip install zstandard)")
+    return zstandard
+
+def compressed_filepath(filepath, compression=None):
+    ''' The path of filepath when compressed (e.g. "xxx.csv" -> "xxx.csv.gz")'''
+    assert compression in COMPRESSION_SUFFIXES, 'unknown compression : %r' % compression
+    return filepath + COMPRESSION_SUFFIXES[compression]
+
+def compression_from_filepath(filepath):
+    ''' The compression of a file, inferred from its suffix'''
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if suffix and filepath.endswith(suffix):
+            return compression
+    return None
+
+def compress(bytestring, compression=None, compressionLevel=None):
+    ''' Compress a bytestring (as a complete gzip member / zstd frame, which can be concatenated with others)'''
+    level = compressionLevel if compressionLevel is not None else DEFAULT_COMPRESSION_LEVELS.get(compression)
+    if compression is None:
+        return bytestring
+    if compression == 'gzip':
+        return gzip.compress(bytestring, compresslevel=level)
+    if compression == 'zstd':
+        return _zstandard().ZstdCompressor(level=level).compress(bytestring)
+    raise ValueError('unknown compression : %r' % compression)
+
+def open_text(filepath):
+    '''
+        Open a (possibly compressed) text file for reading, inferring the compression from the suffix
+        N.B. concatenated gzip members / zstd frames (as written by appending, or by concatenate) are read as one file
+    '''
+    compression = compression_from_filepath(filepath)
+    if compression is None:
+        return open(filepath, 'r')
+    if compression == 'gzip':
+        return gzip.open(filepath, 'rt')
+    reader = _zstandard().ZstdDecompressor().stream_reader(open(filepath, 'rb'), read_across_frames=True, closefd=True)
+    return io.TextIOWrapper(reader)
+
+def format_rows(columns, keys, separator=" , "):
+    '''
+        Format the columns (a dictionary of equal-length sequences) as lines of text, with the fields in the order given by keys
+         - each column is converted with str() in a single pass, & the rows are then joined
+         - N.B. use python objects (e.g. from ndarray.tolist()) rather than numpy scalars, ...
+           ... as str() of a python float is the shortest string that round-trips
+    '''
+    return list( map(separator.join, zip( *[ map(str, columns[key]) for key in keys ] )) )
+
+def concatenate(filepath, partFilepaths, header=None, compression=None, compressionLevel=None):
+    '''
+        (Atomically) write filepath as the header line followed by the contents of each part (in order)
+         - the parts are copied byte-for-byte, so compressed parts must already use the same compression ...
+         - ... (a sequence of gzip members / zstd frames is itself a valid gzip / zstd file)
+    '''
+    tmppath = filepath + '.tmp'
+    try:
+        with open(tmppath, 'wb') as fh:
+            if header is not None:
+                fh.write( compress((header + "\n").encode(), compression, compressionLevel) )
+            for partFilepath in partFilepaths:
+                with open(partFilepath, 'rb') as part_fh:
+                    shutil.copyfileobj(part_fh, fh, 2**22)
+        os.replace(tmppath, filepath)
+    except BaseException:
+        if os.path.isfile(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+# -----------------------------------
+# Define some useful class(es)
+# -----------------------------------
+
+class BufferedLineWriter():
+    '''
+        Write lines of text to a (possibly compressed) file, via a large in-memory buffer
+         - filepath    : the path of the output file (N.B. any compression-suffix is *not* added: see compressed_filepath)
+         - append      : if True, append to any existing file ...
+                         ... otherwise write a new file to <filepath>.tmp, which replaces filepath when commit() is called
+                         N.B. appending cannot be atomic: sample_data_creation relies on its manifest to recover from ...
+                         ... an interrupted (incremental) run instead
+         - compression : None, 'gzip' or 'zstd'
+         - bufferSize  : (approximate) number of characters to accumulate before writing
+
+        Used as a context manager, the file is committed on success, & aborted (the .tmp file removed) on an exception
+    '''
+
+    def __init__(self, filepath, append=False, compression=None, compressionLevel=None, bufferSize=2**22):
+        assert compression in COMPRESSION_SUFFIXES, 'unknown compression : %r' % compression
+        self.filepath    = filepath
+        self.append      = append
+        self.compression = compression
+        self.bufferSize  = bufferSize
+        self.path        = filepath if append else filepath + '.tmp'
+        self.nLines      = 0
+        self._buffer, self._bufferLength = [], 0
+
+        # N.B. the (compressed) streams are opened on top of a raw file handle, which is closed last
+        level = compressionLevel if compressionLevel is not None else DEFAULT_COMPRESSION_LEVELS.get(compression)
+        self._raw = open(self.path, 'ab' if append else 'wb')
+        if compression == 'gzip':
+            self._fh = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=level)
+        elif compression == 'zstd':
+            self._fh = _zstandard().ZstdCompressor(level=level).stream_writer(self._raw, closefd=False)
+        else:
+            self._fh = self._raw
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+    @property
+    def closed(self):
+        return self._raw.closed
+
+    def write_lines(self, lines):
+        ''' Buffer the lines (strings without a trailing newline), writing the buffer to file whenever it is full'''
+        for line in lines:
+            self._buffer.append(line)
+            self._bufferLength += len(line) + 1
+        if self._bufferLength >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        ''' Write (but do not commit) the buffered lines'''
+        if self._buffer:
+            self._fh.write( ("\n".join(self._buffer) + "\n").encode() )
+            self.nLines += len(self._buffer)
+            self._buffer, self._bufferLength = [], 0
+
+    def _close(self):
+        if self._fh is not self._raw:
+            self._fh.close()
+        self._raw.close()
+
+    def commit(self):
+        ''' Write any buffered lines, close the file, & (if it is a new file) rename it to filepath'''
+        if self.closed:
+            return
+        self.flush()
+        self._close()
+        if not self.append:
+            os.replace(self.path, self.filepath)
+
+    def abort(self):
+        ''' Close the file, discarding any buffered lines (& the whole file, if it is a new file)'''
+        if self.closed:
+            return
+        self._buffer, self._bufferLength = [], 0
+        self._close()
+        if not self.append and os.path.isfile(self.path):
+            os.remove(self.path)
@@ -0,0 +1,353 @@
+'''
+    Staged (overlapped) execution of a read -> compute -> write loop, with bounded queues between the stages
+    Intended for use by sample_data_creation._process_detections, so that the disk reads, the numpy work & the writing ...
+    ... of the output files overlap, rather than alternating (which leaves the CPU idle while waiting for slow, e.g. NFS, storage)
+
+     - source : the input is read (in chunks) on a reader thread, up to queueSize chunks ahead of the consumer
+     - map    : a function is applied to each chunk by a pool of worker threads, up to queueSize chunks ahead ...
+                ... & the results are returned in the order of the input
+     - sink   : the items submitted (e.g. blocks of output lines) are handed to a function on a writer thread
+     - each queue is bounded, so a slow stage applies backpressure (the stages upstream of it block) ...
+       ... & memory use is bounded by queueSize chunks per stage
+     - the stage in the calling thread (the "consumer") is the remainder of the loop
+
+    The time that each stage spends working (busy), waiting for its input & blocked on its output is recorded ...
+    ... together with the depth of each queue (sampled whenever an item is taken from, or given to, it)
+     - utilization = busy / elapsed : the stage with the highest utilization is the bottleneck
+     - see Pipeline.stats, Pipeline.summary & Pipeline.record (which reports them to instrumentation)
+    N.B. the threads share the GIL, so the stages only run truly in parallel while they are in I/O, (de)compression or numpy
+
+    Usage (e.g.) ...
+    p = pipeline.Pipeline(queueSize=8)
+    writer = p.sink(write_block)
+    for result in p.map(parse, p.source(lines, chunkSize=2000), nWorkers=2):
+        writer.submit( process(result) )
+    p.close()
+    print(p.summary())
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import time
+import queue
+import itertools
+import threading
+import concurrent.futures
+from collections import deque
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import instrumentation
+
+
+# -----------------------------------
+# Define some useful class(es)
+# -----------------------------------
+
+class _Failure():
+    ''' Wrapper used to pass an exception from a background thread to the consumer'''
+    def __init__(self, exception):
+        self.exception = exception
+
+_END = object()
+
+
+class StageStats():
+    '''
+        Timings of a single stage
+         - busySeconds    : time spent working (summed over the threads of the stage)
+         - waitSeconds    : time spent waiting for input
+         - blockedSeconds : time spent blocked on a full output queue (i.e. backpressure)
+         - nItems         : number of items (chunks) processed
+         - depths         : sum, number & maximum of the samples of the depth of the stage's (input) queue
+    '''
+
+    def __init__(self, name, nThreads=1):
+        self.name           = name
+        self.nThreads       = nThreads
+        self.busySeconds    = 0.
+        self.waitSeconds    = 0.
+        self.blockedSeconds = 0.
+        self.nItems         = 0
+        self.depths         = [0, 0, 0]
+        self._lock          = threading.Lock()
+
+    def add(self, busy=0., wait=0., blocked=0., nItems=0):
+        with self._lock:
+            self.busySeconds    += busy
+            self.waitSeconds    += wait
+            self.blockedSeconds += blocked
+            self.nItems         += nItems
+
+    def sample_depth(self, depth):
+        with self._lock:
+            self.depths[0] += depth
+            self.depths[1] += 1
+            self.depths[2]  = max(self.depths[2], depth)
+
+    def as_dict(self, elapsed):
+        return { 'nItems'         : self.nItems,
+                 'busySeconds'    : self.busySeconds,
+                 'waitSeconds'    : self.waitSeconds,
+                 'blockedSeconds' : self.blockedSeconds,
+                 'utilization'    : self.busySeconds / (elapsed * self.nThreads) if elapsed > 0 else 0.,
+                 'meanQueueDepth' : self.depths[0] / self.depths[1] if self.depths[1] else 0.,
+                 'maxQueueDepth'  : self.depths[2] }
+
+
+class Sink():
+    '''
+        Hands the submitted items to function, in order, on a (single) writer thread
+         - submit blocks while the queue holds queueSize items (backpressure) ...
+           ... & the time for which it blocks is recorded as the blockedSeconds of consumer (if given)
+         - close waits for all of the submitted items to be processed, & re-raises any exception from function
+    '''
+
+    def __init__(self, function, stats, queueSize, consumer=None):
+        self.function = function
+        self.stats    = stats
+        self.consumer = consumer
+        self._queue   = queue.Queue(maxsize=queueSize)
+        self._failure = None
+        self._thread  = threading.Thread(target=self._run, name='pipeline-%s' % stats.name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            t0   = time.perf_counter()
+            item = self._queue.get()
+            t1   = time.perf_counter()
+            if item is _END:
+                self.stats.add(wait=t1 - t0)
+                return
+            if self._failure is None:
+                # N.B. after a failure, the remaining items are discarded (so that submit never blocks forever)
+                try:
+                    self.function(item)
+                except BaseException as e:
+                    self._failure = e
+            self.stats.add(busy=time.perf_counter() - t1, wait=t1 - t0, nItems=1)
+
+    def submit(self, item):
+        ''' Queue item for the writer thread (re-raising the exception from any earlier item)'''
+        if self._failure is not None:
+            raise self._failure
+        self.stats.sample_depth(self._queue.qsize())
+        t0 = time.perf_counter()
+        self._queue.put(item)
+        if self.consumer is not None:
+            self.consumer.add(blocked=time.perf_counter() - t0)
+
+    def close(self):
+        ''' Wait for the submitted items to be processed'''
+        if self._thread.is_alive():
+            self._queue.put(_END)
+            self._thread.join()
+        if self._failure is not None:
+            raise self._failure
+
+
+class Pipeline():
+    '''
+        The stages of a single (read -> compute -> write) loop, & their statistics
+         - queueSize : maximum number of items held between each pair of stages
+         - name      : prefix of the metrics reported by record
+        Call close at the end of the loop (or use as a context manager), so that the threads are always stopped & the sinks closed
+    '''
+
+    def __init__(self, queueSize=8, name='pipeline'):
+        assert queueSize >= 1, 'queueSize must be positive'
+        self.queueSize = int(queueSize)
+        self.name      = name
+        self.stages    = {}
+        self.consumer  = StageStats('consumer')
+        self._sinks    = []
+        self._stop     = threading.Event()
+        self._threads  = []
+        self._generators = []
+        self._start    = time.perf_counter()
+        self._depth    = 0
+        self.elapsed   = 0.
+        self.closed    = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close(failed=excType is not None)
+        return False
+
+    def close(self, failed=False):
+        '''
+            Stop the stages & wait for the sinks to process the items submitted to them
+             - failed : True if the loop is being abandoned because of an exception ...
+                        ... in which case any exception from the sinks is suppressed (the original takes precedence)
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        # stop the stages (e.g. if the consumer left the loop early) : the generators first, so that their worker threads are shut down
+        self._stop.set()
+        for generator in reversed(self._generators):
+            generator.close()
+        for thread in self._threads:
+            thread.join()
+        try:
+            for sink in self._sinks:
+                try:
+                    sink.close()
+                except BaseException:
+                    if not failed:
+                        raise
+        finally:
+            self.elapsed = time.perf_counter() - self._start
+            # the time of the consumer is whatever it did not spend waiting for its input or blocked on the sinks
+            self.consumer.busySeconds = max(self.elapsed - self.consumer.waitSeconds - self.consumer.blockedSeconds, 0.)
+
+    def _stage(self, name, nThreads=1):
+        assert name not in self.stages and name != 'consumer', 'duplicate stage name : %r' % name
+        self.stages[name] = StageStats(name, nThreads)
+        return self.stages[name]
+
+    def _wait(self, function):
+        '''
+            Call function (which waits for the input of the consumer), recording the time taken as the waitSeconds of the consumer
+            N.B. the time is only recorded by the outermost stage (e.g. not by a source that is being read by a map)
+        '''
+        outermost = self._depth == 0
+        self._depth += 1
+        t0 = time.perf_counter()
+        try:
+            return function()
+        finally:
+            self._depth -= 1
+            if outermost:
+                self.consumer.add(wait=time.perf_counter() - t0)
+
+    def _put(self, q, item, stats):
+        ''' Put item on q, unless the pipeline is stopped (N.B. times out periodically, so that the thread can exit)'''
+        t0 = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                stats.add(blocked=time.perf_counter() - t0)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # ---- Stages ------------
+
+    def _generator(self, generator):
+        self._generators.append(generator)
+        return generator
+
+    def source(self, iterable, chunkSize=2000, name='read'):
+        '''
+            Generator : lists of (up to) chunkSize consecutive items of iterable ...
+            ... which is iterated over on a reader thread, up to queueSize chunks ahead
+        '''
+        stats = self._stage(name)
+        q     = queue.Queue(maxsize=self.queueSize)
+
+        def _reader():
+            try:
+                iterator = iter(iterable)
+                while True:
+                    t0    = time.perf_counter()
+                    chunk = list(itertools.islice(iterator, chunkSize))
+                    stats.add(busy=time.perf_counter() - t0, nItems=1 if chunk else 0)
+                    if not chunk:
+                        break
+                    if not self._put(q, chunk, stats):
+                        return
+                self._put(q, _END, stats)
+            except BaseException as e:
+                self._put(q, _Failure(e), stats)
+
+        def _chunks():
+            while True:
+                stats.sample_depth(q.qsize())
+                item = self._wait(q.get)
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exception
+                yield item
+
+        thread = threading.Thread(target=_reader, name='pipeline-%s' % name, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+        return self._generator(_chunks())
+
+    def map(self, function, chunks, nWorkers=1, name='compute'):
+        '''
+            Generator : function(chunk) for each of the chunks (e.g. from source), in order ...
+            ... calculated by a pool of nWorkers threads, up to queueSize chunks ahead of the consumer
+            (the queue depth is the number of results that are ready, but have not yet been taken by the consumer)
+        '''
+        stats = self._stage(name, nWorkers)
+
+        def _timed(chunk):
+            t0 = time.perf_counter()
+            try:
+                return function(chunk)
+            finally:
+                stats.add(busy=time.perf_counter() - t0, nItems=1)
+
+        def _results(chunks):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=nWorkers, thread_name_prefix='pipeline-%s' % name) as executor:
+                pending = deque()
+
+                def _next_result():
+                    # keep up to queueSize chunks in flight
+                    for chunk in itertools.islice(chunks, self.queueSize - len(pending)):
+                        pending.append( executor.submit(_timed, chunk) )
+                    if not pending:
+                        return _END
+                    stats.sample_depth(sum( future.done() for future in pending ))
+                    return pending.popleft().result()
+
+                try:
+                    while True:
+                        result = self._wait(_next_result)
+                        if result is _END:
+                            return
+                        yield result
+                finally:
+                    for future in pending:
+                        future.cancel()
+
+        return self._generator(_results(iter(chunks)))
+
+    def sink(self, function, name='write'):
+        ''' A Sink (see above) : the time that submit blocks is recorded as the blockedSeconds of the consumer'''
+        sink = Sink(function, self._stage(name), self.queueSize, consumer=self.consumer)
+        self._sinks.append(sink)
+        return sink
+
+    # ---- Statistics ------------
+
+    def stats(self):
+        ''' Dictionary of the statistics of each stage (see StageStats), keyed on the name of the stage'''
+        elapsed = self.elapsed if self.elapsed else time.perf_counter() - self._start
+        stats = { name : stage.as_dict(elapsed) for name, stage in self.stages.items() }
+        stats['consumer'] = self.consumer.as_dict(elapsed)
+        return stats
+
+    def summary(self):
+        ''' A compact, human-readable summary of the statistics'''
+        lines = ['%s : %.3fs' % (self.name, self.elapsed)]
+        for name, s in self.stats().items():
+            lines.append('  %-10s items=%7d  busy=%9.3fs  wait=%9.3fs  blocked=%9.3fs  utilization=%5.1f%%  queue depth mean=%5.2f max=%d' % (
+                         name, s['nItems'], s['busySeconds'], s['waitSeconds'], s['blockedSeconds'], 100. * s['utilization'], s['meanQueueDepth'], s['maxQueueDepth']))
+        return "\n".join(lines)
+
+    def record(self):
+        ''' Report the statistics to instrumentation : the times are counted (so that shards add up), the rest are gauges'''
+        for name, s in self.stats().items():
+            instrumentation.record_stats('%s_%s' % (self.name, name), s, counters=('nItems', 'busySeconds', 'waitSeconds', 'blockedSeconds'))
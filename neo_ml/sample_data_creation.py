@@ -15,6 +15,12 @@
 # Third-party imports
 # ----------------------------------------
 import os, sys
+import itertools
+import operator
+import hashlib
+import json
+import shutil
+import tempfile
 import numpy as np
 from collections import namedtuple
 
@@ -22,9 +28,17 @@ from collections import namedtuple
 # Local imports
 # ----------------------------------------
 import data
-from obs80 import obs80 as o
-import MPC_library as MPCL
-import phys_const as PHYS
+import features
+import columnar
+import storage
+import observatory
+import orbit_classification
+import instrumentation
+import output_writer
+import obs80_parser
+import external_sort
+import dedup
+import pipeline
 
 # ----------------------------------------
 # Define some useful class(es)/function(s)
@@ -71,43 +85,213 @@ def _read_from_file(filepath):
             sys.exit('file could not be read : %r' % filepath )
         return dataList
 
-def angle_unitvectors(uv1,uv2):
-    '''
-        Calculate the angle between two unit vectors
-        Returns angle in radians
+def _iterate_over_file(filepath, nSkip=0):
         '''
-    # Check the format is as required
-    assert (uv1.shape == (3,) or uv1.shape == (1,3)), 'The behavior of this routine has only been tested when uv1 is a single unit vector'
-    assert (uv2.shape == (3,) or uv2.shape[1] ==3 )
-    
-    # Do the dot-products to get the angle
-    uv1.flatten()
-    uv2 = np.atleast_2d(uv2)
-    dot = np.dot( uv1,uv2.T )
-    
-    # Return results in radians
-    return np.arccos( dot )
+            Convience function to lazily read data from a file (after checking that the file exists)
+            Lines are yielded one at a time (after skipping the first nSkip lines) ...
+            ... so that memory use does not grow with the size of the file
+        '''
+        assert os.path.isfile(filepath), 'filepath could not be found : %r ' % filepath
+        with open(filepath, 'r') as fh:
+            for n, line in enumerate(fh):
+                if n >= nSkip:
+                    yield line
 
-def radec_to_unitvector_equatorial(RA_deg, DEC_deg):
-    return np.transpose(np.array([  np.cos(np.radians(RA_deg))*np.cos(np.radians(DEC_deg)),
-                                  np.sin(np.radians(RA_deg))*np.cos(np.radians(DEC_deg)),
-                                  np.sin(np.radians(DEC_deg))]))
+def _raw_observations_filepath(numberString):
+    '''
+        The (unsorted) dump of the observations, raw_data/sample_obs_<numberString>.csv ...
+        ... or a compressed version of it (see output_writer.open_text)
+    '''
+    filepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'raw_data' , 'sample_obs_%s.csv' % numberString )
+    for compression in output_writer.COMPRESSION_SUFFIXES:
+        if os.path.isfile( output_writer.compressed_filepath(filepath, compression) ):
+            return output_writer.compressed_filepath(filepath, compression)
+    return filepath
 
-def unitvector_equatorial_to_unitvector_ecliptic(unitvector_equatorial):
-    return np.dot(np.transpose(PHYS.rot_mat), unitvector_equatorial )
+def _detection_sort_key(line):
+    '''
+        The order in which _process_detections requires the detections : (orbitID, trkID, time, detID)
+         - the time is the (fixed-width) date of the obs80 record, which sorts in time-order as a string
+         - N.B. a line that cannot be split into the 4 fields is sorted on its own text (it will fail to parse anyway)
+    '''
+    fields = line.split(',', 3)
+    if len(fields) < 4:
+        return (line, '', '', '')
+    orbitID, detID, trkID, obs80 = fields
+    return (orbitID, trkID, obs80[15:32], detID)
 
 # Useful functions related to position of the observatory at the time the pointing was taken ...
 # ... this is EQUATORIAL
+# (the remaining geometry functions have been moved into features.py so that they can be applied to whole arrays)
+# - The positions are memoized: the size of the cache can be changed (before any look-ups) via _set_observatory_cache
+observatoryCache = observatory.ObservatoryPositionCache()
+
+def _set_observatory_cache(maxsize, interpolationStep=None):
+    global observatoryCache
+    observatoryCache = observatory.ObservatoryPositionCache(maxsize=maxsize, interpolationStep=interpolationStep)
+
+def _record_observatory_cache_stats(previous=None):
+    ''' Report the use of the observatory cache (since the stats in previous) to instrumentation'''
+    instrumentation.record_stats('observatory_cache', observatoryCache.stats(), previous=previous, counters=('nRequested', 'hits', 'misses'))
+
+# Duplicate detections (see dedup.py) are removed as the detections are processed, unless the filter is None
+# - the duplicates are found beforehand, by a single (in order) pass over the keys of all of the detections (see _find_duplicates) ...
+#   ... so that the same detections are removed however the input is split into shards (& blocks)
+# - the filter is set via _set_duplicate_filter
+duplicateFilter = None
+
+def _set_duplicate_filter(reasons):
+    ''' reasons : the duplicates, grouped by tracklet (see dedup.DuplicateFilter), or None to keep the duplicates'''
+    global duplicateFilter
+    duplicateFilter = dedup.DuplicateFilter(reasons) if reasons is not None else None
+
 def calc_heliocentric_position_of_observatory_in_equatorial_coords(obsCode, JDutc):
-    helio_eq_posn = MPCL.Observatory().getObservatoryPosition(obsCode, JDutc)
+    helio_eq_posn = observatoryCache.get_position(obsCode, JDutc)
     return helio_eq_posn
 
-def calc_heliocentric_position_of_observatory_in_ecliptic_coords(helio_eq_posn):
-    helio_ec_posn = np.dot(np.transpose(PHYS.rot_mat), helio_eq_posn )
-    return helio_ec_posn
 
+def _new_detection_block():
+    '''
+        Container used by _process_detections to accumulate the parsed detections ...
+        ... so that the detection-level quantities can be calculated for many detections in a single vectorized pass
+    '''
+    return { key : [] for key in ['orbitID', 'detID', 'trkID', 'timeUTC', 'Vmag', 'obsCode', 'RA', 'Dec'] }
+
+def _split_detection_line(line):
+    '''
+        The fields (orbitID, detID, trkID, obs80) of a line of the input file ...
+        ... or None if the line is too long or does not have exactly 4 fields (it is then skipped, see _parse_detection_batch)
+    '''
+    fields = line.split(',') if len(line) < 150 else None
+    return fields if fields is not None and len(fields) == 4 else None
+
+@instrumentation.timed('parse_detections')
+def _parse_detection_batch(lines):
+    '''
+        Split a batch of lines (see _process_detections) & parse all of their obs80 records at once
+         - obs80_parser.parse_obs80 flags the records that cannot be parsed (rather than raising an exception for each)
+        Returns a list of (status, fields) for the lines, in order
+         - status : 'ok', 'too_long' or 'parse_failure'
+         - fields : (orbitID, detID, trkID, timeUTC, Vmag, obsCode, RA, Dec) if status is 'ok', otherwise None
+    '''
+    splits    = [ _split_detection_line(line) for line in lines ]
+    parseable = [ fields is not None for fields in splits ]
+    selected  = list(itertools.compress(splits, parseable))
+    columns, ok = obs80_parser.parse_obs80( list(map(operator.itemgetter(3), selected)) )
+
+    # N.B. tolist() converts to python floats, & a blank magnitude is None (as it was from obs80.parseOpt)
+    Vmag   = [ None if mag != mag else mag for mag in columns['mag'].tolist() ]
+    parsed = zip(ok.tolist(), zip(map(operator.itemgetter(0), selected), map(operator.itemgetter(1), selected), map(operator.itemgetter(2), selected),
+                                  columns['jdutc'].tolist(), Vmag, columns['cod'].tolist(), columns['ra'].tolist(), columns['dec'].tolist()))
+
+    results = []
+    for line, isParseable in zip(lines, parseable):
+        if isParseable:
+            success, values = next(parsed)
+            results.append( ('ok', values) if success else ('parse_failure', None) )
+        else:
+            results.append( ('too_long', None) if len(line) >= 150 else ('parse_failure', None) )
+    return results
+
+# Number of batches (of lines, or of blocks of output) queued between the stages of a pipelined run (see pipeline.py)
+PIPELINE_QUEUE_SIZE = 8
+
+def _parse_detection_lines(dataList, batchSize=2000, stages=None, nThreads=1):
+    '''
+        Generator : the (status, fields) of each line of dataList (see _parse_detection_batch) ...
+        ... parsing batchSize lines at a time, so that memory use is still bounded
+        stages : optional pipeline.Pipeline, in which case the lines are read on a reader thread ...
+                 ... & the batches parsed by a pool of nThreads threads, ahead of the consumer
+    '''
+    if stages is not None:
+        batches = stages.map(_parse_detection_batch, stages.source(dataList, chunkSize=batchSize), nWorkers=nThreads, name='parse')
+        for results in batches:
+            yield from results
+        return
+    lines = iter(dataList)
+    while True:
+        batch = list(itertools.islice(lines, batchSize))
+        if not batch:
+            return
+        yield from _parse_detection_batch(batch)
+
+# The values of trkID that mark a detection without a tracklet (which is skipped)
+MISSING_TRKIDS = ["", " ", '""', None]
+
+@instrumentation.timed('detection_block')
+def _process_detection_block(block, trkDict, orbitID_Dict, detectionKeys):
+    '''
+        Calculate the detection-level quantities for all of the detections accumulated in block
+        - Returns a list of output strings (one per successfully processed detection)
+        - Updates trkDict (& orbitID_Dict) with the quantities needed for the tracklet-level calculations
+        - trkDict is keyed on (orbitID, trkID) : a trkID that is linked to several orbitIDs gives a separate tracklet for each ...
+          ... (as it does when the orbitIDs fall in different blocks, or in different shards, see _process_detections_in_parallel)
+        - If anything goes wrong with any of the detections, the entire tracklet is flagged as something to be ignored
+        - Duplicates of earlier detections (found by _find_duplicates) are dropped, as are tracklets all of whose detections are duplicates
+    '''
+    outputListOfStringsForDetections = []
+    N = len(block['detID'])
+    if N == 0:
+        return outputListOfStringsForDetections
+
+    # generate_observatory_position_Heliocentric_Equatorial_Coordinates
+    # - a position of nan indicates a failure (e.g. an unknown obsCode)
+    helio_eq_posn = observatoryCache.get_positions(block['obsCode'], block['timeUTC'])
+
+    # calculate all of the remaining detection-level quantities in one go
+    RA  = np.array(block['RA'],  dtype=np.float64) * 15.
+    Dec = np.array(block['Dec'], dtype=np.float64)
+    fields = features.calc_detection_fields(RA, Dec, helio_eq_posn)
+    UV = np.column_stack( (fields['UV_X'], fields['UV_Y'], fields['UV_Z']) )
+    ACCEPT = fields.pop('ACCEPT') & np.isfinite(np.array(block['timeUTC'], dtype=np.float64))
+    instrumentation.count('detections_processed', N)
+    instrumentation.count('detections_rejected', N - int(ACCEPT.sum()))
+
+    # drop the duplicates (of earlier detections, in this block or in any previous block / shard)
+    if duplicateFilter is not None:
+        isDuplicate = duplicateFilter.filter(block['detID'], block['trkID'], block['orbitID'], block['obsCode'], block['timeUTC'])
+    else:
+        isDuplicate = np.zeros(N, dtype=bool)
+
+    # N.B. tolist() converts to python floats, so that str() gives the same output as before
+    columns = { key : value.tolist() for key, value in fields.items() }
+    for key in ['detID', 'trkID', 'timeUTC', 'Vmag', 'obsCode']:
+        columns[key] = block[key]
+    # format all of the rows at once (the rows of any rejected detections are simply not used)
+    rows = output_writer.format_rows(columns, detectionKeys)
+
+    for n in range(N):
+        trkID   = block['trkID'][n]
+        orbitID = block['orbitID'][n]
+        if isDuplicate[n]:
+            # N.B. a tracklet is only created for its first non-duplicate detection
+            continue
+        key = (orbitID, trkID)
+        if key not in trkDict:
+            trkDict[key] = { 'timeUTC' : [] , 'UV': [] , 'objectID' : orbitID }
+
+        if ACCEPT[n]:
+            # save the data line as a string
+            outputListOfStringsForDetections.append(rows[n])
+
+            # -------- Now store tracklet quantities --------------------
+            trkDict[key]['timeUTC'].append(block['timeUTC'][n])
+            trkDict[key]['UV'].append( UV[n] )
 
-def _process_detections(dataList, numberString, dict_of_Strings_keyed_on_orbitID):
+            # save the orbitID (because it may be useful later on ... )
+            orbitID_Dict[orbitID] = True
+        else:
+            # If anything goes wrong with any of the detections, flag the entire tracklet as something to be ignored
+            trkDict[key]['ACCEPT']=False
+
+    # empty the block, ready for re-use
+    for value in block.values():
+        value.clear()
+    return outputListOfStringsForDetections
+
+
+@instrumentation.timed('process_detections')
+def _process_detections(dataList, numberString, dict_of_Strings_keyed_on_orbitID, outputDirectory=None, writeHeaders=True, outputFormat='csv', compression=None, append=False, pipelineThreads=0):
     '''
         We are reading data that was created from a query of the mpc obs-table in the postgres database ...
         
@@ -117,328 +301,886 @@ def _process_detections(dataList, numberString, dict_of_Strings_keyed_on_orbitID
         
         
         dict_of_Strings_keyed_on_orbitID was created by _process_orbits
+        
+        dataList can be any iterable of lines (e.g. the generator from _iterate_over_file)
+         - the lines are parsed in batches (see _parse_detection_lines), and results are written out every 1000 tracklets ...
+         - ... so memory use is bounded by the size of a batch / block of tracklets, not by the size of the input
+        
+        outputDirectory & writeHeaders allow _process_detections_in_parallel to have each worker write a header-less shard
+        
+        outputFormat selects 'csv', 'npy' (see storage.py) or 'both'
+        
+        The csv files are written by buffered writers (see output_writer.py), which are kept open for the whole run
+         - compression : None, 'gzip' or 'zstd'
+         - append      : if False, new files are written, & only moved into place once all of the detections have been processed
+        
+        pipelineThreads : if > 0, the reading, computing & writing are overlapped, rather than done in strict phases (see pipeline.py) ...
+         - the lines are read on a reader thread, & parsed by pipelineThreads threads (see _parse_detection_lines) ...
+         - ... the blocks of detections & tracklets are processed in this thread (in order) ...
+         - ... & the output lines are written on a writer thread
+         - the output is identical to that of the serial version
     '''
     
     # data containers
-    detDict = {}
     trkDict = {}
     orbitID_Dict = {}
     outputListOfStringsForDetections,outputListOfStringsForTracklets, outputListOfStringsForTrackletsHeader  = [], [], []
     
-    # create the header line & append it to the output container
+    # create the header lines & append them to the output containers
+    # - N.B. the tracklet header is written at the top of the file, together with the first block of tracklets
     detectionKeys = sorted(data.detection_field_definitions.keys())
-    outputListOfStringsForDetections.append("# " + " , ".join( detectionKeys ))
-    print(outputListOfStringsForDetections)
-
     trackletKeys = sorted(data.tracklet_field_definitions.keys())
-    outputListOfStringsForTrackletsHeader.append("# " + " , ".join( trackletKeys ))
-    print(outputListOfStringsForTrackletsHeader)
+    if writeHeaders:
+        outputListOfStringsForDetections.append("# " + " , ".join( detectionKeys ))
+        print(outputListOfStringsForDetections)
+        outputListOfStringsForTrackletsHeader.append("# " + " , ".join( trackletKeys ))
+        print(outputListOfStringsForTrackletsHeader)
     countTrkIDs = 0
     
-    prev_trkID = ''
-    for l,line in enumerate(dataList):
-        totLen=len(dataList)
-        if len(line) < 150 :
-            
-            # immediately try to split the line & parse the obs80 part and use this as a guage of success
-            try:
-                orbitID, detID, trkID, obs80 = line.split(',')
-                obs80 = o.parseOpt(obs80)
-                detDict['detID'] = detID
-                detDict['trkID'] = trkID
+    # reasons for dropping input lines (reported to instrumentation once, at the end)
+    nLines, nTooLong, nParseFailures, nMissingTrkID, nUnknownOrbit = 0, 0, 0, 0, 0
+    
+    writers = _open_writers(numberString, outputDirectory=outputDirectory, compression=compression, append=append) if outputFormat in ('csv', 'both') else None
+    stages  = pipeline.Pipeline(queueSize=PIPELINE_QUEUE_SIZE, name='detection_pipeline') if pipelineThreads > 0 else None
+    try:
+        # the output lines are written either directly, or (when pipelined) on a writer thread
+        def write_to_files(outputs):
+            append_strings_to_files(*outputs, numberString, outputDirectory=outputDirectory, outputFormat=outputFormat, writers=writers)
+        if stages is not None:
+            outputSink = stages.sink(write_to_files, name='write')
+            write_outputs = lambda *outputs: outputSink.submit(outputs)
+        else:
+            write_outputs = lambda *outputs: write_to_files(outputs)
+
+        prev_trkID = ''
+        block = _new_detection_block()
+        # the lines are split & their obs80 records parsed (in batches) by _parse_detection_lines
+        for l, (status, fields) in enumerate(_parse_detection_lines(dataList, stages=stages, nThreads=pipelineThreads)):
+            nLines += 1
+            if status == 'too_long' :
+                nTooLong += 1
+            elif status == 'parse_failure' :
+                nParseFailures += 1
+            else :
+                orbitID, detID, trkID, timeUTC, Vmag, obsCode, RA, Dec = fields
                 if 'K10C00077F' == orbitID:
-                    print( ' orbitID, detID, trkID, obs80 === \n\t' , orbitID, detID, trkID, obs80)
-                PROCEED = True
-            except:
-                PROCEED = False
+                    print( ' orbitID, detID, trkID, obs80 === \n\t' , fields)
             
             
-            if PROCEED and trkID not in  [""," ",'""','\"\"',None] :
+                if trkID in MISSING_TRKIDS :
+                    nMissingTrkID += 1
+                else :
                 
                 
-                # At this point we know the orbitID, so we will only both to proceed if the orbitID is contained in ...
-                # ... the dict_of_Strings_keyed_on_orbitID created by _process_orbits
-                if orbitID in dict_of_Strings_keyed_on_orbitID:
+                    # At this point we know the orbitID, so we will only both to proceed if the orbitID is contained in ...
+                    # ... the dict_of_Strings_keyed_on_orbitID created by _process_orbits
+                    if orbitID not in dict_of_Strings_keyed_on_orbitID:
+                        nUnknownOrbit += 1
+                    else:
 
 
-                    # --- TRACKLET-LEVEL QUANTITIES ------------------
-                    # look for new trkIDs so that we know when it is a good time to periodically write
-                    if trkID != prev_trkID:
-                        countTrkIDs +=1
+                        # --- TRACKLET-LEVEL QUANTITIES ------------------
+                        # look for new trkIDs so that we know when it is a good time to periodically write
+                        if trkID != prev_trkID:
+                            countTrkIDs +=1
                         
-                        # arbitrarily choose to write-out every 1000 tracklets
-                        critCount = 1000
-                        if countTrkIDs % critCount == 0 :
-                            print(" ... l=%15d, countTrkIDs=%10d" % (l , countTrkIDs) , flush=True)
-                            # do_tracklet_calculations_on_accumulated_contents_of_tracklet_dictionary
-                            outputListOfStringsForTracklets = do_tracklet_calculations_on_contents_of_tracklet_dictionary(trkDict, trackletKeys)
+                            # arbitrarily choose to write-out every 1000 tracklets
+                            critCount = 1000
+                            if countTrkIDs % critCount == 0 :
+                                print(" ... l=%15d, countTrkIDs=%10d" % (l , countTrkIDs) , flush=True)
+                                # do the (vectorized) detection-level calculations on the accumulated block of detections
+                                outputListOfStringsForDetections.extend( _process_detection_block(block, trkDict, orbitID_Dict, detectionKeys) )
                             
-                            # write the detection & tracklet strings to file
-                            if countTrkIDs == critCount :
-                                temp_string_list = outputListOfStringsForTracklets
-                                outputListOfStringsForTracklets = outputListOfStringsForTrackletsHeader
-                                outputListOfStringsForTracklets.extend(temp_string_list)
-                            append_strings_to_files(outputListOfStringsForDetections , outputListOfStringsForTracklets, numberString)
+                                # do_tracklet_calculations_on_accumulated_contents_of_tracklet_dictionary
+                                outputListOfStringsForTracklets = do_tracklet_calculations_on_contents_of_tracklet_dictionary(trkDict, trackletKeys)
                             
-                            # reset the strings to ""
-                            outputListOfStringsForDetections,outputListOfStringsForTracklets  = [], []
+                                # write the detection & tracklet strings to file
+                                write_outputs(outputListOfStringsForDetections , outputListOfStringsForTrackletsHeader + outputListOfStringsForTracklets)
+                                outputListOfStringsForTrackletsHeader = []
                             
-                            # reset the trkDict to zero
-                            trkDict = {}
-                            trkDict[trkID] = { 'timeUTC' : [] , 'UV': [] }
+                                # reset the strings to ""
+                                outputListOfStringsForDetections,outputListOfStringsForTracklets  = [], []
+                            
+                                # reset the trkDict to zero
+                                trkDict = {}
 
             
-                    # --- DETECTION-LEVEL QUANTITIES ------------------
-                    # Try to parse each detection
-                    # - But if anything goes wrong with any of the detections, flag the entire tracklet as something to be ignored
-                    try:
-                        
-                        # parse the obs80 line
-                        detDict['timeUTC'] = obs80.jdutc
-                        detDict['Vmag']    = obs80.mag
-                        detDict['obsCode'] = obs80.cod
-                        
-                        RA,Dec = obs80.ra * 15. , obs80.dec
-                        
-                        # convert RA, Dec to unit vector (ecliptic coords)
-                        UV = unitvector_equatorial_to_unitvector_ecliptic( radec_to_unitvector_equatorial(RA,Dec) ) # [None,None,None]
-                        detDict['UV_X'] = UV[0]
-                        detDict['UV_Y'] = UV[1]
-                        detDict['UV_Z'] = UV[2]
-                        
-                        # generate_observatory_position_Heliocentric_Ecliptic_Coordinates
-                        obsPosn = calc_heliocentric_position_of_observatory_in_ecliptic_coords(calc_heliocentric_position_of_observatory_in_equatorial_coords(obs80.cod, obs80.jdutc))
-                        detDict['Obs_X'] = obsPosn[0]
-                        detDict['Obs_Y'] = obsPosn[1]
-                        detDict['Obs_Z'] = obsPosn[2]
-
-                        # calculate_ecliptic_latitude() : [RADIANS]
-                        detDict['eclipticLat'] = np.arctan( detDict['UV_Z'] / ( detDict['UV_X']**2 +detDict['UV_Y']**2 )**0.5 )
-
-                        # calculate_solar_elongation [RADIANS] :
-                        UobsPosn = obsPosn / ( obsPosn[0]**2 + obsPosn[1]**2 + obsPosn[2]**2 )**0.5
-                        detDict['solarElong'] = np.pi - angle_unitvectors(UV,UobsPosn)[0]
-                        
-                        # save the data line as a string
-                        outputstr =  " , ".join( [ str(detDict[key]) for key in detectionKeys ] )
-                        outputListOfStringsForDetections.append(outputstr)
-                    
-                    
-                        # -------- Now store tracklet quantities --------------------
-                        if trkID not in trkDict:
-                            trkDict[trkID] = { 'timeUTC' : [] , 'UV': [] }
-                        trkDict[trkID]['timeUTC'].append(detDict['timeUTC'])
-                        trkDict[trkID]['UV'].append( UV )
-                        trkDict[trkID]['objectID']=orbitID
-
-                        # reset the prev_trkID variable
+                        # --- DETECTION-LEVEL QUANTITIES ------------------
+                        # Accumulate the parsed detections: the calculations are done (in bulk) by _process_detection_block
+                        # - N.B. prev_trkID is now reset as soon as the obs80 line has been parsed
+                        block['orbitID'].append(orbitID)
+                        block['detID'].append(detID)
+                        block['trkID'].append(trkID)
+                        block['timeUTC'].append(timeUTC)
+                        block['Vmag'].append(Vmag)
+                        block['obsCode'].append(obsCode)
+                        block['RA'].append(RA)
+                        block['Dec'].append(Dec)
                         prev_trkID = trkID
-        
-                        # save the orbitID (because it may be useful later on ... )
-                        orbitID_Dict[orbitID] = True
-                        
-                    except:
-                        # If anything goes wrong with any of the detections, flag the entire tracklet as something to be ignored
-                        if trkID not in trkDict:
-                            trkDict[trkID] = { 'timeUTC' : [] , 'UV': [] }
-                        trkDict[trkID]['ACCEPT']=False
-    # if anything remains in trkDict ...
-    # ...do_tracklet_calculations_on_accumulated_contents_of_tracklet_dictionary
-    outputListOfStringsForTracklets = do_tracklet_calculations_on_contents_of_tracklet_dictionary(trkDict, trackletKeys)
-    # ...write the detection & tracklet strings to file
-    append_strings_to_files(outputListOfStringsForDetections , outputListOfStringsForTracklets, numberString)
 
+        # if anything remains in the block / trkDict ...
+        # ...do the detection-level calculations on the remaining detections
+        outputListOfStringsForDetections.extend( _process_detection_block(block, trkDict, orbitID_Dict, detectionKeys) )
+        # ...do_tracklet_calculations_on_accumulated_contents_of_tracklet_dictionary
+        outputListOfStringsForTracklets = do_tracklet_calculations_on_contents_of_tracklet_dictionary(trkDict, trackletKeys)
+        # ...write the detection & tracklet strings to file
+        write_outputs(outputListOfStringsForDetections , outputListOfStringsForTrackletsHeader + outputListOfStringsForTracklets)
+        if stages is not None:
+            # (waits for the writer thread to finish)
+            stages.close()
+    except BaseException:
+        if stages is not None:
+            stages.close(failed=True)
+        # N.B. aborting a (new) file removes it, so that a half-written file is never left behind
+        for writer in (writers or {}).values():
+            writer.abort()
+        raise
+    for writer in (writers or {}).values():
+        writer.commit()
+        print( "wrote %d lines to %s" % (writer.nLines, writer.filepath) , flush=True)
+    if stages is not None:
+        print(stages.summary(), flush=True)
+        stages.record()
+
+    instrumentation.count('lines_read', nLines)
+    instrumentation.count('lines_too_long', nTooLong)
+    instrumentation.count('parse_failures', nParseFailures)
+    instrumentation.count('detections_missing_trkID', nMissingTrkID)
+    instrumentation.count('detections_unknown_orbit', nUnknownOrbit)
 
     return orbitID_Dict
 
+@instrumentation.timed('tracklet_calculations')
 def do_tracklet_calculations_on_contents_of_tracklet_dictionary(trkDict, trackletKeys):
     '''
-        _process_detections causes trkDict to accumulate detection info
+        _process_detections causes trkDict to accumulate detection info (keyed on (orbitID, trkID), see _process_detection_block)
         Now we want to calculate tracklet-level (or detection-to-detection) quantities
+         - The detections of all of the (accepted) tracklets are gathered into flat arrays, sorted by (tracklet, time) ...
+         - ... so that features.calc_tracklet_fields can process every tracklet in a single vectorized pass
     '''
     outputListOfStringsForTracklets = []
-    for trkID in trkDict:
-        
-        
-        # Check whether there were any problems with any of the detections
-        if 'ACCEPT' not in trkDict[trkID] or trkDict[trkID]['ACCEPT'] == True:
-            times = trkDict[trkID]['timeUTC']
-            UVs   = trkDict[trkID]['UV']
-            # ensure that they are sorted
-            try:
-                times, UVs = zip(*sorted(zip(times, UVs)))
-            except:
-                print('Problem with the time, UV sort ...')
-                print('trkID = ', trkID)
-                print('times, UVs = ', times, UVs )
-                trkDict[trkID]['ACCEPT'] = False
-            
-            # get angles between adjacent observations
-            vecAngSepn = [ angle_unitvectors(uv1, uv2)[0] for uv1, uv2 in zip( UVs[:-1], UVs[1:]) ]
-            deltaTimes    = (np.array( times[1:] ) - np.array( times[:-1] ))*3600.*24.
-            # VECTOR OF ANGULAR RATES between adjacent observations
-            vecAngRate    = [a/t for a,t in zip(vecAngSepn,deltaTimes) ]
-            meanAngRate = np.mean(vecAngRate)
-            rms = None
-            
-            
-            trkDict[trkID]['trkID'] = trkID
-            trkDict[trkID]['vecAngSepn'] = list(vecAngSepn)
-            trkDict[trkID]['vecAngRate'] = list(vecAngRate)
-            trkDict[trkID]['meanAngRate'] = meanAngRate
-            trkDict[trkID]['rms'] = rms
-            
-            # save the data line as a string
-            outputstr =  " , ".join( [ str(trkDict[trkID][key]) for key in trackletKeys ] )
-            outputListOfStringsForTracklets.append(outputstr)
 
-        # if there were any problems with a tracklet (either at the detection-level or the racklet-level), don't use this data
-        else:
-            pass
-            
+    # Check whether there were any problems with any of the detections
+    # - if there were any problems with a tracklet (either at the detection-level or the tracklet-level), don't use this data
+    accepted = [key for key in trkDict if 'ACCEPT' not in trkDict[key] or trkDict[key]['ACCEPT'] == True]
+    instrumentation.count('tracklets_accepted', len(accepted))
+    instrumentation.count('tracklets_rejected', len(trkDict) - len(accepted))
+    if not accepted:
+        return outputListOfStringsForTracklets
+
+    # flatten, then ensure that they are sorted (the integer trkIndex preserves the order of the tracklets in trkDict)
+    nDet     = [len(trkDict[key]['timeUTC']) for key in accepted]
+    trkIndex = np.repeat(np.arange(len(accepted)), nDet)
+    times    = np.array([t for key in accepted for t in trkDict[key]['timeUTC']], dtype=np.float64)
+    UVs      = np.array([uv for key in accepted for uv in trkDict[key]['UV']], dtype=np.float64).reshape(-1,3)
+    order    = features.sort_by_tracklet_and_time(trkIndex, times)
+    offsets  = np.zeros(len(accepted) + 1, dtype=np.int64)
+    np.cumsum(nDet, out=offsets[1:])
+
+    # get angles & angular rates between adjacent observations, their mean, & the rms about a straight-line fit
+    fields = features.calc_tracklet_fields(offsets, times[order], UVs[order])
+
+    # save the data lines as strings
+    # N.B. tolist() converts to python floats, so that str() gives the same output as before
+    columns = { 'trkID'       : [ trkID for orbitID, trkID in accepted ],
+                'objectID'    : [ trkDict[key]['objectID'] for key in accepted ],
+                'vecAngSepn'  : [ _.tolist() for _ in fields['vecAngSepn'] ],
+                'vecAngRate'  : [ _.tolist() for _ in fields['vecAngRate'] ],
+                'meanAngRate' : fields['meanAngRate'].tolist(),
+                'rms'         : fields['rms'].tolist() }
+    outputListOfStringsForTracklets.extend( output_writer.format_rows(columns, trackletKeys) )
+
     return outputListOfStringsForTracklets
 
-def append_strings_to_files(outputListOfStringsForDetections , outputListOfStringsForTracklets, numberString):
+def _output_filepath(numberString, dataType, outputDirectory=None, compression=None):
     '''
-        ...
+        Path of the sample-data file of the given dataType ('detections', 'tracklets' or 'objects') ...
+        ... or of the report of the removed duplicates ('duplicates')
+        - By default the files are written into neo_ml/neo_ml/sample_data
+        - compressed files have the suffix of the compression appended (see output_writer.compressed_filepath)
     '''
-    # detections
-    outputfilepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' , 'sample_data_%s_real_detections.csv' % numberString)
-    _append_to_file(outputfilepath , outputListOfStringsForDetections)
-
-    # tracklets
-    outputfilepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' , 'sample_data_%s_real_tracklets.csv' % numberString)
-    _append_to_file(outputfilepath , outputListOfStringsForTracklets)
+    if outputDirectory is None:
+        outputDirectory = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' )
+    return output_writer.compressed_filepath( os.path.join( outputDirectory , 'sample_data_%s_real_%s.csv' % (numberString, dataType) ), compression )
 
-
-def _process_orbits(dataList ):
+def _open_writers(numberString, outputDirectory=None, compression=None, append=False):
     '''
-        dataList looks like ...
-        desig_pkd,peri_dist,eccentricity,incl,arg_peri,asc_node,peri_time
-        K17A00000Z,1.860740581,0.327816993,11.9724421,24.3326162,353.2247911,2459182.9309837
-        
+        Open (buffered) writers for the detection & tracklet csv files, keyed on dataType
+        - New files are only renamed into place when the writers are committed (see output_writer.BufferedLineWriter)
     '''
+    return { dataType : output_writer.BufferedLineWriter( _output_filepath(numberString, dataType, outputDirectory=outputDirectory, compression=compression), append=append, compression=compression )
+             for dataType in ('detections', 'tracklets') }
 
-    # data containers
-    orbitDict = {}
-    dict_of_Strings_keyed_on_orbitID = {}
-    
-    # create the header line & append it to the output container
-    keys = sorted(data.object_field_definitions.keys())
-    headerString = "# " + " , ".join( keys )
-    
-    for line in dataList:
-        
-        # split each line
-        objectID, orbit_q, orbit_e, orbit_i, orbit_AP, orbit_LAN, orbit_TP = line.strip().split(',')
-        
-        # if this orbit corresponds to an object in the detection/tracklets, then we want that data. Otherwise, we are not interested
-        
-        orbitDict['objectID']=objectID
-        orbitDict['orbit_q']=orbit_q
-        orbitDict['orbit_e']=orbit_e
-        orbitDict['orbit_i']=orbit_i
-        orbitDict['orbit_AP']=orbit_AP
-        orbitDict['orbit_LAN']=orbit_LAN
-        orbitDict['orbit_TP']=orbit_TP
-
-        # NEO ?
-        orbitDict['isNEO'] = True if float(orbit_q) < 1.3 else False
-        orbitDict['objectType'] = None
-
-        # save the data line as a string
-        outputstr =  " , ".join( [ str(orbitDict[key]) for key in keys ] )
-        dict_of_Strings_keyed_on_orbitID[objectID] = outputstr
-
-    return headerString, dict_of_Strings_keyed_on_orbitID
-
-
-
-
-
-def _write_to_file(filepath, outputListOfStrings ):
-    with open (filepath, 'w') as fh:
-        for line in outputListOfStrings:
-            fh.write(line + "\n")
-    print( "created ", filepath , flush=True)
+@instrumentation.timed('write_outputs')
+def append_strings_to_files(outputListOfStringsForDetections , outputListOfStringsForTracklets, numberString, outputDirectory=None, outputFormat='csv', writers=None):
+    '''
+        ...
+        outputFormat : 'csv', 'npy' or 'both'
+         - the npy output is appended as a new part of a binary dataset (see storage.py) ...
+         - ... and the parts are combined by storage.finalize once all of the detections have been processed
+        writers : the (open) csv writers from _open_writers
+         - if None, the csv files are opened, appended to, & closed again
+    '''
+    assert outputFormat in ('csv', 'npy', 'both'), 'unknown outputFormat : %r' % outputFormat
+    instrumentation.count('detections_written', sum( not line.startswith('#') for line in outputListOfStringsForDetections ))
+    instrumentation.count('tracklets_written', sum( not line.startswith('#') for line in outputListOfStringsForTracklets ))
+
+    for dataType, outputListOfStrings, fieldDtypes, dataKey in (('detections', outputListOfStringsForDetections, data.detection_field_dtypes, 'detID'),
+                                                                 ('tracklets',  outputListOfStringsForTracklets,  data.tracklet_field_dtypes,  'trkID')):
+        outputfilepath = _output_filepath(numberString, dataType, outputDirectory=outputDirectory)
+        if outputFormat in ('csv', 'both'):
+            if writers is not None:
+                writers[dataType].write_lines(outputListOfStrings)
+            else:
+                _append_to_file(outputfilepath , outputListOfStrings)
+        if outputFormat in ('npy', 'both'):
+            _append_to_binary(outputfilepath , outputListOfStrings, fieldDtypes, dataKey)
+
+@instrumentation.timed('finalize_binary')
+def finalize_binary_files(numberString, outputDirectory=None):
+    ''' Combine the parts written by append_strings_to_files (with outputFormat 'npy' or 'both') into single .npy files'''
+    for dataType in ('detections', 'tracklets'):
+        directory = storage.binary_path_from_csv_path( _output_filepath(numberString, dataType, outputDirectory=outputDirectory) )
+        storage.finalize(directory)
+        print( "finalized ", directory , flush=True)
 
-def _append_to_file(filepath, outputListOfStrings ):
-    with open (filepath, 'a') as fh:
-        for line in outputListOfStrings:
-            fh.write(line + "\n")
-    print( "appended to ", filepath , flush=True)
 
+# ----------------------------------------
+# Duplicate detections
+# ----------------------------------------
+# The duplicates (see dedup.py) are found before the detections are processed, so that the same ones are removed ...
+# ... whether the detections are processed serially, in shards, or incrementally
+# - The keys of the detections are calculated (in parallel, for the shards), & then checked in a single, in-order pass
+# - Only the tracklets with duplicates are recorded, so the result is small, & is handed to the processing via the duplicateFilter
 
+def _duplicate_keys(dataList, dict_of_Strings_keyed_on_orbitID, batchSize=100000):
+    '''
+        The keys (see dedup.DuplicateIndex.keys) of the detections in dataList that _process_detections processes, in order ...
+        ... together with the (orbitID, trkID) & the number of detections of each (consecutive) tracklet
+        N.B. the detections are selected in the same way as in _process_detections
+    '''
+    index = dedup.DuplicateIndex()
+    keys, trackletKeys, trackletSizes = [], [], []
+    batch = { key : [] for key in ('detID', 'obsCode', 'timeUTC', 'RA', 'Dec') }
+
+    def _add_batch():
+        if batch['detID']:
+            # (the unit vectors are calculated as in features.calc_detection_fields)
+            RADec = features.radec_to_unitvector_equatorial( np.array(batch['RA'], dtype=np.float64) * 15., np.array(batch['Dec'], dtype=np.float64) )
+            UV    = features.unitvector_equatorial_to_unitvector_ecliptic( RADec.reshape(-1,3) )
+            keys.append( index.keys(batch['detID'], batch['obsCode'], batch['timeUTC'], UV) )
+            for value in batch.values():
+                value.clear()
+
+    for status, fields in _parse_detection_lines(dataList):
+        if status != 'ok':
+            continue
+        orbitID, detID, trkID, timeUTC, Vmag, obsCode, RA, Dec = fields
+        if trkID in MISSING_TRKIDS or orbitID not in dict_of_Strings_keyed_on_orbitID:
+            continue
+        if trackletKeys and trackletKeys[-1] == (orbitID, trkID):
+            trackletSizes[-1] += 1
+        else:
+            trackletKeys.append( (orbitID, trkID) )
+            trackletSizes.append(1)
+        for key, value in zip(('detID', 'obsCode', 'timeUTC', 'RA', 'Dec'), (detID, obsCode, timeUTC, RA, Dec)):
+            batch[key].append(value)
+        if len(batch['detID']) >= batchSize:
+            _add_batch()
+    _add_batch()
+
+    if not keys:
+        keys = [ (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=bool)) ]
+    return tuple( np.concatenate(_) for _ in zip(*keys) ), trackletKeys, trackletSizes
+
+@instrumentation.timed('find_duplicates')
+def _find_duplicates(shardKeys):
+    '''
+        Find the duplicates amongst the detections of a sequence of shards, from their keys (see _duplicate_keys) ...
+        ... checking the shards in order, so that the result is the same as for a single pass over the whole input
+        Returns, for each shard, the reasons for removing its duplicates, grouped by tracklet (see dedup.DuplicateFilter)
+    '''
+    index = dedup.DuplicateIndex()
+    return [ dedup.reasons_by_tracklet(index.find(*keys), trackletKeys, trackletSizes) for keys, trackletKeys, trackletSizes in shardKeys ]
 
+def _find_duplicates_in_file(filepath, dict_of_Strings_keyed_on_orbitID):
+    ''' The reasons for removing the duplicates amongst all of the detections of the (sorted) input file (see _find_duplicates)'''
+    return _find_duplicates([ _duplicate_keys(_iterate_over_file(filepath, nSkip=1), dict_of_Strings_keyed_on_orbitID) ])[0]
 
 
-# ----------- SELECT SOURCE FILE LENGTH ----
-numberString = '1e6'
+# ----------------------------------------
+# Parallel (sharded) processing of the detections
+# ----------------------------------------
+# The sorted input file is split into shards at tracklet boundaries, so that no tracklet is spread across two shards
+# - Each worker runs _process_detections on one shard, writing (header-less) output files into a temporary directory
+# - The shard outputs are then concatenated (in order) after the headers, reproducing the output of the serial run
 
+def _trkID_from_line(line):
+    ''' Extract the trkID from a (bytes) line of the input file (or None if the line cannot be split)'''
+    fields = line.split(b',')
+    return fields[2] if len(fields) >= 4 else None
 
-# ----------- ORBITS -----------------------
-# I want to start by processing all of the orbits (because they are small and can all be held easily in memory)
-# - After both they and the detections have been processed, I will down-select to only keep the orbits that have corresponding detections/tracklets
+def _find_shard_boundaries(filepath, nShards):
+    '''
+        Split the (sorted) input file into (at most) nShards byte-ranges
+        - The first range starts after the header line
+        - Every subsequent range starts at the first line of a new tracklet
+        Returns a list of (start, end) byte-offsets
+    '''
+    fileSize = os.path.getsize(filepath)
+    with open(filepath, 'rb') as fh:
+        fh.readline()
+        boundaries = [fh.tell()]
+        for n in range(1, nShards):
+            target = boundaries[0] + (fileSize - boundaries[0]) * n // nShards
+            if target <= boundaries[-1]:
+                continue
+
+            # move to the start of the next full line, & then on to the start of the next tracklet
+            fh.seek(target - 1)
+            fh.readline()
+            line = fh.readline()
+            trkID = _trkID_from_line(line)
+            while line:
+                position = fh.tell()
+                line = fh.readline()
+                if _trkID_from_line(line) != trkID:
+                    break
+            if line and position > boundaries[-1]:
+                boundaries.append(position)
+    boundaries.append(fileSize)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def _iterate_over_byte_range(filepath, start, end):
+    '''
+        Lazily read the lines in the byte-range [start, end) of a file (equivalent to the same lines from _iterate_over_file)
+        N.B. start & end must fall on line boundaries (see _find_shard_boundaries)
+    '''
+    with open(filepath, 'rb') as fh:
+        fh.seek(start)
+        position = start
+        while position < end:
+            line = fh.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode().replace('\r\n', '\n')
+
+# Set by _init_shard_worker in each worker process (to avoid re-sending the orbit dictionary with every shard)
+_shard_dict_of_Strings_keyed_on_orbitID = None
+
+def _init_shard_worker(dict_of_Strings_keyed_on_orbitID, observatoryCacheSize, interpolationStep, instrumented=False):
+    global _shard_dict_of_Strings_keyed_on_orbitID
+    _shard_dict_of_Strings_keyed_on_orbitID = dict_of_Strings_keyed_on_orbitID
+    _set_observatory_cache(observatoryCacheSize, interpolationStep=interpolationStep)
+    if instrumented:
+        instrumentation.enable()
+
+def _shard_duplicate_keys(args):
+    ''' The keys of the detections of a single shard of the input file (see _duplicate_keys)'''
+    filepath, start, end = args
+    return _duplicate_keys(_iterate_over_byte_range(filepath, start, end), _shard_dict_of_Strings_keyed_on_orbitID)
+
+def _process_shard(args):
+    '''
+        Run _process_detections on a single shard of the input file
+         - duplicateReasons : the duplicates to remove from the shard (see _find_duplicates), or None to keep them
+        Returns the list of orbitIDs with accepted detections, the metrics collected while processing the shard ...
+        ... & the duplicates removed from the shard (see dedup.py)
+    '''
+    filepath, start, end, shardDirectory, shardNumberString, outputFormat, compression, pipelineThreads, duplicateReasons = args
+    instrumentation.reset()
+    # N.B. the cache persists across the shards processed by a worker
+    cacheStats = observatoryCache.stats()
+    _set_duplicate_filter(duplicateReasons)
+    dataList = _iterate_over_byte_range(filepath, start, end)
+    orbitID_Dict = _process_detections(dataList, shardNumberString, _shard_dict_of_Strings_keyed_on_orbitID,
+                                       outputDirectory=shardDirectory, writeHeaders=False, outputFormat=outputFormat, compression=compression, pipelineThreads=pipelineThreads)
+    print('observatory cache (shard %s) : %r' % (shardNumberString, observatoryCache.stats()), flush=True)
+    _record_observatory_cache_stats(previous=cacheStats)
+    return list(orbitID_Dict), instrumentation.snapshot(), (duplicateFilter.removed if duplicateFilter is not None else [])
+
+def _process_detections_in_parallel(filepath, numberString, dict_of_Strings_keyed_on_orbitID, nWorkers, nShards=None, outputFormat='csv', compression=None, pipelineThreads=0, deduplicate=True, outputDirectory=None):
+    '''
+        Equivalent to _process_detections(_read_from_file(filepath)[1:], numberString, dict_of_Strings_keyed_on_orbitID) ...
+        ... but with the work spread across a pool of nWorkers processes
+         - each worker compresses its own shards, which are then concatenated (see output_writer.concatenate)
+        
+        N.B. As with the serial version, the input file must already be sorted on (orbitID, trkID, ...)
+        N.B. The duplicates are found across all of the shards (see _find_duplicates) before they are processed ...
+             ... & the rows removed from the shards are collected (in shard order) in the duplicateFilter of this process
+    '''
+    # use several shards per worker to even out the load
+    shards = _find_shard_boundaries(filepath, nShards if nShards is not None else 4 * nWorkers)
+    print('split %s into %d shards' % (filepath, len(shards)), flush=True)
+
+    outputDirectory = os.path.dirname( _output_filepath(numberString, 'detections', outputDirectory=outputDirectory) )
+    import concurrent.futures
+    shardDirectory  = tempfile.mkdtemp(prefix='sample_data_%s_shards_' % numberString, dir=outputDirectory)
+    shardNumberStrings = ['%s_shard%05d' % (numberString, n) for n in range(len(shards))]
+    try:
+        initargs = (dict_of_Strings_keyed_on_orbitID, observatoryCache.stats()['maxsize'], observatoryCache.interpolationStep, instrumentation.is_enabled())
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nWorkers, initializer=_init_shard_worker, initargs=initargs) as executor:
+            # find the duplicates : the keys of the shards are calculated in parallel, & then checked in order
+            if deduplicate:
+                duplicateReasons = _find_duplicates( executor.map(_shard_duplicate_keys, [ (filepath, start, end) for start, end in shards ]) )
+            else:
+                duplicateReasons = [None] * len(shards)
+
+            # process the shards
+            tasks = [ (filepath, start, end, shardDirectory, shardNumberString, outputFormat, compression, pipelineThreads, reasons) for (start, end), shardNumberString, reasons in zip(shards, shardNumberStrings, duplicateReasons) ]
+            results = list(executor.map(_process_shard, tasks))
+
+        # merge: the headers, followed by the contents of each shard (in order)
+        orbitID_Dict = {}
+        # (the filter of this process holds the duplicates of all of the shards, & collects the rows removed from them)
+        _set_duplicate_filter( { key : reasons for shardReasons in duplicateReasons for key, reasons in shardReasons.items() } if deduplicate else None )
+        for orbitIDs, metrics, removed in results:
+            instrumentation.merge(metrics)
+            for orbitID in orbitIDs:
+                orbitID_Dict[orbitID] = True
+            if duplicateFilter is not None:
+                duplicateFilter.removed.extend(removed)
+        headerKeys = { 'detections' : sorted(data.detection_field_definitions.keys()) , 'tracklets' : sorted(data.tracklet_field_definitions.keys()) }
+        for dataType, keys in headerKeys.items():
+            outputfilepath = _output_filepath(numberString, dataType, outputDirectory=outputDirectory)
+            if outputFormat in ('csv', 'both'):
+                shardfilepaths = [ _output_filepath(shardNumberString, dataType, outputDirectory=shardDirectory, compression=compression) for shardNumberString in shardNumberStrings ]
+                output_writer.concatenate(_output_filepath(numberString, dataType, outputDirectory=outputDirectory, compression=compression), shardfilepaths, header="# " + " , ".join( keys ), compression=compression)
+            if outputFormat in ('npy', 'both'):
+                # the binary parts are simply moved (in shard order): storage.finalize combines them later
+                for shardNumberString in shardNumberStrings:
+                    shardfilepath = _output_filepath(shardNumberString, dataType, outputDirectory=shardDirectory)
+                    storage.move_parts( storage.binary_path_from_csv_path(shardfilepath), storage.binary_path_from_csv_path(outputfilepath) )
+            print( "merged %d shards into %s" % (len(shards), _output_filepath(numberString, dataType, outputDirectory=outputDirectory, compression=compression)) , flush=True)
+    finally:
+        shutil.rmtree(shardDirectory, ignore_errors=True)
 
-print("---ORBITS---")
+    return orbitID_Dict
 
-# read the orbits
-filepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'raw_data' , 'sample_orbit_large.csv')
-dataList = _read_from_file(filepath)[1:]
-print("length of raw data = ", len(dataList))
+def compare_serial_and_parallel(filepath, dict_of_Strings_keyed_on_orbitID, nWorkers, nShards=None, deduplicate=True):
+    '''
+        Check that _process_detections_in_parallel gives the same output as the serial _process_detections ...
+        ... (the detections, the tracklets & the removed duplicates), writing both into a temporary directory
+         - nShards : by default, many (small) shards, so that many tracklets & orbits fall either side of a shard boundary
+        Returns a list of the differences (empty if the outputs are identical)
+        N.B. the input should include trkIDs that are linked to several orbitIDs (the number of which is printed) ...
+             ... as they are what a sharded run is most likely to treat differently (e.g. by merging them in one shard only)
+    '''
+    orbitIDs = {}
+    for fields in map(_split_detection_line, _iterate_over_file(filepath, nSkip=1)):
+        if fields is not None:
+            orbitIDs.setdefault(fields[2], set()).add(fields[0])
+    print('%d trkIDs are linked to more than one orbitID' % sum( len(_) > 1 for _ in orbitIDs.values() ), flush=True)
+
+    directory = tempfile.mkdtemp(prefix='compare_workers_', dir=os.path.dirname( _output_filepath('', 'detections') ))
+    try:
+        removed = {}
+        _set_duplicate_filter( _find_duplicates_in_file(filepath, dict_of_Strings_keyed_on_orbitID) if deduplicate else None )
+        _process_detections(_iterate_over_file(filepath, nSkip=1), 'serial', dict_of_Strings_keyed_on_orbitID, outputDirectory=directory)
+        removed['serial'] = duplicateFilter.removed if duplicateFilter is not None else []
+        _process_detections_in_parallel(filepath, 'parallel', dict_of_Strings_keyed_on_orbitID, nWorkers, nShards=nShards if nShards is not None else 16 * nWorkers,
+                                        deduplicate=deduplicate, outputDirectory=directory)
+        removed['parallel'] = duplicateFilter.removed if duplicateFilter is not None else []
+
+        differences = []
+        for dataType in ('detections', 'tracklets'):
+            serialLines   = _read_from_file( _output_filepath('serial', dataType, outputDirectory=directory) )
+            parallelLines = _read_from_file( _output_filepath('parallel', dataType, outputDirectory=directory) )
+            different = [ n for n, (a, b) in enumerate(zip(serialLines, parallelLines)) if a != b ]
+            if different or len(serialLines) != len(parallelLines):
+                example = 'e.g. line %d : %r vs %r' % (different[0], serialLines[different[0]], parallelLines[different[0]]) if different else ''
+                differences.append('%s : %d vs %d lines, %d of which differ %s' % (dataType, len(serialLines), len(parallelLines), len(different), example))
+        if removed['serial'] != removed['parallel']:
+            differences.append('duplicates : %d vs %d rows removed' % (len(removed['serial']), len(removed['parallel'])))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return differences
 
-# process the orbits
-headerStringOrbits, dict_of_Strings_keyed_on_orbitID = _process_orbits(dataList)
-print('headerStringOrbits', headerStringOrbits)
-print('len(dict_of_Strings_keyed_on_orbitID) = ', len(dict_of_Strings_keyed_on_orbitID) )
-key0 = list(dict_of_Strings_keyed_on_orbitID.keys())[0] ; print('\t key0=%s : value0=%s' % (key0, dict_of_Strings_keyed_on_orbitID[key0]) )
 
 
+# ----------------------------------------
+# Incremental processing of the detections
+# ----------------------------------------
+# Rather than rebuilding the sample data from scratch, only process the tracklets that are new (or have changed) ...
+# ... since the last run, & append the results to the existing output files
+# - A manifest records a fingerprint of the input lines of every processed tracklet, & the objectIDs in the objects file
+# - Tracklets are marked as "pending" in the manifest before they are processed, & only given their fingerprint afterwards ...
+#   ... so that the rows from an interrupted run are removed & reprocessed by the next run (rather than duplicated)
+
+MANIFEST_VERSION = 1
+
+def _manifest_filepath(numberString, outputDirectory=None):
+    return _output_filepath(numberString, 'manifest', outputDirectory=outputDirectory).replace('.csv', '.json')
+
+def _read_manifest(filepath):
+    ''' The manifest is a dictionary : {'trkIDs' : {trkID : fingerprint-or-None}, 'objectIDs' : [objectID, ...]}'''
+    if not os.path.isfile(filepath):
+        return {'version' : MANIFEST_VERSION, 'trkIDs' : {}, 'objectIDs' : []}
+    with open(filepath, 'r') as fh:
+        manifest = json.load(fh)
+    assert manifest['version'] == MANIFEST_VERSION, 'unsupported manifest version %r in %s' % (manifest['version'], filepath)
+    return manifest
+
+def _write_manifest(filepath, manifest):
+    # write-then-rename, so that a crash never leaves a partially written manifest
+    with open(filepath + '.tmp', 'w') as fh:
+        json.dump(manifest, fh)
+    os.replace(filepath + '.tmp', filepath)
+
+def _fingerprint_tracklets(dataList, duplicateReasons=None):
+    '''
+        Fingerprint (a hash of the input lines) of each tracklet in dataList
+         - duplicateReasons : the duplicates that are removed (see _find_duplicates), which are included in the fingerprint ...
+           ... so that a tracklet is reprocessed if any of its detections becomes (or stops being) a duplicate
+        Returns a dictionary keyed on trkID
+         - lines that cannot be split into their fields are skipped (as they are by _process_detections)
+    '''
+    fingerprints = {}
+    splits = ( (line, _split_detection_line(line)) for line in dataList )
+    splits = ( split for split in splits if split[1] is not None )
+    for trkID, group in itertools.groupby(splits, key=lambda split: split[1][2]):
+        h = hashlib.blake2b(digest_size=8)
+        # N.B. the lines of a (duplicated) trkID can appear under more than one orbitID
+        h.update( fingerprints.get(trkID, '').encode() )
+        orbitIDs = []
+        for line, fields in group:
+            h.update( line.strip().encode() )
+            if not orbitIDs or orbitIDs[-1] != fields[0]:
+                orbitIDs.append( fields[0] )
+        for orbitID in orbitIDs:
+            if duplicateReasons and (orbitID, trkID) in duplicateReasons:
+                h.update( repr(duplicateReasons[(orbitID, trkID)]).encode() )
+        fingerprints[trkID] = h.hexdigest()
+    return fingerprints
+
+def _remove_trkIDs_from_outputs(numberString, trkIDs, outputFormat='csv', compression=None):
+    '''
+        Remove the rows for the supplied trkIDs from the detection & tracklet output files (& from the report of the duplicates)
+        - The csv files are filtered line-by-line into a new file, which then replaces the original (see output_writer)
+        - Only needed when previously processed tracklets have changed, so the cost is not paid by a typical (append-only) update
+    '''
+    trkIDs = set(trkIDs)
+    for dataType, keys in (('detections', sorted(data.detection_field_definitions.keys())), ('tracklets', sorted(data.tracklet_field_definitions.keys())), ('duplicates', dedup.REPORT_KEYS)):
+        outputfilepath = _output_filepath(numberString, dataType)
+        # (the report of the duplicates is never compressed, nor written in binary)
+        csvfilepath    = _output_filepath(numberString, dataType, compression=compression if dataType != 'duplicates' else None)
+        column = keys.index('trkID')
+        if (outputFormat in ('csv', 'both') or dataType == 'duplicates') and os.path.isfile(csvfilepath):
+            nRemoved = 0
+            with output_writer.open_text(csvfilepath) as fh, output_writer.BufferedLineWriter(csvfilepath, compression=compression) as writer:
+                for line in fh:
+                    if line.strip() == '' or line.strip()[0] == '#' or columnar.tokenize_line(line)[column] not in trkIDs:
+                        writer.write_lines( [line.rstrip('\n')] )
+                    else:
+                        nRemoved += 1
+            print( "removed %d rows from %s" % (nRemoved, csvfilepath) , flush=True)
+        directory = storage.binary_path_from_csv_path(outputfilepath)
+        if outputFormat in ('npy', 'both') and dataType != 'duplicates' and storage.is_binary_dataset(directory):
+            binaryData = storage.read_columnar(directory, mmap=False)
+            keep = ~np.isin(binaryData.columns['trkID'], np.array(sorted(trkIDs), dtype='S'))
+            if not np.all(keep):
+                storage.write_columnar(directory, binaryData.select(keep))
+            print( "removed %d rows from %s" % (np.sum(~keep), directory) , flush=True)
+
+def _remove_existing_outputs(numberString):
+    ''' A full (non-incremental) run starts from scratch: remove any previous outputs, so that rows are never duplicated'''
+    for dataType in ('detections', 'tracklets', 'objects', 'duplicates'):
+        outputfilepath = _output_filepath(numberString, dataType)
+        # (with any compression, & any temporary file left by an interrupted run)
+        for compression in output_writer.COMPRESSION_SUFFIXES:
+            for filepath in (_output_filepath(numberString, dataType, compression=compression), _output_filepath(numberString, dataType, compression=compression) + '.tmp'):
+                if os.path.isfile(filepath):
+                    os.remove(filepath)
+        if os.path.isdir( storage.binary_path_from_csv_path(outputfilepath) ):
+            shutil.rmtree( storage.binary_path_from_csv_path(outputfilepath) )
+    if os.path.isfile(_manifest_filepath(numberString)):
+        os.remove(_manifest_filepath(numberString))
+
+def _process_detections_incrementally(filepath, numberString, dict_of_Strings_keyed_on_orbitID, outputFormat='csv', compression=None, pipelineThreads=0, deduplicate=True):
+    '''
+        Equivalent to _process_detections(_read_from_file(filepath)[1:], numberString, dict_of_Strings_keyed_on_orbitID) ...
+        ... but only the tracklets that are not already in the manifest (or whose input lines have changed) are processed
+        - The input file is read twice: once to fingerprint the tracklets, & then to process the selected tracklets
+        - The duplicates are found amongst all of the detections (not just those of the selected tracklets), as in a full run ...
+          ... & are part of the fingerprints, so that a tracklet whose duplicates change (e.g. because an earlier copy of one ...
+          ... of its detections has been added) is reprocessed, & the result is the same as that of a full run
+        Returns the orbitID_Dict for the processed tracklets, & the manifest
+    '''
+    manifestfilepath = _manifest_filepath(numberString)
+    manifest = _read_manifest(manifestfilepath)
+
+    # (i) select the new/changed tracklets (N.B. a fingerprint of None marks a tracklet from an interrupted run)
+    duplicateReasons = _find_duplicates_in_file(filepath, dict_of_Strings_keyed_on_orbitID) if deduplicate else None
+    fingerprints = _fingerprint_tracklets(_iterate_over_file(filepath, nSkip=1), duplicateReasons)
+    selected = { trkID : fp for trkID, fp in fingerprints.items() if manifest['trkIDs'].get(trkID) != fp }
+    changed  = [ trkID for trkID in selected if trkID in manifest['trkIDs'] ]
+    print('incremental : %d tracklets in input, %d to be processed (of which %d previously processed)' % (len(fingerprints), len(selected), len(changed)), flush=True)
+
+    # (ii) remove the rows of any changed tracklets, & mark the selected tracklets as pending
+    if changed:
+        _remove_trkIDs_from_outputs(numberString, changed, outputFormat=outputFormat, compression=compression)
+    manifest['trkIDs'].update( { trkID : None for trkID in selected } )
+    _write_manifest(manifestfilepath, manifest)
+
+    # (iii) process the selected tracklets, appending to the existing files (headers are only needed for new files)
+    _set_duplicate_filter(duplicateReasons)
+    def _is_selected(line):
+        fields = _split_detection_line(line)
+        return fields is not None and fields[2] in selected
+    dataList = filter(_is_selected, _iterate_over_file(filepath, nSkip=1))
+    writeHeaders = not os.path.isfile( _output_filepath(numberString, 'detections', compression=compression) ) and not os.path.isdir( storage.binary_path_from_csv_path(_output_filepath(numberString, 'detections')) )
+    orbitID_Dict = _process_detections(dataList, numberString, dict_of_Strings_keyed_on_orbitID, writeHeaders=writeHeaders, outputFormat=outputFormat, compression=compression, append=True, pipelineThreads=pipelineThreads)
+
+    # (iv) record the fingerprints of the processed tracklets
+    manifest['trkIDs'].update( selected )
+    _write_manifest(manifestfilepath, manifest)
+    return orbitID_Dict, manifest
+
+def _append_new_objects(numberString, headerStringOrbits, dict_of_Strings_keyed_on_orbitID, orbitID_Dict, manifest, outputFormat='csv', compression=None):
+    '''
+        Append the objects for any new orbitIDs to the (existing) objects file(s), & record them in the manifest
+        - Objects that are already in the file are left untouched, so the file is never rewritten
+    '''
+    existing   = set(manifest['objectIDs'])
+    newObjects = [ k for k in dict_of_Strings_keyed_on_orbitID if k in orbitID_Dict and k not in existing ]
+    outputListOfStrings = [ dict_of_Strings_keyed_on_orbitID[k] for k in newObjects ]
+    print('incremental : appending %d new objects' % len(newObjects), flush=True)
 
-# ---------- DETECTIONS -------------------
-print()
-print("---DETECTIONS & TRACKLETS---")
-# pre-sort step ...
-#command = "sort -t, -k1,1 -k3,2 -k2,3 sample_obs_large.csv > sample_obs_large_sorted.csv"
+    outputfilepath = _output_filepath(numberString, 'objects')
+    if outputFormat in ('csv', 'both'):
+        csvfilepath = _output_filepath(numberString, 'objects', compression=compression)
+        _append_to_file(csvfilepath , ([] if os.path.isfile(csvfilepath) else [headerStringOrbits]) + outputListOfStrings)
+    if outputFormat in ('npy', 'both'):
+        _append_to_binary(outputfilepath , outputListOfStrings, data.object_field_dtypes, 'objectID')
+        storage.finalize( storage.binary_path_from_csv_path(outputfilepath) )
 
-# read the detections
-print("reading...")
-filepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'raw_data' , 'sample_obs_%s_sorted.csv' % numberString )
-dataList = _read_from_file(filepath)[1:]
-print(len(dataList))
+    manifest['objectIDs'].extend(newObjects)
+    _write_manifest(_manifest_filepath(numberString), manifest)
 
-# process the detections
-print("processing...")
-orbitID_Dict = _process_detections(dataList, numberString, dict_of_Strings_keyed_on_orbitID)
-print('length of orbitID_dict returned from _process_detections step = ... ', len(orbitID_Dict) )
-key0 = list( orbitID_Dict.keys())[0] ; print(' \t Example of orbitID from orbitID_Dict ... %s:%s' % (key0 , orbitID_Dict[key0]) )
 
+@instrumentation.timed('process_orbits')
+def _process_orbits(dataList, nWorkers=1):
+    '''
+        dataList looks like ...
+        desig_pkd,peri_dist,eccentricity,incl,arg_peri,asc_node,peri_time
+        K17A00000Z,1.860740581,0.327816993,11.9724421,24.3326162,353.2247911,2459182.9309837
+        
+        The orbits are parsed, labelled (isNEO) & classified (objectType) in a single pass ...
+        ... using the vectorized functions in orbit_classification.py
+         - with nWorkers > 1 the orbits are split into blocks, which are processed by a pool of worker processes
+         - returns the header & a (read-only) mapping from objectID to the output string for that object
+    '''
 
+    # create the header line & append it to the output container
+    keys = sorted(data.object_field_definitions.keys())
+    headerString = "# " + " , ".join( keys )
+    instrumentation.count('orbits_read', len(dataList))
 
+    if nWorkers > 1 and len(dataList) > nWorkers:
+        import concurrent.futures
+        chunkSize = -(-len(dataList) // nWorkers)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nWorkers) as executor:
+            results = list(executor.map(orbit_classification.classify_orbit_lines, [ dataList[n:n + chunkSize] for n in range(0, len(dataList), chunkSize) ]))
+        columns = { key : list(itertools.chain.from_iterable( _[key] for _ in results )) for key in keys }
+    else:
+        columns = orbit_classification.classify_orbit_lines(dataList)
 
+    # the data lines are only formatted as strings when they are needed (i.e. for the objects that are written out)
+    dict_of_Strings_keyed_on_orbitID = orbit_classification.ObjectStrings(columns, keys)
 
-# ----------- ORBITS -----------------------
-print("--- TRIMMING ORBITS ... ---")
-# only select the orbits that have data in the detection/tracklet dictionary
+    return headerString, dict_of_Strings_keyed_on_orbitID
 
-tmpListOfStrings = []
-for k,v in dict_of_Strings_keyed_on_orbitID.items():
-    if k in orbitID_Dict:
-        tmpListOfStrings.append(v)
 
-outputListOfStrings = [headerStringOrbits]
-outputListOfStrings.extend(tmpListOfStrings)
-print('len(outputListOfStrings) = %d ' % len(outputListOfStrings) )
-print('outputListOfStrings[0] = ', outputListOfStrings[0])
-print('outputListOfStrings[1] = ', outputListOfStrings[1])
 
-# save the orbits to file
-outputfilepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' , 'sample_data_%s_real_objects.csv' % numberString )
-_write_to_file(outputfilepath , outputListOfStrings)
 
 
+def _write_to_file(filepath, outputListOfStrings ):
+    ''' (Atomically) write the lines to filepath, compressed according to its suffix (see output_writer)'''
+    with output_writer.BufferedLineWriter(filepath, compression=output_writer.compression_from_filepath(filepath)) as writer:
+        writer.write_lines(outputListOfStrings)
+    print( "created ", filepath , flush=True)
 
+def _append_to_file(filepath, outputListOfStrings ):
+    with output_writer.BufferedLineWriter(filepath, append=True, compression=output_writer.compression_from_filepath(filepath)) as writer:
+        writer.write_lines(outputListOfStrings)
+    print( "appended to ", filepath , flush=True)
 
+def _append_to_binary(filepath, outputListOfStrings, fieldDtypes, dataKey):
+    '''
+        Append the (non-header) lines to the binary dataset that accompanies the csv filepath
+        The lines are parsed using the same code that reads the csv files (columnar.parse_lines), ...
+        ... so the binary & csv versions of the data are guaranteed to be identical
+    '''
+    lines = [ line for line in outputListOfStrings if not line.startswith('#') ]
+    if lines:
+        headerKeys = sorted(fieldDtypes.keys())
+        directory  = storage.binary_path_from_csv_path(filepath)
+        storage.append_part(directory, columnar.parse_lines(lines, headerKeys, fieldDtypes, filepath), dataKey)
+        print( "appended to ", directory , flush=True)
+
+
+
+
+
+def main(argv=None, prog=None):
+    ''' Create the sample data from the raw MPC data (see the argparse help)'''
+
+    import argparse
+
+    # ----------- SELECT SOURCE FILE LENGTH & NUMBER OF WORKERS ----
+    parser = argparse.ArgumentParser(prog=prog, description='Create the sample data in neo_ml/neo_ml/sample_data (requires internal MPC data/code)')
+    parser.add_argument('--numberString', default='1e6', help='Selects the input file, raw_data/sample_obs_<numberString>_sorted.csv, & labels the output files')
+    parser.add_argument('--sort', action='store_true', help='First sort the (unsorted) raw_data/sample_obs_<numberString>.csv (e.g. a psql dump) into raw_data/sample_obs_<numberString>_sorted.csv')
+    parser.add_argument('--sortMemory', type=int, default=256, help='Approximate memory [MB] used by --sort: larger inputs are sorted out-of-core, via temporary files in raw_data')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes used to process the orbits & detections (1 => serial)')
+    parser.add_argument('--observatoryCacheSize', type=int, default=2**17, help='Number of (obsCode, JDutc) observatory positions to memoize (per process)')
+    parser.add_argument('--outputFormat', default='csv', choices=['csv', 'npy', 'both'], help='Write the output as csv, as memory-mappable .npy datasets (see storage.py), or both')
+    parser.add_argument('--pipelineThreads', type=int, default=0, help='If > 0, overlap the reading, parsing (with this many threads) & writing of the detections (see pipeline.py)')
+    parser.add_argument('--keepDuplicates', action='store_true', help='Do not remove duplicate detections & tracklets (see dedup.py)')
+    parser.add_argument('--compareWorkers', type=int, default=0, help='Instead of creating the sample data, check that processing the detections with this many workers gives the same output as the serial version')
+    parser.add_argument('--incremental', action='store_true', help='Only process the tracklets that are new/changed since the last run (see _process_detections_incrementally)')
+    parser.add_argument('--observatoryInterpolationStep', type=float, default=None, help='If set, interpolate observatory positions from a time-grid with this spacing [days]')
+    parser.add_argument('--compression', default=None, choices=['gzip', 'zstd'], help='Compress the csv output files (zstd requires the zstandard package)')
+    parser.add_argument('--metrics', default=None, help='Write the timings & counters of each stage to this file (*.jsonl : append to a structured log, otherwise Prometheus text format)')
+    parser.add_argument('--profile', default=None, help='Profile the run with cProfile, & dump the statistics to this file')
+    parser.add_argument('--tracemalloc', action='store_true', help='Also record the peak (python-allocated) memory of each stage (slow)')
+    args = parser.parse_args(argv)
+    if args.metrics or args.profile or args.tracemalloc:
+        instrumentation.enable(profile=args.profile is not None, tracemalloc=args.tracemalloc)
+    assert not (args.incremental and args.workers > 1), '--incremental is only supported with a single worker'
+    numberString = args.numberString
+    _set_observatory_cache(args.observatoryCacheSize, interpolationStep=args.observatoryInterpolationStep)
+
+
+    # ----------- ORBITS -----------------------
+    # I want to start by processing all of the orbits (because they are small and can all be held easily in memory)
+    # - After both they and the detections have been processed, I will down-select to only keep the orbits that have corresponding detections/tracklets
+
+    print("---ORBITS---")
+
+    # read the orbits
+    filepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'raw_data' , 'sample_orbit_large.csv')
+    dataList = _read_from_file(filepath)[1:]
+    print("length of raw data = ", len(dataList))
+
+    # process the orbits
+    headerStringOrbits, dict_of_Strings_keyed_on_orbitID = _process_orbits(dataList, nWorkers=args.workers)
+    print('headerStringOrbits', headerStringOrbits)
+    print('len(dict_of_Strings_keyed_on_orbitID) = ', len(dict_of_Strings_keyed_on_orbitID) )
+    key0 = list(dict_of_Strings_keyed_on_orbitID.keys())[0] ; print('\t key0=%s : value0=%s' % (key0, dict_of_Strings_keyed_on_orbitID[key0]) )
+
+
+
+    # ---------- DETECTIONS -------------------
+    print()
+    print("---DETECTIONS & TRACKLETS---")
+    # pre-sort step ...
+    # - the detections must be sorted on (orbitID, trkID, time), as tracklets are identified by changes of trkID
+    # - this used to be done outside of the pipeline (sort -t, -k1,1 -k3,2 -k2,3 sample_obs_large.csv > sample_obs_large_sorted.csv)
+    filepath = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'raw_data' , 'sample_obs_%s_sorted.csv' % numberString )
+    if args.sort:
+        rawFilepath = _raw_observations_filepath(numberString)
+        print("sorting %s ..." % rawFilepath, flush=True)
+        nSorted = external_sort.sort_file(rawFilepath, filepath, _detection_sort_key, nHeader=1, memoryBudget=args.sortMemory * 2**20)
+        print("sorted %d lines into %s" % (nSorted, filepath), flush=True)
+    if args.compareWorkers > 1:
+        # (a check of the parallel processing, rather than a run : nothing is written to sample_data)
+        print("comparing the serial & parallel (%d workers) processing..." % args.compareWorkers, flush=True)
+        differences = compare_serial_and_parallel(filepath, dict_of_Strings_keyed_on_orbitID, args.compareWorkers, deduplicate=not args.keepDuplicates)
+        for difference in differences:
+            print('DIFFERENCE : %s' % difference)
+        print('the serial & parallel outputs are %s' % ('different' if differences else 'identical'))
+        return 1 if differences else 0
+    if args.incremental:
+        # only read & process the new/changed tracklets, appending to the existing files
+        print("reading & processing (incremental)...")
+        orbitID_Dict, manifest = _process_detections_incrementally(filepath, numberString, dict_of_Strings_keyed_on_orbitID, outputFormat=args.outputFormat, compression=args.compression, pipelineThreads=args.pipelineThreads, deduplicate=not args.keepDuplicates)
+        print('observatory cache : %r' % observatoryCache.stats())
+    elif args.workers > 1:
+        # read & process the detections in parallel
+        print("processing (%d workers)..." % args.workers)
+        _remove_existing_outputs(numberString)
+        orbitID_Dict = _process_detections_in_parallel(filepath, numberString, dict_of_Strings_keyed_on_orbitID, args.workers, outputFormat=args.outputFormat, compression=args.compression, pipelineThreads=args.pipelineThreads, deduplicate=not args.keepDuplicates)
+    else:
+        # lazily read (skipping the header line) & process the detections
+        print("reading & processing...")
+        _remove_existing_outputs(numberString)
+        _set_duplicate_filter( _find_duplicates_in_file(filepath, dict_of_Strings_keyed_on_orbitID) if not args.keepDuplicates else None )
+        dataList = _iterate_over_file(filepath, nSkip=1)
+        orbitID_Dict = _process_detections(dataList, numberString, dict_of_Strings_keyed_on_orbitID, outputFormat=args.outputFormat, compression=args.compression, pipelineThreads=args.pipelineThreads)
+        print('observatory cache : %r' % observatoryCache.stats())
+    if args.outputFormat in ('npy', 'both'):
+        finalize_binary_files(numberString)
+    if duplicateFilter is not None:
+        # report the duplicates that were removed
+        # - an --incremental run appends those found in that run (the rows of any reprocessed tracklets have already been removed)
+        print(duplicateFilter.summary())
+        dedup.record_counts(duplicateFilter.removed)
+        duplicatesfilepath = _output_filepath(numberString, 'duplicates')
+        if args.incremental and os.path.isfile(duplicatesfilepath):
+            _append_to_file(duplicatesfilepath, dedup.report_lines(duplicateFilter.removed)[1:])
+        else:
+            _write_to_file(duplicatesfilepath, dedup.report_lines(duplicateFilter.removed))
+    print('length of orbitID_dict returned from _process_detections step = ... ', len(orbitID_Dict) )
+    if orbitID_Dict:
+        key0 = list( orbitID_Dict.keys())[0] ; print(' \t Example of orbitID from orbitID_Dict ... %s:%s' % (key0 , orbitID_Dict[key0]) )
+
+
+
+
+
+    # ----------- ORBITS -----------------------
+    print("--- TRIMMING ORBITS ... ---")
+    if args.incremental:
+        # append any new objects to the existing file(s)
+        _append_new_objects(numberString, headerStringOrbits, dict_of_Strings_keyed_on_orbitID, orbitID_Dict, manifest, outputFormat=args.outputFormat, compression=args.compression)
+    else:
+        # only select the orbits that have data in the detection/tracklet dictionary
+
+        tmpListOfStrings = []
+        for k,v in dict_of_Strings_keyed_on_orbitID.items():
+            if k in orbitID_Dict:
+                tmpListOfStrings.append(v)
+
+        outputListOfStrings = [headerStringOrbits]
+        outputListOfStrings.extend(tmpListOfStrings)
+        print('len(outputListOfStrings) = %d ' % len(outputListOfStrings) )
+        print('outputListOfStrings[0] = ', outputListOfStrings[0])
+        print('outputListOfStrings[1] = ', outputListOfStrings[1])
+
+        # save the orbits to file
+        outputfilepath = _output_filepath(numberString, 'objects')
+        if args.outputFormat in ('csv', 'both'):
+            _write_to_file(_output_filepath(numberString, 'objects', compression=args.compression) , outputListOfStrings)
+        if args.outputFormat in ('npy', 'both'):
+            objectColumns = columnar.parse_lines(outputListOfStrings[1:], sorted(data.object_field_definitions.keys()), data.object_field_dtypes, outputfilepath)
+            storage.write_columnar( storage.binary_path_from_csv_path(outputfilepath), columnar.ColumnarData(objectColumns, 'objectID') )
+            print( "created ", storage.binary_path_from_csv_path(outputfilepath) , flush=True)
+
+        # record what has been processed, so that subsequent runs can be --incremental
+        manifest = {'version' : MANIFEST_VERSION,
+                    'trkIDs'    : _fingerprint_tracklets(_iterate_over_file(filepath, nSkip=1), duplicateFilter.reasons if duplicateFilter is not None else None),
+                    'objectIDs' : [ k for k in dict_of_Strings_keyed_on_orbitID if k in orbitID_Dict ]}
+        _write_manifest(_manifest_filepath(numberString), manifest)
+
+    # ----------- INSTRUMENTATION ----------------
+    if instrumentation.is_enabled():
+        # (with several workers, the cache statistics of each worker are merged from the shards)
+        if args.workers <= 1:
+            _record_observatory_cache_stats()
+        print("---METRICS---")
+        print(instrumentation.summary())
+        if args.metrics:
+            instrumentation.write_metrics(args.metrics, numberString=numberString, workers=args.workers, outputFormat=args.outputFormat)
+            print("wrote metrics to", args.metrics)
+        if args.profile:
+            print(instrumentation.write_profile(args.profile))
+            print("wrote profile to", args.profile)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
 
 '''
     Problems experienced with duplicate observations for ... 
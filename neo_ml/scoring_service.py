@@ -0,0 +1,428 @@
+'''
+    Online (low-latency) scoring of newly submitted tracklets : isNEO scores for the raw detections of each tracklet
+    Intended for the real-time triage of short arcs, as they are submitted (cf. the offline batch pipeline of sample_data_creation.py)
+
+     - The service is a local asyncio server, speaking JSON-lines over a Unix socket (or TCP) ...
+       ... each request is a single line, e.g. {"id": 7, "trkID": "abc", "detections": [<obs80 record>, ...]}
+       ... & each response is a single line, e.g. {"id": 7, "trkID": "abc", "isNEO": 0.93, "error": null}
+       ... a connection may send many requests without waiting : the responses are matched to them via the id
+       ... {"stats": true} returns the latency percentiles, batch sizes, etc
+     - Concurrent requests are grouped into micro-batches (see MicroBatcher) ...
+       ... a batch is scored as soon as it holds maxBatch tracklets, or maxWait seconds after its first tracklet arrived
+     - Each batch is scored in a single vectorized pass, using the same calculations as the offline pipeline ...
+       ... obs80_parser.parse_obs80, ObservatoryPositionCache.get_positions & features.calc_detection_fields (cf. _process_detections) ...
+       ... features.calc_tracklet_fields (cf. do_tracklet_calculations_on_contents_of_tracklet_dictionary) ...
+       ... & FeatureMatrixBuilder.build_from_data, so that the features are exactly those used for training
+     - As offline, a tracklet is rejected (with an error) if any of its detections cannot be parsed / processed
+       ... or if it has fewer than 2 detections (as a single detection has no angular rate)
+     - The model is pluggable (see load_model) : the default (AngularRateModel) is only a simple baseline
+
+    Usage (e.g.) ...
+    python cli.py serve --socket /tmp/neo_ml.sock --maxBatch 64 --maxWait 0.005 --model my_models:load
+    scoring_service.request_scores([ [<obs80 record>, ...], ... ], socketPath='/tmp/neo_ml.sock')
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import json
+import time
+import asyncio
+import importlib
+from collections import deque
+import numpy as np
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import features
+import columnar
+import observatory
+import obs80_parser
+import feature_matrix
+import instrumentation
+
+
+DEFAULT_SOCKET_PATH = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'scoring_service.sock' )
+PERCENTILES         = (50, 90, 99)
+
+
+# -----------------------------------
+# Feature calculation & scoring
+# -----------------------------------
+
+def _failures(errors):
+    ''' A list of (None, error) results'''
+    return [ (None, error) for error in errors ]
+
+@instrumentation.timed('score_tracklets')
+def score_tracklets(tracklets, model, builder, observatoryCache):
+    '''
+        Score a batch of tracklets in a single vectorized pass
+         - tracklets        : list of lists of obs80 records (the detections of each tracklet)
+         - model            : see load_model
+         - builder          : FeatureMatrixBuilder (N.B. with dropUnlabelled=False)
+         - observatoryCache : observatory.ObservatoryPositionCache
+        Returns a list of (score, error) : one per tracklet, with score None if the tracklet could not be scored
+    '''
+    nTrk = len(tracklets)
+    nDet = np.array([ len(detections) for detections in tracklets ], dtype=np.int64)
+    if nDet.sum() == 0:
+        return _failures( ['no detections'] * nTrk )
+    trkIndex = np.repeat(np.arange(nTrk), nDet)
+    records  = [ record for detections in tracklets for record in detections ]
+
+    # detection-level quantities (cf. _process_detections)
+    # - if anything goes wrong with any of the detections, the entire tracklet is rejected
+    columns, ok = obs80_parser.parse_obs80(records)
+    helio_eq_posn = observatoryCache.get_positions(columns['cod'].tolist(), columns['jdutc'].tolist())
+    fields = features.calc_detection_fields(columns['ra'] * 15., columns['dec'], helio_eq_posn)
+    ACCEPT = ok & fields['ACCEPT'] & np.isfinite(columns['jdutc'])
+    nFailed  = np.bincount(trkIndex[~ACCEPT], minlength=nTrk)
+    # N.B. a single detection has no (finite) angular rate, which the feature matrix would otherwise fill with 0
+    accepted = (nDet >= 2) & (nFailed == 0)
+    instrumentation.count('scoring_detections', len(records))
+    instrumentation.count('scoring_tracklets_rejected', nTrk - int(accepted.sum()))
+
+    errors = [ None if accepted[k] else 'no detections' if nDet[k] == 0 else '%d of %d detections could not be processed' % (nFailed[k], nDet[k]) if nFailed[k] else 'fewer than 2 detections' for k in range(nTrk) ]
+    if not accepted.any():
+        return _failures(errors)
+
+    # tracklet-level quantities (cf. do_tracklet_calculations_on_contents_of_tracklet_dictionary)
+    keep    = np.flatnonzero(accepted[trkIndex])
+    order   = keep[ features.sort_by_tracklet_and_time(trkIndex[keep], columns['jdutc'][keep]) ]
+    trkRows = np.flatnonzero(accepted)
+    offsets = np.zeros(len(trkRows) + 1, dtype=np.int64)
+    np.cumsum(nDet[trkRows], out=offsets[1:])
+    UV = np.column_stack( (fields['UV_X'], fields['UV_Y'], fields['UV_Z']) )[order]
+    trackletFields = features.calc_tracklet_fields(offsets, columns['jdutc'][order], UV)
+
+    # the feature matrix (N.B. the tracklets are keyed on their position in the batch, as the submitted trkIDs need not be unique)
+    trkIDs     = np.array([ str(k) for k in trkRows ])
+    detections = columnar.ColumnarData({ 'detID'       : np.arange(len(order)).astype(str),
+                                         'trkID'       : trkIDs[ np.repeat(np.arange(len(trkRows)), nDet[trkRows]) ],
+                                         'timeUTC'     : columns['jdutc'][order],
+                                         'eclipticLat' : fields['eclipticLat'][order],
+                                         'solarElong'  : fields['solarElong'][order],
+                                         'Vmag'        : columns['mag'][order] }, 'detID')
+    tracklets  = columnar.ColumnarData(dict(trackletFields, trkID=trkIDs, objectID=np.full(len(trkRows), '', dtype='U1')), 'trkID')
+    objects    = columnar.ColumnarData({ 'objectID' : np.zeros(0, dtype='U1'), 'isNEO' : np.zeros(0, dtype=bool) }, 'objectID')
+    featureMatrix = builder.build_from_data(detections, tracklets, objects)
+
+    with instrumentation.timer('scoring_model'):
+        scores = predict(model, featureMatrix.X)
+    results = _failures(errors)
+    for k, score in zip(trkRows, scores.tolist()):
+        results[k] = (score, None)
+    return results
+
+
+# -----------------------------------
+# Models
+# -----------------------------------
+
+class AngularRateModel():
+    '''
+        Baseline model : a logistic function of the (log of the) mean angular rate of the tracklet
+        - NEOs are typically seen close to the Earth, so move across the sky much faster than the main-belt asteroids
+        - rate      : rate at which the score is 0.5 [radians / s] (default: 1 deg / day)
+        - steepness : per factor of 10 in the rate
+        N.B. this is a placeholder, until a trained model is plugged in (see load_model)
+    '''
+
+    def __init__(self, featureNames, rate=np.radians(1.) / 86400., steepness=4.):
+        self.column    = list(featureNames).index('meanAngRate')
+        self.rate      = rate
+        self.steepness = steepness
+
+    def __call__(self, X):
+        with np.errstate(divide='ignore', over='ignore'):
+            z = self.steepness * ( np.log10(np.asarray(X[:, self.column], dtype=np.float64)) - np.log10(self.rate) )
+            return 1. / (1. + np.exp(-z))
+
+def load_model(spec, featureNames):
+    '''
+        Load the model named by spec : "module:attribute" (None => AngularRateModel)
+         - the attribute is called with the list of featureNames (i.e. the names of the columns of X), & must return the model
+         - the model is either a callable, X -> array of scores ...
+           ... or has a predict_proba method (e.g. a scikit-learn classifier), in which case the score is that of the second class
+    '''
+    if spec is None:
+        return AngularRateModel(featureNames)
+    assert ':' in spec, 'the model must be specified as "module:attribute" : %r' % spec
+    moduleName, attribute = spec.split(':', 1)
+    return getattr(importlib.import_module(moduleName), attribute)(featureNames)
+
+def predict(model, X):
+    ''' The isNEO scores of the rows of X, as a float64 array'''
+    scores = model.predict_proba(X)[:, 1] if hasattr(model, 'predict_proba') else model(X)
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    assert len(scores) == len(X), 'the model returned %d scores for %d tracklets' % (len(scores), len(X))
+    return scores
+
+
+# -----------------------------------
+# Micro-batching
+# -----------------------------------
+
+class LatencyRecorder():
+    '''
+        Records the latencies [s] of the most recent (window) requests, & the sizes of the most recent batches
+        - percentiles are calculated on demand (see stats)
+    '''
+
+    def __init__(self, window=10000):
+        self.latencies  = deque(maxlen=window)
+        self.batchSizes = deque(maxlen=window)
+        self.nRequests  = 0
+        self.nBatches   = 0
+
+    def record_batch(self, latencies):
+        self.latencies.extend(latencies)
+        self.batchSizes.append(len(latencies))
+        self.nRequests += len(latencies)
+        self.nBatches  += 1
+
+    def stats(self):
+        ''' Dictionary of the latency percentiles [ms], the mean batch size, etc'''
+        stats = { 'nRequests' : self.nRequests, 'nBatches' : self.nBatches,
+                  'meanBatchSize' : float(np.mean(self.batchSizes)) if self.batchSizes else 0. }
+        latencies = np.array(self.latencies) * 1000.
+        for p in PERCENTILES:
+            stats['latency_p%d_ms' % p] = float(np.percentile(latencies, p)) if len(latencies) else None
+        stats['latency_max_ms'] = float(latencies.max()) if len(latencies) else None
+        return stats
+
+class MicroBatcher():
+    '''
+        Groups concurrently submitted items into batches, which are processed (in order, one at a time) by process
+         - process  : function, list of items -> list of results (one per item) ...
+                      ... called in a worker thread, so that the event loop keeps accepting requests meanwhile
+         - maxBatch : maximum number of items in a batch
+         - maxWait  : maximum time [s] for which the first item of a batch waits for more items to arrive
+                      (0 => each batch holds whatever had arrived by the time that the previous batch finished)
+
+        Usage (e.g., within a coroutine) ...
+        batcher = MicroBatcher(process, maxBatch=64, maxWait=0.005)
+        batcher.start()
+        result = await batcher.submit(item)
+    '''
+
+    def __init__(self, process, maxBatch=64, maxWait=0.005, latencyWindow=10000):
+        assert maxBatch >= 1 and maxWait >= 0, 'maxBatch must be positive & maxWait non-negative'
+        self.process  = process
+        self.maxBatch = int(maxBatch)
+        self.maxWait  = float(maxWait)
+        self.latency  = LatencyRecorder(latencyWindow)
+        self._queue   = None
+        self._task    = None
+
+    def start(self):
+        ''' Start the batching task (N.B. must be called from within the running event loop)'''
+        self._queue = asyncio.Queue()
+        self._task  = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, item):
+        ''' Queue item for the next batch, & wait for its result'''
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put( (item, future, time.perf_counter()) )
+        return await future
+
+    async def _next_batch(self):
+        ''' Wait for the first item, then collect more until the batch is full or maxWait has elapsed'''
+        batch    = [ await self._queue.get() ]
+        deadline = time.perf_counter() + self.maxWait
+        while len(batch) < self.maxBatch:
+            if not self._queue.empty():
+                batch.append( self._queue.get_nowait() )
+                continue
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append( await asyncio.wait_for(self._queue.get(), timeout) )
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            instrumentation.count('scoring_batches')
+            instrumentation.gauge('scoring_queue_depth', self._queue.qsize())
+            try:
+                results = await loop.run_in_executor(None, self.process, [ item for item, future, submitted in batch ])
+                assert len(results) == len(batch), 'process returned %d results for a batch of %d' % (len(results), len(batch))
+            except Exception as exception:
+                results = None
+                for item, future, submitted in batch:
+                    if not future.done():
+                        future.set_exception(exception)
+            if results is not None:
+                for (item, future, submitted), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            now = time.perf_counter()
+            self.latency.record_batch([ now - submitted for item, future, submitted in batch ])
+
+
+# -----------------------------------
+# Server
+# -----------------------------------
+
+class ScoringService():
+    '''
+        The (asyncio, JSON-lines) scoring server : see the module docstring for the protocol
+         - model            : see load_model
+         - maxBatch/maxWait : the batching policy (see MicroBatcher)
+         - builder          : FeatureMatrixBuilder (default: that of the offline pipeline, without dropping the unlabelled tracklets)
+         - observatoryCache : ObservatoryPositionCache (shared by all of the batches)
+    '''
+
+    def __init__(self, model, maxBatch=64, maxWait=0.005, builder=None, observatoryCache=None):
+        self.model            = model
+        self.builder          = builder if builder is not None else feature_matrix.FeatureMatrixBuilder(dropUnlabelled=False, cacheDirectory=None)
+        self.observatoryCache = observatoryCache if observatoryCache is not None else observatory.ObservatoryPositionCache()
+        self.batcher          = MicroBatcher(self._score_batch, maxBatch=maxBatch, maxWait=maxWait)
+        assert not self.builder.dropUnlabelled, 'the builder must keep the (unlabelled) submitted tracklets'
+
+    def _score_batch(self, tracklets):
+        return score_tracklets(tracklets, self.model, self.builder, self.observatoryCache)
+
+    def stats(self):
+        stats = self.batcher.latency.stats()
+        stats.update( maxBatch=self.batcher.maxBatch, maxWait=self.batcher.maxWait, observatoryCache=self.observatoryCache.stats() )
+        return stats
+
+    async def _respond(self, line, writer):
+        ''' Handle a single request (line), writing a single response'''
+        message = {}
+        try:
+            message = json.loads(line)
+            assert isinstance(message, dict), 'the request must be a JSON object'
+            if message.get('stats'):
+                response = { 'stats' : self.stats() }
+            else:
+                detections = message.get('detections')
+                assert isinstance(detections, list) and all(isinstance(_, str) for _ in detections), '"detections" must be a list of obs80 records'
+                score, error = await self.batcher.submit(detections)
+                response = { 'id' : message.get('id'), 'trkID' : message.get('trkID'), 'isNEO' : score, 'error' : error }
+        except Exception as exception:
+            message  = message if isinstance(message, dict) else {}
+            response = { 'id' : message.get('id'), 'trkID' : message.get('trkID'), 'isNEO' : None, 'error' : '%s: %s' % (type(exception).__name__, exception) }
+        writer.write( (json.dumps(response) + '\n').encode() )
+
+    async def handle_connection(self, reader, writer):
+        ''' Handle all of the requests on a connection (N.B. concurrently, so that a single client can fill a batch)'''
+        pending = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(self._respond(line, writer))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socketPath=None, host=None, port=None, ready=None):
+        '''
+            Serve until cancelled, on the Unix socket socketPath or (if given) on TCP host:port
+            ready : optional asyncio.Event, set once the server is accepting connections
+        '''
+        self.batcher.start()
+        if port is not None:
+            server = await asyncio.start_server(self.handle_connection, host or '127.0.0.1', port)
+        else:
+            if os.path.exists(socketPath):
+                os.remove(socketPath)
+            server = await asyncio.start_unix_server(self.handle_connection, socketPath)
+        try:
+            if ready is not None:
+                ready.set()
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+            if port is None and os.path.exists(socketPath):
+                os.remove(socketPath)
+
+
+# -----------------------------------
+# Client
+# -----------------------------------
+
+async def _request_scores(tracklets, socketPath=None, host=None, port=None):
+    if port is not None:
+        reader, writer = await asyncio.open_connection(host or '127.0.0.1', port)
+    else:
+        reader, writer = await asyncio.open_unix_connection(socketPath)
+    try:
+        writer.write( b''.join( (json.dumps({ 'id' : n, 'detections' : list(detections) }) + '\n').encode() for n, detections in enumerate(tracklets) ) )
+        await writer.drain()
+        responses = [ json.loads(await reader.readline()) for _ in tracklets ]
+    finally:
+        writer.close()
+    return sorted(responses, key=lambda response: response['id'])
+
+def request_scores(tracklets, socketPath=DEFAULT_SOCKET_PATH, host=None, port=None):
+    ''' Client : submit a list of tracklets (each a list of obs80 records) to a running service, returning the list of responses'''
+    return asyncio.run( _request_scores(tracklets, socketPath=socketPath, host=host, port=port) )
+
+
+# -----------------------------------
+# Driver
+# -----------------------------------
+
+def main(argv=None, prog=None):
+    ''' Run the scoring service until interrupted, then print the latency statistics'''
+
+    import argparse
+    parser = argparse.ArgumentParser(prog=prog, description='Serve isNEO scores for newly submitted tracklets (JSON-lines over a Unix socket or TCP)')
+    parser.add_argument('--socket',   default=DEFAULT_SOCKET_PATH, help='Path of the Unix socket (default: %(default)s)')
+    parser.add_argument('--port',     type=int, default=None, help='Serve on TCP (localhost) instead of a Unix socket')
+    parser.add_argument('--host',     default='127.0.0.1')
+    parser.add_argument('--model',    default=None, help='"module:attribute" of a function, featureNames -> model (default: the angular-rate baseline)')
+    parser.add_argument('--maxBatch', type=int, default=64, help='Maximum number of tracklets scored in one batch')
+    parser.add_argument('--maxWait',  type=float, default=0.005, help='Maximum time [s] that a request waits for its batch to fill')
+    parser.add_argument('--metrics',  default=None, help='Write the metrics (Prometheus text format) to this file on exit')
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        instrumentation.enable()
+    builder = feature_matrix.FeatureMatrixBuilder(dropUnlabelled=False, cacheDirectory=None)
+    service = ScoringService(load_model(args.model, builder.feature_names()), maxBatch=args.maxBatch, maxWait=args.maxWait, builder=builder)
+    print('serving on %s (maxBatch=%d, maxWait=%gs)' % ('%s:%d' % (args.host, args.port) if args.port is not None else args.socket, args.maxBatch, args.maxWait))
+    try:
+        asyncio.run( service.serve(socketPath=args.socket, host=args.host, port=args.port) )
+    except KeyboardInterrupt:
+        pass
+
+    stats = service.stats()
+    print(json.dumps(stats, indent=1))
+    if args.metrics:
+        instrumentation.record_stats('scoring', stats)
+        instrumentation.write_metrics(args.metrics, command='serve')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+'''
+    Spatio-temporal index over the detections
+    Intended for finding candidate tracklet linkages, and for finding detections close to known objects ...
+    ... without O(N^2) scans over 1e6+ detections
+
+    The detections are binned on ...
+     - time      : bins of timeBinSize [days] (the default of 1 day => roughly one bin per night)
+     - sky-position : a regular 3D grid of cubes of side cellSize [chord-length] laid over the ecliptic unit vectors (UV_X, UV_Y, UV_Z)
+    The bins are stored as a single sorted array of integer keys, so a look-up is a binary search (np.searchsorted)
+
+    A cone search (angle theta, time-window dt) only needs to inspect the (few) bins that could contain a match ...
+    ... and the candidates from those bins are then filtered exactly
+     - the number of bins inspected per query grows as (theta/cellSize)^3, so the queries are processed in ...
+       ... chunks of at most maxBins (query, bin) pairs, & pairs_within re-bins on cellSize ~ theta for wide searches
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import numpy as np
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def chord_from_angle(angle):
+    ''' Straight-line distance between two unit vectors separated by angle [radians]'''
+    return 2. * np.sin(0.5 * np.asarray(angle, dtype=np.float64))
+
+def _expand_ranges(starts, ends):
+    '''
+        Convert arrays of [start, end) ranges into a single array of all of the integers in those ranges
+        Also returns the number of integers in each range
+    '''
+    lengths = np.maximum(ends - starts, 0)
+    total   = int(lengths.sum())
+    if total == 0:
+        return np.array([], dtype=np.int64), lengths
+    # position of each output element within its own range
+    within  = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + within, lengths
+
+
+# -----------------------------------
+# Define some useful class(es)
+# -----------------------------------
+
+class DetectionIndex():
+    '''
+        Index on (sky-position, time) over an array of detections
+
+        UV          : (N,3) array of ecliptic unit vectors (e.g. UV_X, UV_Y, UV_Z from the detection data)
+        timeUTC     : length-N array of times [JDUTC]
+        cellSize    : angular size of the sky-bins [radians]
+                      - searches are most efficient when the search-angle is <~ cellSize
+        timeBinSize : size of the time-bins [days]
+
+        All of the queries return (integer) row-numbers into the arrays used to construct the index
+         - e.g. detections.columns['detID'][indices] for an index built with from_detections
+    '''
+
+    def __init__(self, UV, timeUTC, cellSize=np.radians(1.), timeBinSize=1.):
+        self.UV          = np.asarray(UV, dtype=np.float64).reshape(-1,3)
+        self.timeUTC     = np.asarray(timeUTC, dtype=np.float64)
+        assert self.timeUTC.shape == (len(self.UV),), 'inconsistent input lengths'
+        assert cellSize > 0 and timeBinSize > 0, 'cellSize & timeBinSize must be positive'
+        self.cellSize    = float(cellSize)
+        self.timeBinSize = float(timeBinSize)
+
+        # 3D grid: unit vectors have coordinates in [-1, 1], so the (shifted) cell coordinates lie in [0, nSide)
+        self._chord      = float(chord_from_angle(self.cellSize))
+        self._nHalf      = int(np.ceil(1. / self._chord))
+        self._nSide      = 2 * self._nHalf + 1
+        self._timeBin0   = int(np.floor(self.timeUTC.min() / self.timeBinSize)) if len(self.timeUTC) else 0
+
+        # sort the detections on their (time-bin, cell) key
+        keys             = self._keys( self._cell_coords(self.UV), self._time_bins(self.timeUTC) )
+        self.order       = np.argsort(keys, kind='stable')
+        self.sortedKeys  = keys[self.order]
+
+    @classmethod
+    def from_detections(cls, detections, **kwargs):
+        ''' Build an index from a ColumnarData object of detections (e.g. from NEODATA.read_detections_columnar)'''
+        UV = np.column_stack( [detections.columns['UV_X'], detections.columns['UV_Y'], detections.columns['UV_Z']] )
+        return cls(UV, detections.columns['timeUTC'], **kwargs)
+
+    def __len__(self):
+        return len(self.UV)
+
+    def _cell_coords(self, UV):
+        ''' (N,3) integer coordinates of the sky-cell(s) containing the unit vector(s)'''
+        return np.clip( np.floor(np.atleast_2d(UV) / self._chord).astype(np.int64) + self._nHalf, 0, self._nSide - 1)
+
+    def _time_bins(self, timeUTC):
+        return np.floor(np.asarray(timeUTC, dtype=np.float64) / self.timeBinSize).astype(np.int64) - self._timeBin0
+
+    def _keys(self, cellCoords, timeBins):
+        ''' Single integer key per (time-bin, cell) : unique for any integer time-bin, provided 0 <= cellCoords < nSide'''
+        n = self._nSide
+        return ((timeBins * n + cellCoords[:,0]) * n + cellCoords[:,1]) * n + cellCoords[:,2]
+
+    def _neighbour_offsets(self, angle, dt):
+        '''
+            The (cell, time-bin) offsets that need to be inspected for a search of radius angle & time-window dt
+             - cells of the (2k+1)^3 cube whose nearest point is further than the search chord from the query cell are dropped
+        '''
+        chord = float(chord_from_angle(angle))
+        k     = int(np.ceil(chord / self._chord))
+        kt    = int(np.ceil(dt / self.timeBinSize))
+        grid  = np.arange(-k, k + 1)
+        cells = np.stack(np.meshgrid(grid, grid, grid, indexing='ij'), axis=-1).reshape(-1,3)
+        gap   = np.maximum(np.abs(cells) - 1, 0) * self._chord
+        cells = cells[ np.einsum('ij,ij->i', gap, gap) <= chord**2 * (1. + 1e-9) ]
+        times = np.arange(-kt, kt + 1)
+        return np.repeat(cells, len(times), axis=0), np.tile(times, len(cells))
+
+    def _on_sphere(self, cellCoords):
+        ''' Whether each of the (M,3) cells intersects the unit sphere (i.e. could contain a detection)'''
+        lo    = (cellCoords - self._nHalf) * self._chord
+        hi    = lo + self._chord
+        near  = np.where(lo > 0, lo, np.where(hi < 0, -hi, 0.))
+        far   = np.maximum(np.abs(lo), np.abs(hi))
+        return (np.einsum('ij,ij->i', near, near) <= 1. + 1e-9) & (np.einsum('ij,ij->i', far, far) >= 1. - 1e-9)
+
+    def cone_search_batch(self, UV, timeUTC, angle, dt, batchSize=10000, maxBins=2**20):
+        '''
+            Find all of the detections within angle [radians] and dt [days] of each of a batch of query positions/times
+
+            Returns (indices, offsets)
+             - the matches for the k-th query are indices[ offsets[k] : offsets[k+1] ] (in ascending order)
+             - i.e. the same layout as used by columnar.RaggedArray & features.segment_offsets
+
+            batchSize : maximum number of queries processed together
+            maxBins   : maximum number of (query, bin) pairs processed together (caps the working memory) ...
+                        ... the queries (and, for very wide searches, the bin-offsets) are chunked to respect this
+        '''
+        UV      = np.asarray(UV, dtype=np.float64).reshape(-1,3)
+        timeUTC = np.asarray(timeUTC, dtype=np.float64).reshape(-1)
+        assert timeUTC.shape == (len(UV),), 'inconsistent input lengths'
+        cellOffsets, timeOffsets = self._neighbour_offsets(angle, dt)
+        maxChord2 = float(chord_from_angle(angle))**2
+        nQueryPerChunk  = max(1, min(batchSize, maxBins // len(cellOffsets)))
+        nOffsetPerChunk = max(1, maxBins // nQueryPerChunk)
+
+        listOfIndices, counts = [], []
+        for start in range(0, len(UV), nQueryPerChunk):
+            uv, t  = UV[start:start + nQueryPerChunk], timeUTC[start:start + nQueryPerChunk]
+            nQuery = len(uv)
+            cells, tbins = self._cell_coords(uv), self._time_bins(t)
+
+            listOfQuery, listOfCandidates = [], []
+            for o in range(0, len(cellOffsets), nOffsetPerChunk):
+                # keys of the bins neighbouring each query (discarding those off the edge of the grid or off the unit sphere)
+                coords = cells[:,None,:] + cellOffsets[None,o:o + nOffsetPerChunk,:]
+                bins   = tbins[:,None] + timeOffsets[None,o:o + nOffsetPerChunk]
+                valid  = np.all((coords >= 0) & (coords < self._nSide), axis=2)
+                query  = np.broadcast_to(np.arange(nQuery)[:,None], valid.shape)[valid]
+                coords, bins = coords[valid], bins[valid]
+                onSphere = self._on_sphere(coords)
+                query  = query[onSphere]
+                keys   = self._keys(coords[onSphere], bins[onSphere])
+
+                # candidate detections from those bins
+                lo, hi = np.searchsorted(self.sortedKeys, keys, side='left'), np.searchsorted(self.sortedKeys, keys, side='right')
+                positions, lengths = _expand_ranges(lo, hi)
+                candidates = self.order[positions]
+                query      = np.repeat(query, lengths)
+
+                # exact filter
+                delta = self.UV[candidates] - uv[query]
+                keep  = (np.einsum('ij,ij->i', delta, delta) <= maxChord2) & (np.abs(self.timeUTC[candidates] - t[query]) <= dt)
+                listOfQuery.append( query[keep] )
+                listOfCandidates.append( candidates[keep] )
+            query, candidates = np.concatenate(listOfQuery), np.concatenate(listOfCandidates)
+
+            # group by query (ascending index within each query)
+            sort = np.lexsort( (candidates, query) )
+            listOfIndices.append( candidates[sort] )
+            counts.append( np.bincount(query, minlength=nQuery) )
+
+        indices = np.concatenate(listOfIndices) if listOfIndices else np.array([], dtype=np.int64)
+        offsets = np.zeros(len(UV) + 1, dtype=np.int64)
+        if counts:
+            np.cumsum(np.concatenate(counts), out=offsets[1:])
+        return indices, offsets
+
+    def cone_search(self, UV, timeUTC, angle, dt):
+        ''' Indices of all of the detections within angle [radians] and dt [days] of a single position/time'''
+        indices, offsets = self.cone_search_batch(np.reshape(UV, (1,3)), [timeUTC], angle, dt)
+        return indices
+
+    def neighbours(self, n, angle, dt):
+        ''' Indices of all of the (other) detections within angle [radians] and dt [days] of the n-th detection'''
+        indices = self.cone_search(self.UV[n], self.timeUTC[n], angle, dt)
+        return indices[indices != n]
+
+    def pairs_within(self, angle, dt, batchSize=10000, maxBins=2**20):
+        '''
+            All pairs of detections (i < j) within angle [radians] and dt [days] of each other
+            Returns two integer arrays, (i, j)
+             - e.g. as the starting-point for linking detections into candidate tracklets
+            If angle is much larger than cellSize, the search is done on a temporary index with cellSize = angle ...
+            ... (the row-numbers are unchanged) as otherwise each query would inspect ~(angle/cellSize)^3 empty bins
+        '''
+        if angle > 2. * self.cellSize:
+            return DetectionIndex(self.UV, self.timeUTC, cellSize=angle, timeBinSize=self.timeBinSize).pairs_within(angle, dt, batchSize=batchSize, maxBins=maxBins)
+
+        listOfI, listOfJ = [], []
+        for start in range(0, len(self), batchSize):
+            indices, offsets = self.cone_search_batch(self.UV[start:start + batchSize], self.timeUTC[start:start + batchSize], angle, dt, batchSize=batchSize, maxBins=maxBins)
+            i    = np.repeat(np.arange(start, start + len(offsets) - 1), np.diff(offsets))
+            keep = indices > i
+            listOfI.append( i[keep] )
+            listOfJ.append( indices[keep] )
+        if not listOfI:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return np.concatenate(listOfI), np.concatenate(listOfJ)
@@ -0,0 +1,193 @@
+'''
+    Binary (numpy .npy) storage format for the sample data products
+    Intended as a companion to the csv files in neo_ml/neo_ml/sample_data
+
+    Each product (detections, tracklets or objects) is stored as a directory containing ...
+     - one <field>.npy file per fixed-width field
+     - <field>.values.npy & <field>.offsets.npy for each ragged field (e.g. vecAngSepn)
+     - schema.json, recording the dataKey, the fields, & the number of rows
+
+    The .npy files can be memory-mapped, so that loading (even the 1e6 product) is near-instant, zero-copy, & involves no text-parsing
+
+    Data can be written in one go (write_columnar), or accumulated part-by-part (append_part) and then combined (finalize)
+     - The latter is used by sample_data_creation.py, which writes its output in blocks
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import json
+import shutil
+import numpy as np
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import columnar
+
+
+SCHEMA_FILENAME = 'schema.json'
+PARTS_DIRNAME   = '_parts'
+FORMAT_VERSION  = 1
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def binary_path_from_csv_path(filepath):
+    ''' Convention: the binary version of "xxx.csv" is the directory "xxx.npy.d" '''
+    return os.path.splitext(filepath)[0] + '.npy.d'
+
+def is_binary_dataset(path):
+    ''' Does the path point to a (finalized) binary dataset ?'''
+    return os.path.isfile(os.path.join(path, SCHEMA_FILENAME))
+
+def _save_columns(directory, columns):
+    ''' Save a dictionary of columns (numpy arrays or RaggedArrays) into directory'''
+    os.makedirs(directory, exist_ok=True)
+    for key, col in columns.items():
+        if isinstance(col, columnar.RaggedArray):
+            np.save(os.path.join(directory, key + '.values.npy'),  col.values,  allow_pickle=False)
+            np.save(os.path.join(directory, key + '.offsets.npy'), col.offsets, allow_pickle=False)
+        else:
+            np.save(os.path.join(directory, key + '.npy'), np.asarray(col), allow_pickle=False)
+
+def _load_columns(directory, schema, mmap=True):
+    ''' Load the columns described by schema from directory (memory-mapped if mmap)'''
+    mmap_mode = 'r' if mmap else None
+    columns = {}
+    for key, kind in schema['columns']:
+        if kind == 'ragged':
+            columns[key] = columnar.RaggedArray( np.load(os.path.join(directory, key + '.values.npy'),  mmap_mode=mmap_mode, allow_pickle=False),
+                                                 np.load(os.path.join(directory, key + '.offsets.npy'), mmap_mode=mmap_mode, allow_pickle=False) )
+        else:
+            columns[key] = np.load(os.path.join(directory, key + '.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+    return columns
+
+def _make_schema(columns, dataKey):
+    return {
+        'version'   : FORMAT_VERSION,
+        'dataKey'   : dataKey,
+        'columns'   : [ [key, 'ragged' if isinstance(col, columnar.RaggedArray) else 'array'] for key, col in columns.items() ],
+        'nRows'     : len(columns[dataKey]),
+    }
+
+def _read_schema(directory):
+    with open(os.path.join(directory, SCHEMA_FILENAME), 'r') as fh:
+        schema = json.load(fh)
+    assert schema['version'] == FORMAT_VERSION, 'unsupported binary format version %r in %s' % (schema['version'], directory)
+    return schema
+
+def _write_schema(directory, schema):
+    # write-then-rename, so that a crash never leaves a partially written schema
+    tmppath = os.path.join(directory, SCHEMA_FILENAME + '.tmp')
+    with open(tmppath, 'w') as fh:
+        json.dump(schema, fh, indent=1)
+    os.replace(tmppath, os.path.join(directory, SCHEMA_FILENAME))
+
+def write_columnar(directory, columnarData):
+    '''
+        Write a ColumnarData object (e.g. from NEODATA.read_detections_columnar) into a binary dataset directory
+        Any existing dataset in the directory is overwritten
+    '''
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    _save_columns(directory, columnarData.columns)
+    _write_schema(directory, _make_schema(columnarData.columns, columnarData.dataKey))
+
+def read_columnar(directory, mmap=True):
+    '''
+        Read a binary dataset directory into a ColumnarData object
+        With mmap=True the columns are memory-mapped (read-only): nothing is read from disk until it is used
+    '''
+    assert is_binary_dataset(directory), 'binary dataset could not be found : %r ' % directory
+    schema = _read_schema(directory)
+    assert not os.path.isdir(os.path.join(directory, PARTS_DIRNAME)), 'dataset has un-finalized parts (see storage.finalize) : %r' % directory
+    return columnar.ColumnarData( _load_columns(directory, schema, mmap=mmap), schema['dataKey'] )
+
+def _list_parts(directory):
+    partsDirectory = os.path.join(directory, PARTS_DIRNAME)
+    if not os.path.isdir(partsDirectory):
+        return []
+    return [ os.path.join(partsDirectory, _) for _ in sorted(os.listdir(partsDirectory)) ]
+
+def append_part(directory, columns, dataKey):
+    '''
+        Append a block of rows (a dictionary of columns) to a binary dataset, as a new "part"
+         - The parts are combined into single .npy files (one per field) by finalize
+    '''
+    partDirectory = os.path.join(directory, PARTS_DIRNAME, '%08d' % len(_list_parts(directory)))
+    _save_columns(partDirectory, columns)
+    _write_schema(partDirectory, _make_schema(columns, dataKey))
+
+def move_parts(sourceDirectory, destinationDirectory):
+    '''
+        Move all of the parts from one (un-finalized) dataset onto the end of another (preserving their order)
+        Used to merge the outputs of the shards processed in parallel by sample_data_creation.py
+    '''
+    for partDirectory in _list_parts(sourceDirectory):
+        destination = os.path.join(destinationDirectory, PARTS_DIRNAME, '%08d' % len(_list_parts(destinationDirectory)))
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.move(partDirectory, destination)
+
+def finalize(directory):
+    '''
+        Combine the parts of a binary dataset (plus any previously finalized data in the directory) into single .npy files
+         - The combined files are filled via memory-maps, so the parts never need to be in memory at the same time
+         - Each combined file is written under a temporary name and then renamed into place
+    '''
+    parts = _list_parts(directory)
+    if not parts:
+        return
+    sources = ([directory] if is_binary_dataset(directory) else []) + parts
+    schemas = [ _read_schema(_) for _ in sources ]
+    schema  = schemas[0]
+    for other in schemas[1:]:
+        assert other['columns'] == schema['columns'] and other['dataKey'] == schema['dataKey'], 'inconsistent parts in %s' % directory
+    nRows = [ _['nRows'] for _ in schemas ]
+    schema['nRows'] = int(sum(nRows))
+
+    def _combine(filename, isOffsets=False):
+        arrays = [ np.load(os.path.join(_, filename), mmap_mode='r', allow_pickle=False) for _ in sources ]
+        if isOffsets:
+            length = 1 + sum(len(a) - 1 for a in arrays)
+            dtype  = np.int64
+        else:
+            length = sum(len(a) for a in arrays)
+            dtype  = np.result_type(*[a.dtype for a in arrays]) if arrays else np.float64
+        tmppath = os.path.join(directory, filename + '.tmp')
+        out = np.lib.format.open_memmap(tmppath, mode='w+', dtype=dtype, shape=(length,))
+        start, shift = 0, 0
+        for a in arrays:
+            if isOffsets:
+                # each part's offsets start at zero: shift them by the number of values in the preceding parts
+                out[start:start + len(a)] = a + shift
+                shift += a[-1]
+                start += len(a) - 1
+            else:
+                out[start:start + len(a)] = a
+                start += len(a)
+        out.flush()
+        del out, arrays
+        os.replace(tmppath, os.path.join(directory, filename))
+
+    for key, kind in schema['columns']:
+        if kind == 'ragged':
+            _combine(key + '.values.npy')
+            _combine(key + '.offsets.npy', isOffsets=True)
+        else:
+            _combine(key + '.npy')
+    _write_schema(directory, schema)
+    shutil.rmtree(os.path.join(directory, PARTS_DIRNAME))
+
+def convert_csv_to_binary(filepath, fieldDefinitions, fieldDtypes, dataKey, directory=None):
+    '''
+        Convert one of the csv sample-data files into a binary dataset (by default, alongside the csv file)
+        Returns the path of the binary dataset
+    '''
+    directory = binary_path_from_csv_path(filepath) if directory is None else directory
+    write_columnar(directory, columnar.read_columnar(filepath, fieldDefinitions, fieldDtypes, dataKey))
+    return directory
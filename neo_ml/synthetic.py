@@ -0,0 +1,368 @@
+'''
+    Generator of synthetic (but realistic) sample data
+    Intended to provide reproducible, arbitrarily large (1e6 - 1e8 rows) load-test inputs for the rest of the pipeline
+
+    sample_data_creation.py depends on internal MPC data & code, so it cannot be used to scale-test outside of the MPC
+     - This module has no such dependencies: it writes detections / tracklets / objects files in the schemas of data.py
+     - The files have the same format as those in neo_ml/neo_ml/sample_data (csv), and/or the binary format of storage.py
+
+    The steps are ...
+    (i)   draw Keplerian orbits for a population of main-belt asteroids & NEOs
+    (ii)  draw a handful of short (2-5 detection) tracklets per object, observed from one of several (real) observatory sites
+    (iii) propagate the orbits (2-body) & calculate the positions of the observatories (circular Earth orbit + Earth rotation)
+    (iv)  keep the tracklets that would plausibly have been observed (solar elongation, limiting magnitude)
+    (v)   calculate the detection- & tracklet-level quantities exactly as sample_data_creation.py does (see features.py)
+
+    The work is split into chunks of objects, each generated from its own seed (derived from the master seed) ...
+    ... so the output is identical however many worker processes are used
+
+    Usage (e.g.) ...
+    python synthetic.py --nDetections 1e7 --workers 8 --seed 42
+
+'''
+
+# ----------------------------------------
+# Third-party imports
+# ----------------------------------------
+import os, sys
+import shutil
+import tempfile
+import numpy as np
+
+# ----------------------------------------
+# Local imports
+# ----------------------------------------
+import data
+import features
+import storage
+import orbit_classification
+
+
+# ----------------------------------------
+# Constants
+# ----------------------------------------
+GAUSS_K        = 0.01720209895          # Gaussian gravitational constant [rad/day]
+EARTH_RADIUS   = 4.263521e-5            # [au]
+OBLIQUITY      = np.radians(23.4392911) # J2000 [rad]
+J2000          = 2451545.0
+
+# Approximate parallax constants of some of the main survey sites : (east longitude [deg], rho*cos(phi'), rho*sin(phi'))
+OBSERVATORIES = {
+    'F51' : (203.7443, 0.936241, +0.351543),    # Pan-STARRS 1, Haleakala
+    'G96' : (249.2108, 0.845183, +0.533631),    # Mt. Lemmon Survey
+    '703' : (249.2675, 0.845315, +0.533030),    # Catalina Sky Survey
+    '691' : (248.3997, 0.849091, +0.526981),    # Spacewatch, Kitt Peak
+    'I41' : (243.1403, 0.836325, +0.546877),    # Zwicky Transient Facility, Palomar
+    'T08' : (204.5242, 0.941178, +0.337290),    # ATLAS, Mauna Loa
+    'W68' : (289.2026, 0.867520, -0.496310),    # ATLAS, Rio Hurtado
+}
+
+# Defaults describing the synthetic population & survey
+DEFAULTS = {
+    'fractionNEO'           : 0.1,      # fraction of the objects that are NEOs
+    'trackletsPerObject'    : 3.,       # mean number of tracklets per object
+    'nDetProbabilities'     : {2 : 0.1, 3 : 0.45, 4 : 0.35, 5 : 0.1},
+    'surveyStart'           : 2458849.5,    # 2020-01-01
+    'surveyDays'            : 365.,
+    'minSpacing'            : 10. / 1440.,  # spacing between the detections of a tracklet [days]
+    'maxSpacing'            : 30. / 1440.,
+    'astrometricNoise'      : np.radians(0.2 / 3600.),  # [rad]
+    'minSolarElongation'    : np.radians(60.),          # [rad]
+    'limitingMagnitude'     : 22.5,
+}
+
+
+# ----------------------------------------
+# Define some useful function(s)
+# ----------------------------------------
+
+def draw_orbits(rng, nObjects, fractionNEO=DEFAULTS['fractionNEO'], epoch=DEFAULTS['surveyStart']):
+    '''
+        Draw a population of Keplerian orbits (& absolute magnitudes)
+        Returns a dictionary of length-nObjects arrays : q [au], e, i, AP, LAN [degrees], TP [JDUTC], H, isNEO
+    '''
+    isNEO = rng.random(nObjects) < fractionNEO
+
+    # main-belt : a ~ 2.1-3.3 au, low e & i ; NEOs : q ~ 0.7-1.3 au, higher e & i
+    a_MB  = rng.uniform(2.1, 3.3, nObjects)
+    e_MB  = rng.uniform(0.0, 0.3, nObjects)
+    q_NEO = rng.uniform(0.7, 1.3, nObjects)
+    e_NEO = rng.uniform(0.1, 0.7, nObjects)
+    q     = np.where(isNEO, q_NEO, a_MB * (1. - e_MB))
+    e     = np.where(isNEO, e_NEO, e_MB)
+    i     = np.minimum( np.abs(rng.normal(0., np.where(isNEO, 15., 8.))), 60.)
+    H     = np.where(isNEO, rng.uniform(16., 24., nObjects), rng.uniform(12., 19., nObjects))
+
+    # time of perihelion : anywhere within the orbital period preceding the epoch
+    period = 2. * np.pi * (q / (1. - e))**1.5 / GAUSS_K
+    TP     = epoch - rng.random(nObjects) * period
+
+    return { 'q' : q, 'e' : e, 'i' : i, 'AP' : rng.uniform(0., 360., nObjects), 'LAN' : rng.uniform(0., 360., nObjects),
+             'TP' : TP, 'H' : H, 'isNEO' : q < 1.3 }
+
+def heliocentric_position_of_object(q, e, i, AP, LAN, TP, timeUTC):
+    '''
+        2-body (elliptical) position of the objects at the supplied times : all inputs are arrays of the same length
+        Returns (N,3) heliocentric positions [au] (ECLIPTIC coords)
+    '''
+    a = q / (1. - e)
+    M = GAUSS_K / a**1.5 * (timeUTC - TP)
+
+    # solve Kepler's equation (Newton-Raphson)
+    E = M + e * np.sin(M)
+    for _ in range(12):
+        E -= (E - e * np.sin(E) - M) / (1. - e * np.cos(E))
+    x = a * (np.cos(E) - e)
+    y = a * np.sqrt(1. - e**2) * np.sin(E)
+
+    # rotate from the orbital plane into ecliptic coords
+    i, w, W = np.radians(i), np.radians(AP), np.radians(LAN)
+    P = np.column_stack( ( np.cos(w)*np.cos(W) - np.sin(w)*np.sin(W)*np.cos(i),
+                           np.cos(w)*np.sin(W) + np.sin(w)*np.cos(W)*np.cos(i),
+                           np.sin(w)*np.sin(i) ) )
+    Q = np.column_stack( (-np.sin(w)*np.cos(W) - np.cos(w)*np.sin(W)*np.cos(i),
+                          -np.sin(w)*np.sin(W) + np.cos(w)*np.cos(W)*np.cos(i),
+                           np.cos(w)*np.sin(i) ) )
+    return x[:,None] * P + y[:,None] * Q
+
+def heliocentric_position_of_observatory(obsCodes, timeUTC):
+    '''
+        Approximate heliocentric position of the observatories at the supplied times [au] (ECLIPTIC coords)
+         - circular orbit for the Earth, plus the (rotating) geocentric position of the observatory
+    '''
+    # Earth : mean longitude
+    L     = np.radians(100.46435 + 0.985609101 * (timeUTC - J2000))
+    earth = np.column_stack( (np.cos(L), np.sin(L), np.zeros_like(L)) )
+
+    # Observatory : (equatorial) geocentric position from the Earth Rotation Angle & the parallax constants
+    longitude, rhoCos, rhoSin = [ np.array([OBSERVATORIES[_][n] for _ in obsCodes]) for n in range(3) ]
+    theta = 2. * np.pi * (0.7790572732640 + 1.00273781191135448 * (timeUTC - J2000)) + np.radians(longitude)
+    geo   = EARTH_RADIUS * np.column_stack( (rhoCos * np.cos(theta), rhoCos * np.sin(theta), rhoSin) )
+    # equatorial -> ecliptic (rotation about the x-axis by the obliquity)
+    geo   = np.column_stack( (geo[:,0],
+                              np.cos(OBLIQUITY) * geo[:,1] + np.sin(OBLIQUITY) * geo[:,2],
+                             -np.sin(OBLIQUITY) * geo[:,1] + np.cos(OBLIQUITY) * geo[:,2]) )
+    return earth + geo
+
+def _ids(prefix, chunkIndex, n):
+    return np.array([ '%s%05d%08d' % (prefix, chunkIndex, k) for k in range(n) ], dtype='S')
+
+def generate_chunk(seed, chunkIndex, nObjects, **kwargs):
+    '''
+        Generate the detections, tracklets & objects for a single chunk of nObjects objects
+         - The random numbers are drawn from a generator seeded on (seed, chunkIndex) ...
+         - ... so every chunk can be generated independently (& reproducibly)
+        Returns three dictionaries of columns (detections, tracklets, objects), in the schemas of data.py
+    '''
+    config = dict(DEFAULTS, **kwargs)
+    rng    = np.random.default_rng([seed, chunkIndex])
+
+    # (i) orbits
+    orbits = draw_orbits(rng, nObjects, fractionNEO=config['fractionNEO'], epoch=config['surveyStart'])
+
+    # (ii) tracklets : object, start-time, observatory & number of detections of each
+    nTrk      = rng.poisson(config['trackletsPerObject'] - 1., nObjects) + 1
+    trkObject = np.repeat(np.arange(nObjects), nTrk)
+    nTracklets= len(trkObject)
+    tStart    = config['surveyStart'] + rng.random(nTracklets) * config['surveyDays']
+    obsCodes  = np.array(sorted(OBSERVATORIES))[ rng.integers(0, len(OBSERVATORIES), nTracklets) ]
+    nDetValues= np.array(sorted(config['nDetProbabilities']))
+    nDet      = rng.choice(nDetValues, size=nTracklets, p=[config['nDetProbabilities'][_] for _ in nDetValues])
+
+    # detections : times within each tracklet (rounded to ~1s, as in the MPC data)
+    offsets   = np.zeros(nTracklets + 1, dtype=np.int64)
+    np.cumsum(nDet, out=offsets[1:])
+    detTrk    = np.repeat(np.arange(nTracklets), nDet)
+    spacing   = rng.uniform(config['minSpacing'], config['maxSpacing'], offsets[-1])
+    spacing[offsets[:-1]] = 0.
+    elapsed   = np.cumsum(spacing) - np.repeat(np.cumsum(spacing)[offsets[:-1]], nDet)
+    timeUTC   = np.round(tStart[detTrk] + elapsed, 5)
+
+    # (iii) geometry
+    detObject = trkObject[detTrk]
+    objPosn   = heliocentric_position_of_object(*[orbits[key][detObject] for key in ('q', 'e', 'i', 'AP', 'LAN', 'TP')], timeUTC)
+    obsPosn   = heliocentric_position_of_observatory(obsCodes[detTrk], timeUTC)
+    topo      = objPosn - obsPosn
+    delta     = np.sqrt(np.einsum('ij,ij->i', topo, topo))
+    UV        = topo / delta[:,None] + rng.normal(0., config['astrometricNoise'], topo.shape)
+    UV       /= np.sqrt(np.einsum('ij,ij->i', UV, UV))[:,None]
+    r         = np.sqrt(np.einsum('ij,ij->i', objPosn, objPosn))
+    Vmag      = np.round( orbits['H'][detObject] + 5. * np.log10(r * delta) + rng.normal(0., 0.1, len(r)), 1)
+    solarElong= features.calc_solar_elongation(UV, obsPosn)
+
+    # (iv) keep the tracklets that would plausibly have been observed (judged on their first detection)
+    first     = offsets[:-1]
+    keepTrk   = (solarElong[first] >= config['minSolarElongation']) & (Vmag[first] <= config['limitingMagnitude'])
+    keepDet   = keepTrk[detTrk]
+    keepObj   = np.bincount(trkObject[keepTrk], minlength=nObjects) > 0
+
+    # (v) detection-level quantities (N.B. the IDs are assigned after the selection, so they are contiguous)
+    detTrkKept = np.flatnonzero(keepTrk)
+    nDetKept   = nDet[keepTrk]
+    trkIDs     = _ids('T', chunkIndex, len(detTrkKept))
+    objectIDs  = _ids('S', chunkIndex, nObjects)
+    UVk, obsk  = UV[keepDet], obsPosn[keepDet]
+    detections = {
+        'detID'       : _ids('D', chunkIndex, int(keepDet.sum())),
+        'trkID'       : np.repeat(trkIDs, nDetKept),
+        'timeUTC'     : timeUTC[keepDet],
+        'Obs_X'       : obsk[:,0], 'Obs_Y' : obsk[:,1], 'Obs_Z' : obsk[:,2],
+        'UV_X'        : UVk[:,0],  'UV_Y'  : UVk[:,1],  'UV_Z'  : UVk[:,2],
+        'Vmag'        : Vmag[keepDet],
+        'obsCode'     : obsCodes[detTrk][keepDet].astype('S'),
+        'eclipticLat' : features.calc_ecliptic_latitude(UVk),
+        'solarElong'  : solarElong[keepDet],
+    }
+
+    # tracklet-level quantities (the detections are already sorted by tracklet & time)
+    trkOffsets = np.zeros(len(detTrkKept) + 1, dtype=np.int64)
+    np.cumsum(nDetKept, out=trkOffsets[1:])
+    tracklets  = features.calc_tracklet_fields(trkOffsets, detections['timeUTC'], UVk)
+    tracklets.update( { 'trkID' : trkIDs, 'objectID' : objectIDs[trkObject[keepTrk]] } )
+
+    # objects (only those with at least one tracklet, as for the "trimmed" objects file)
+    objects = {
+        'objectID'    : objectIDs[keepObj],
+        'isNEO'       : orbits['isNEO'][keepObj],
+        'objectType'  : orbit_classification.classify_orbits(orbits['q'], orbits['e'], orbits['i'], orbits['AP'])[1][keepObj],
+        'orbit_q'     : orbits['q'][keepObj],
+        'orbit_e'     : orbits['e'][keepObj],
+        'orbit_i'     : orbits['i'][keepObj],
+        'orbit_AP'    : orbits['AP'][keepObj],
+        'orbit_LAN'   : orbits['LAN'][keepObj],
+        'orbit_TP'    : orbits['TP'][keepObj],
+    }
+    return detections, tracklets, objects
+
+
+# ----------------------------------------
+# Output
+# ----------------------------------------
+
+def _column_as_strings(col, dtype):
+    ''' Format a column in the same way as sample_data_creation.py (i.e. str() of the python value, None if missing)'''
+    if dtype == 'ragged':
+        return [ str(col[n].tolist()) for n in range(len(col)) ]
+    if dtype == 'S':
+        return [ _.decode() for _ in col.tolist() ]
+    if dtype == 'int8':
+        return [ 'None' if _ == data.missing_values['int8'] else str(_) for _ in col.tolist() ]
+    return [ str(_) for _ in col.tolist() ]
+
+def format_lines(columns, fieldDtypes):
+    ''' Convert a dictionary of columns into the (header-less) lines of a sample-data file'''
+    keys = sorted(fieldDtypes.keys())
+    return [ " , ".join(fields) + "\n" for fields in zip(*[ _column_as_strings(columns[key], fieldDtypes[key]) for key in keys ]) ]
+
+def output_filepath(numberString, dataType, outputDirectory=None):
+    ''' As sample_data_creation._output_filepath, but labelled "synthetic" rather than "real"'''
+    if outputDirectory is None:
+        outputDirectory = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'sample_data' )
+    return os.path.join( outputDirectory , 'sample_data_%s_synthetic_%s.csv' % (numberString, dataType) )
+
+PRODUCTS = (('detections', data.detection_field_dtypes, 'detID'),
+            ('tracklets',  data.tracklet_field_dtypes,  'trkID'),
+            ('objects',    data.object_field_dtypes,    'objectID'))
+
+def _write_chunk(args):
+    '''
+        Generate a single chunk & write it into chunkDirectory (header-less csv files and/or binary parts)
+        Returns the number of detections, tracklets & objects
+    '''
+    seed, chunkIndex, nObjects, chunkDirectory, outputFormat, kwargs = args
+    products = generate_chunk(seed, chunkIndex, nObjects, **kwargs)
+    for (dataType, fieldDtypes, dataKey), columns in zip(PRODUCTS, products):
+        filepath = output_filepath('chunk%06d' % chunkIndex, dataType, outputDirectory=chunkDirectory)
+        if outputFormat in ('csv', 'both'):
+            with open(filepath, 'w') as fh:
+                fh.writelines( format_lines(columns, fieldDtypes) )
+        if outputFormat in ('npy', 'both') and len(columns[dataKey]):
+            storage.append_part(storage.binary_path_from_csv_path(filepath), columns, dataKey)
+    return tuple( len(columns[dataKey]) for (dataType, fieldDtypes, dataKey), columns in zip(PRODUCTS, products) )
+
+def generate(numberString, nDetections, seed=0, objectsPerChunk=20000, nWorkers=1, outputDirectory=None, outputFormat='csv', **kwargs):
+    '''
+        Generate (approximately) nDetections synthetic detections, plus the corresponding tracklets & objects
+         - A first chunk is generated to measure the number of detections per chunk, & hence the number of chunks required
+         - The remaining chunks are generated by a pool of nWorkers processes, & appended (in order) to the output files
+        Returns a dictionary of the number of rows written to each file
+    '''
+    assert outputFormat in ('csv', 'npy', 'both'), 'unknown outputFormat : %r' % outputFormat
+    outputDirectory = os.path.dirname( output_filepath(numberString, 'detections', outputDirectory=outputDirectory) )
+    os.makedirs(outputDirectory, exist_ok=True)
+    chunkDirectory = tempfile.mkdtemp(prefix='synthetic_%s_chunks_' % numberString, dir=outputDirectory)
+    counts = dict.fromkeys([dataType for dataType, fieldDtypes, dataKey in PRODUCTS], 0)
+
+    # start each product from scratch, with its header line
+    for dataType, fieldDtypes, dataKey in PRODUCTS:
+        filepath = output_filepath(numberString, dataType, outputDirectory=outputDirectory)
+        if outputFormat in ('csv', 'both'):
+            with open(filepath, 'w') as fh:
+                fh.write("# " + " , ".join( sorted(fieldDtypes.keys()) ) + "\n")
+        if os.path.isdir(storage.binary_path_from_csv_path(filepath)):
+            shutil.rmtree(storage.binary_path_from_csv_path(filepath))
+
+    def _merge(chunkIndex, chunkCounts):
+        for (dataType, fieldDtypes, dataKey), n in zip(PRODUCTS, chunkCounts):
+            filepath      = output_filepath(numberString, dataType, outputDirectory=outputDirectory)
+            chunkfilepath = output_filepath('chunk%06d' % chunkIndex, dataType, outputDirectory=chunkDirectory)
+            if outputFormat in ('csv', 'both'):
+                with open(filepath, 'a') as fh, open(chunkfilepath, 'r') as chunk_fh:
+                    shutil.copyfileobj(chunk_fh, fh)
+                os.remove(chunkfilepath)
+            if outputFormat in ('npy', 'both'):
+                storage.move_parts(storage.binary_path_from_csv_path(chunkfilepath), storage.binary_path_from_csv_path(filepath))
+            counts[dataType] += n
+
+    try:
+        # the first chunk measures the yield of detections per chunk
+        chunkCounts = _write_chunk( (seed, 0, objectsPerChunk, chunkDirectory, outputFormat, kwargs) )
+        _merge(0, chunkCounts)
+        nChunks = max(1, int(np.ceil(nDetections / max(chunkCounts[0], 1))))
+        print('synthetic : %d detections per chunk => %d chunks' % (chunkCounts[0], nChunks), flush=True)
+
+        tasks = [ (seed, chunkIndex, objectsPerChunk, chunkDirectory, outputFormat, kwargs) for chunkIndex in range(1, nChunks) ]
+        if nWorkers > 1:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(max_workers=nWorkers) as executor:
+                for chunkIndex, chunkCounts in zip(range(1, nChunks), executor.map(_write_chunk, tasks)):
+                    _merge(chunkIndex, chunkCounts)
+        else:
+            for chunkIndex, task in zip(range(1, nChunks), tasks):
+                _merge(chunkIndex, _write_chunk(task))
+
+        if outputFormat in ('npy', 'both'):
+            for dataType, fieldDtypes, dataKey in PRODUCTS:
+                storage.finalize( storage.binary_path_from_csv_path(output_filepath(numberString, dataType, outputDirectory=outputDirectory)) )
+    finally:
+        shutil.rmtree(chunkDirectory, ignore_errors=True)
+
+    print('synthetic : wrote %r' % counts, flush=True)
+    return counts
+
+
+
+def main(argv=None, prog=None):
+    ''' Generate a synthetic sample (see the argparse help)'''
+
+    import argparse
+    parser = argparse.ArgumentParser(prog=prog, description='Generate synthetic detections / tracklets / objects files (in the schemas of data.py)')
+    parser.add_argument('--nDetections', type=float, default=1e6, help='(Approximate) number of detections to generate')
+    parser.add_argument('--numberString', default=None, help='Labels the output files (default: derived from nDetections, e.g. "1e6")')
+    parser.add_argument('--seed', type=int, default=0, help='Master seed: the output is reproducible for a given seed (& objectsPerChunk)')
+    parser.add_argument('--objectsPerChunk', type=int, default=20000, help='Number of objects generated per chunk (bounds the memory use of each worker)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--outputDirectory', default=None, help='Default: neo_ml/neo_ml/sample_data')
+    parser.add_argument('--outputFormat', default='csv', choices=['csv', 'npy', 'both'], help='Write the output as csv, as memory-mappable .npy datasets (see storage.py), or both')
+    parser.add_argument('--fractionNEO', type=float, default=DEFAULTS['fractionNEO'], help='Fraction of the objects that are NEOs')
+    parser.add_argument('--trackletsPerObject', type=float, default=DEFAULTS['trackletsPerObject'], help='Mean number of tracklets per object')
+    args = parser.parse_args(argv)
+
+    numberString = args.numberString if args.numberString is not None else ('%.0e' % args.nDetections).replace('+0', '').replace('+', '')
+    generate(numberString, int(args.nDetections), seed=args.seed, objectsPerChunk=args.objectsPerChunk, nWorkers=args.workers,
+             outputDirectory=args.outputDirectory, outputFormat=args.outputFormat,
+             fractionNEO=args.fractionNEO, trackletsPerObject=args.trackletsPerObject)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+'''
+    Shared set-up for the tests
+     - the modules of neo_ml use flat (sibling) imports, as when they are run from neo_ml/neo_ml ...
+       ... so that directory is put on the path
+     - tests that need the (MPC-internal) obs80, phys_const or MPC_library modules are skipped when they are not installed
+
+    Usage (e.g., from neo_ml/neo_ml) ...
+    python -m pytest -q tests
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+
+NEO_ML_DIRECTORY = os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) )
+if NEO_ML_DIRECTORY not in sys.path:
+    sys.path.insert(0, NEO_ML_DIRECTORY)
+
+TESTS_DIRECTORY = os.path.dirname( os.path.abspath(__file__) )
+if TESTS_DIRECTORY not in sys.path:
+    sys.path.insert(0, TESTS_DIRECTORY)
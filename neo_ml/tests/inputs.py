@@ -0,0 +1,135 @@
+'''
+    Inputs for the tests
+     - the (checked-in) 1e4 sample data files
+     - synthetic raw data, in the format of the MPC extracts read by sample_data_creation.py ...
+       ... (raw_data/sample_obs_<numberString>_sorted.csv & raw_data/sample_orbit_large.csv) ...
+       ... optionally with the duplicates & malformed lines that the pipeline has to cope with
+     - a copy of the pipeline, so that sample_data_creation.py (which reads & writes next to itself) can be run in a temporary directory
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import sys, os
+import glob
+import shutil
+import datetime
+import subprocess
+import numpy as np
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+from conftest import NEO_ML_DIRECTORY
+import sample_data_creation
+
+
+SAMPLE_DATA_DIRECTORY = os.path.join(NEO_ML_DIRECTORY, 'sample_data')
+
+NUMBER_STRING = 'test'
+
+OBS_HEADER   = 'provid_pkd,obsid,trkid,obs80\n'
+ORBIT_HEADER = 'desig_pkd,peri_dist,eccentricity,incl,arg_peri,asc_node,peri_time\n'
+
+# Lines that sample_data_creation.py has to skip (rather than crash on)
+MALFORMED_LINES = ['garbage line without commas\n', 'K10A00000Z,det\n']
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def sample_filepath(dataType, numberString='1e4'):
+    ''' Path of one of the checked-in sample data files (dataType = 'detections', 'tracklets' or 'objects')'''
+    return os.path.join(SAMPLE_DATA_DIRECTORY, 'sample_data_%s_real_%s.csv' % (numberString, dataType))
+
+def obs80_record(designation, jdutc, raHours, decDegrees, mag, obsCode):
+    ''' An (80-character) obs80 record for an optical observation, e.g. "     K17A00Z  C2014 04 28.98950 13 24 42.05 -19 38 29.3 ..."'''
+    date   = datetime.date.fromordinal( int(jdutc - 1721424.5) )
+    day    = date.day + (jdutc - 1721424.5) % 1.
+    raSec  = raHours * 3600.
+    decSec = abs(decDegrees) * 3600.
+    record = '     %-7s  C%04d %02d %08.5f %02d %02d %05.2f %s%02d %02d %04.1f         %5s V      %s' % (
+             designation[-7:], date.year, date.month, day,
+             int(raSec // 3600), int(raSec % 3600 // 60), min(raSec % 60, 59.99),
+             '-' if decDegrees < 0 else '+', int(decSec // 3600), int(decSec % 3600 // 60), min(decSec % 60, 59.9),
+             '' if mag is None else '%.1f' % mag, obsCode)
+    assert len(record) == 80, 'obs80 record of length %d : %r' % (len(record), record)
+    return record
+
+def make_raw_data(nObjects=40, seed=0, duplicates=True):
+    '''
+        Synthetic raw data : returns (obsLines, orbitLines), each without their header line
+         - each object has 1-3 tracklets of 2-5 detections, from one of a few (real) obsCodes
+         - duplicates : also add (a) tracklets linked to a second orbit (exact duplicates : same trkID & detIDs) ...
+                        ... (b) a trkID re-used under another orbit for different detections (not duplicates) ...
+                        ... (c) near duplicates (the same obs80 record, with a new detID) & (d) repeated lines
+        The obsLines are sorted as required by sample_data_creation.py (see sample_data_creation._detection_sort_key)
+    '''
+    rng = np.random.default_rng(seed)
+    rows, orbitLines, tracklets = [], [], []
+    for k in range(nObjects):
+        objectID = 'K10A%05dZ' % k
+        orbitLines.append('%s,%.9f,%.9f,%.7f,%.7f,%.7f,%.7f\n' % (objectID, rng.uniform(0.5, 4.), rng.uniform(0., 0.6), rng.uniform(0., 30.),
+                                                                   rng.uniform(0., 360.), rng.uniform(0., 360.), 2459000. + rng.uniform(0., 1000.)))
+        for t in range(rng.integers(1, 4)):
+            trkID = '%010d' % (k * 10 + t)
+            ra, dec, jdutc = rng.uniform(0., 23.), rng.uniform(-60., 60.), 2458000. + rng.uniform(0., 1000.)
+            obsCode = ['F51', 'G96', '703'][rng.integers(3)]
+            tracklet = []
+            for d in range(rng.integers(2, 6)):
+                mag = None if rng.random() < 0.1 else rng.uniform(15., 22.)
+                tracklet.append( [objectID, 'det%07d' % len(rows), trkID, obs80_record(objectID, jdutc + d * 0.01, ra + d * 1e-4, dec + d * 1e-3, mag, obsCode)] )
+                rows.append(tracklet[-1])
+            tracklets.append(tracklet)
+
+    if duplicates:
+        objectIDs = [ line.split(',')[0] for line in orbitLines ]
+        new = []
+        for n in range(5):
+            # (a) a tracklet linked to a second orbit
+            tracklet = tracklets[rng.integers(len(tracklets))]
+            other    = objectIDs[rng.integers(len(objectIDs))]
+            new += [ [other] + row[1:] for row in tracklet ]
+            # (b) the trkID of a tracklet re-used under another orbit, for different detections (moved by an hour of RA)
+            trkID    = tracklets[rng.integers(len(tracklets))][0][2]
+            tracklet = tracklets[rng.integers(len(tracklets))]
+            new += [ [row[0], 'reused%s_%d' % (row[1], n), trkID, row[3][:32] + '%02d' % ((int(row[3][32:34]) + 1) % 24) + row[3][34:]] for row in tracklet ]
+            # (c) a near duplicate, in a new tracklet of another orbit
+            row = rows[rng.integers(len(rows))]
+            new += [ [objectIDs[rng.integers(len(objectIDs))], 'near%s' % row[1], 'near%06d' % n, row[3]] ]
+            # (d) a repeated line
+            new += [ list(rows[rng.integers(len(rows))]) ]
+        rows = rows + new
+
+    obsLines = sorted( [ ','.join(row) + '\n' for row in rows ], key=sample_data_creation._detection_sort_key )
+    return obsLines, orbitLines
+
+def write_raw_data(directory, obsLines, orbitLines, numberString=NUMBER_STRING):
+    ''' Write the raw data files read by sample_data_creation.py into directory/raw_data'''
+    os.makedirs(os.path.join(directory, 'raw_data'), exist_ok=True)
+    with open(os.path.join(directory, 'raw_data', 'sample_obs_%s_sorted.csv' % numberString), 'w') as fh:
+        fh.writelines( [OBS_HEADER] + list(obsLines) )
+    with open(os.path.join(directory, 'raw_data', 'sample_orbit_large.csv'), 'w') as fh:
+        fh.writelines( [ORBIT_HEADER] + list(orbitLines) )
+
+def copy_pipeline(directory):
+    ''' Copy the sources into directory (which then holds its own raw_data & sample_data)'''
+    os.makedirs(os.path.join(directory, 'sample_data'), exist_ok=True)
+    for filepath in glob.glob(os.path.join(NEO_ML_DIRECTORY, '*.py')):
+        shutil.copy(filepath, directory)
+    return directory
+
+def run_pipeline(directory, *args, numberString=NUMBER_STRING):
+    ''' Run (a copy of) sample_data_creation.py in directory, returning the subprocess.CompletedProcess'''
+    return subprocess.run([sys.executable, 'sample_data_creation.py', '--numberString', numberString] + list(args),
+                          cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+def read_outputs(directory, numberString=NUMBER_STRING, dataTypes=('detections', 'tracklets', 'objects', 'duplicates')):
+    ''' The lines of each of the output files (None for any that do not exist), keyed on dataType'''
+    outputs = {}
+    for dataType in dataTypes:
+        filepath = os.path.join(directory, 'sample_data', 'sample_data_%s_real_%s.csv' % (numberString, dataType))
+        outputs[dataType] = open(filepath).readlines() if os.path.isfile(filepath) else None
+    return outputs
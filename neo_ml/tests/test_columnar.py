@@ -0,0 +1,89 @@
+'''
+    Tests of columnar.py : the typed (column-by-column) ingest of the sample data ...
+    ... which must agree with the dict-of-dicts from ingest_demo.NEODATA.read_*_into_dict
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import numpy as np
+import pytest
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import data
+import columnar
+import ingest_demo
+from inputs import sample_filepath
+
+
+DATA_TYPES = { 'detections' : ('detection', data.detection_field_dtypes),
+               'tracklets'  : ('tracklet',  data.tracklet_field_dtypes),
+               'objects'    : ('object',    data.object_field_dtypes) }
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def _matches_csv_string(value, string, dtype):
+    ''' Whether a value from a ColumnarData row is the one written as string in the csv file (i.e. as in the dict-of-dicts)'''
+    if string == 'None':
+        missing = data.missing_values[dtype]
+        return value != value if missing != missing else value == missing
+    return str(value) == string
+
+
+# -----------------------------------
+# Tests
+# -----------------------------------
+
+@pytest.mark.parametrize('dataType', sorted(DATA_TYPES))
+def test_columnar_matches_dict_ingest(dataType):
+    ''' Every row of the ColumnarData (via its dict-compatible view) reproduces the strings of the dict-of-dicts'''
+    kind, fieldDtypes = DATA_TYPES[dataType]
+    neodata   = ingest_demo.NEODATA()
+    filepath  = sample_filepath(dataType)
+    dictData  = getattr(neodata, 'read_%s_data_into_dict' % kind)(filepath)
+    colData   = getattr(neodata, 'read_%s_columnar' % dataType)(filepath)
+
+    assert len(colData) == len(dictData)
+    assert list(colData) == list(dictData)
+    for key, d in dictData.items():
+        row = colData[key]
+        assert set(row) == set(d)
+        for field, value in row.items():
+            if fieldDtypes[field] == 'ragged':
+                assert all( type(_) is float for _ in value )
+            assert _matches_csv_string(value, d[field].strip(), fieldDtypes[field]), (key, field, value, d[field])
+
+def test_row_values_are_python_types():
+    ''' The dict-compatible view holds plain python values (not numpy scalars), as the dict-of-dicts did'''
+    tracklets = columnar.read_tracklets_columnar(sample_filepath('tracklets'))
+    row = tracklets.row(0)
+    assert type(row['trkID']) is str and type(row['meanAngRate']) is float
+    assert type(row['vecAngRate']) is list and all( type(_) is float for _ in row['vecAngRate'] )
+    assert 'np.float64' not in repr(row)
+
+def test_ragged_array():
+    lists  = [[1.5, 2.], [], [3.], [4., 5., 6.]]
+    ragged = columnar.RaggedArray.from_lists(lists)
+    assert len(ragged) == 4
+    assert ragged.lengths().tolist() == [2, 0, 1, 3]
+    assert ragged.tolist() == lists
+    assert all( type(_) is float for vector in ragged.tolist() for _ in vector )
+    assert ragged.take([3, 1, 0]).tolist() == [lists[3], lists[1], lists[0]]
+    assert columnar.RaggedArray.concatenate([ragged, ragged.take([2])]).tolist() == lists + [lists[2]]
+    assert columnar.RaggedArray([], [0]).tolist() == []
+
+def test_select():
+    objects = columnar.read_objects_columnar(sample_filepath('objects'))
+    selected = objects.select(objects.columns['isNEO'])
+    assert len(selected) == int(objects.columns['isNEO'].sum())
+    assert all( selected[key]['isNEO'] for key in selected )
+    assert list(objects.select([2, 0])) == [list(objects)[2], list(objects)[0]]
+
+def test_tokenize_line():
+    assert columnar.tokenize_line('a , 1.5 , [1.0, 2.0] , None') == ['a', '1.5', '[1.0, 2.0]', 'None']
@@ -0,0 +1,143 @@
+'''
+    Tests of dedup.py : exact & near duplicates are found in input order, independently of how the input is split up ...
+    ... & are removed (with the tracklets all of whose detections are duplicates) by DuplicateFilter
+    (see test_sample_data_creation.py for the serial vs parallel comparison of the whole pipeline)
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import numpy as np
+import pytest
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import dedup
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def _unit_vectors(N, seed=0):
+    rng = np.random.default_rng(seed)
+    UV = rng.normal(size=(N, 3))
+    return UV / np.linalg.norm(UV, axis=1)[:, None]
+
+def _detections(N=200, seed=0):
+    ''' detIDs, obsCodes, timeUTC & UV of N distinct detections'''
+    rng = np.random.default_rng(seed)
+    detIDs   = [ 'det%06d' % n for n in range(N) ]
+    obsCodes = [ ['F51', 'G96', '703'][_] for _ in rng.integers(3, size=N) ]
+    timeUTC  = 2458000. + rng.uniform(0., 100., N)
+    return detIDs, obsCodes, timeUTC, _unit_vectors(N, seed)
+
+def _find(detIDs, obsCodes, timeUTC, UV, batchSizes=None):
+    ''' The reasons (see DuplicateIndex.find), with the keys calculated in batches of the supplied sizes'''
+    index = dedup.DuplicateIndex()
+    batchSizes = batchSizes or [len(detIDs)]
+    keys, start = [], 0
+    for size in batchSizes:
+        keys.append( index.keys(detIDs[start:start + size], obsCodes[start:start + size], timeUTC[start:start + size], UV[start:start + size]) )
+        start += size
+    return index.find( *[ np.concatenate(_) for _ in zip(*keys) ] )
+
+
+# -----------------------------------
+# Tests
+# -----------------------------------
+
+def test_no_duplicates():
+    assert _find(*_detections()) == [None] * 200
+
+def test_exact_and_near_duplicates():
+    detIDs, obsCodes, timeUTC, UV = _detections()
+    # an exact duplicate (same detID, whatever its position), & a near duplicate (new detID, same obsCode, time & position) ...
+    # ... N.B. not offset within the tolerances, which could straddle the edge of a rounding-cell (see dedup.py)
+    detIDs   = detIDs   + ['det000010', 'near000020']
+    obsCodes = obsCodes + [obsCodes[10], obsCodes[20]]
+    timeUTC  = np.append(timeUTC, [timeUTC[10] + 1., timeUTC[20]])
+    UV       = np.vstack([UV, -UV[10], UV[20]])
+    reasons  = _find(detIDs, obsCodes, timeUTC, UV)
+    assert reasons[:200] == [None] * 200
+    assert reasons[200:] == [dedup.DUPLICATE_DETID, dedup.NEAR_DUPLICATE]
+
+def test_near_duplicates_need_the_same_obsCode_time_and_position():
+    detIDs, obsCodes, timeUTC, UV = _detections()
+    otherCode = 'F51' if obsCodes[20] != 'F51' else 'G96'
+    detIDs   = detIDs   + ['a', 'b', 'c']
+    obsCodes = obsCodes + [otherCode, obsCodes[20], obsCodes[20]]
+    timeUTC  = np.append(timeUTC, [timeUTC[20], timeUTC[20] + 10. * dedup.TIME_TOLERANCE, timeUTC[20]])
+    UV       = np.vstack([UV, UV[20], UV[20], UV[20] + 10. * dedup.ANGLE_TOLERANCE])
+    assert _find(detIDs, obsCodes, timeUTC, UV)[200:] == [None, None, None]
+
+def test_first_occurrence_is_kept():
+    ''' The later copies (in input order) are the duplicates, including copies of copies'''
+    detIDs, obsCodes, timeUTC, UV = _detections(N=3)
+    order = [2, 0, 2, 1, 0, 2]
+    reasons = _find([ detIDs[_] for _ in order ], [ obsCodes[_] for _ in order ], timeUTC[order], UV[order])
+    assert reasons == [None, None, dedup.DUPLICATE_DETID, None, dedup.DUPLICATE_DETID, dedup.DUPLICATE_DETID]
+
+def test_detections_without_a_position_are_only_checked_on_their_detID():
+    detIDs, obsCodes, timeUTC, UV = _detections(N=2)
+    timeUTC[1] = np.nan
+    reasons = _find(detIDs + ['x', detIDs[1]], obsCodes + [obsCodes[1]] * 2, np.append(timeUTC, [np.nan, np.nan]), np.vstack([UV, UV[1], UV[1]]))
+    assert reasons == [None, None, None, dedup.DUPLICATE_DETID]
+
+@pytest.mark.parametrize('batchSizes', [[1] * 230, [7, 100, 123], [229, 1]])
+def test_result_does_not_depend_on_the_batches(batchSizes):
+    ''' The keys only depend on each detection (e.g. not on the longest detID of its batch)'''
+    detIDs, obsCodes, timeUTC, UV = _detections()
+    rng = np.random.default_rng(3)
+    copies = rng.integers(200, size=30)
+    # (copies with a longer detID, so that the padded width of the detIDs differs between the batches)
+    detIDs   = detIDs + [ detIDs[_] if n % 2 else 'a-much-longer-detID-%d' % _ for n, _ in enumerate(copies) ]
+    obsCodes = obsCodes + [ obsCodes[_] for _ in copies ]
+    timeUTC  = np.append(timeUTC, timeUTC[copies])
+    UV       = np.vstack([UV, UV[copies]])
+    assert _find(detIDs, obsCodes, timeUTC, UV, batchSizes) == _find(detIDs, obsCodes, timeUTC, UV)
+    assert all( reason is not None for reason in _find(detIDs, obsCodes, timeUTC, UV)[200:] )
+
+def test_reasons_by_tracklet():
+    N = dedup.NEAR_DUPLICATE
+    reasons       = [None, None, N, None, N, N, None]
+    trackletKeys  = [('o1', 't1'), ('o1', 't2'), ('o2', 't3'), ('o3', 't1')]
+    trackletSizes = [2, 2, 2, 1]
+    assert dedup.reasons_by_tracklet(reasons, trackletKeys, trackletSizes) == { ('o1', 't2') : [N, None], ('o2', 't3') : [N, N] }
+
+def test_duplicate_filter():
+    ''' Removes the duplicates (in any number of batches), & reports a tracklet all of whose detections are duplicates'''
+    D, N = dedup.DUPLICATE_DETID, dedup.NEAR_DUPLICATE
+    reasons = { ('o1', 't2') : [None, D], ('o2', 't3') : [N, D] }
+    detIDs   = ['d1', 'd2', 'd3', 'd4', 'd5', 'd6']
+    trkIDs   = ['t1', 't1', 't2', 't2', 't3', 't3']
+    orbitIDs = ['o1', 'o1', 'o1', 'o1', 'o2', 'o2']
+    obsCodes = ['F51'] * 6
+    timeUTC  = [1., 2., 3., 4., 5., 6.]
+
+    removed = {}
+    for batches in ([6], [1, 1, 1, 1, 1, 1], [3, 3]):
+        duplicateFilter = dedup.DuplicateFilter(reasons)
+        isDuplicate, start = [], 0
+        for size in batches:
+            sl = slice(start, start + size)
+            isDuplicate += duplicateFilter.filter(detIDs[sl], trkIDs[sl], orbitIDs[sl], obsCodes[sl], timeUTC[sl]).tolist()
+            start += size
+        assert isDuplicate == [False, False, False, True, True, True]
+        removed[tuple(batches)] = duplicateFilter.removed
+    assert len(set( tuple(_) for _ in removed.values() )) == 1
+
+    rows = removed[(6,)]
+    assert [ (row.reason, row.detID, row.trkID, row.orbitID) for row in rows ] == [(D, 'd4', 't2', 'o1'), (N, 'd5', 't3', 'o2'), (D, 'd6', 't3', 'o2'), (dedup.DUPLICATE_TRACKLET, '', 't3', 'o2')]
+    assert dedup.count_removed(rows) == { D : 2, N : 1, dedup.DUPLICATE_TRACKLET : 1 }
+    lines = dedup.report_lines(rows)
+    assert lines[0] == '# ' + ' , '.join(dedup.REPORT_KEYS)
+    assert lines[1] == 'duplicate_detID , d4 , t2 , o1 , F51 , 4.0'
+
+def test_duplicate_filter_rejects_unexpected_detections():
+    duplicateFilter = dedup.DuplicateFilter({ ('o1', 't1') : [dedup.DUPLICATE_DETID] })
+    duplicateFilter.filter(['d1'], ['t1'], ['o1'], ['F51'], [1.])
+    with pytest.raises(AssertionError):
+        duplicateFilter.filter(['d2'], ['t1'], ['o1'], ['F51'], [2.])
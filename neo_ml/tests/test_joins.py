@@ -0,0 +1,107 @@
+'''
+    Tests of joins.py : the hash joins must give the same answers as dictionary look-ups ...
+    ... for both ColumnarData objects & the dict-of-dicts from ingest_demo.NEODATA.read_*_into_dict
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import numpy as np
+import pytest
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import columnar
+import ingest_demo
+import joins
+from inputs import sample_filepath
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def _read_sample(columnarFormat):
+    ''' The (1e4) sample detections, tracklets & objects'''
+    neodata = ingest_demo.NEODATA()
+    if columnarFormat:
+        return neodata.read_detections_columnar(sample_filepath('detections')), neodata.read_tracklets_columnar(sample_filepath('tracklets')), neodata.read_objects_columnar(sample_filepath('objects'))
+    return neodata.read_detection_data_into_dict(sample_filepath('detections')), neodata.read_tracklet_data_into_dict(sample_filepath('tracklets')), neodata.read_object_data_into_dict(sample_filepath('objects'))
+
+def _table(dataKey, rows):
+    ''' A small dict-of-dicts'''
+    return { row[dataKey] : row for row in rows }
+
+
+# -----------------------------------
+# Tests
+# -----------------------------------
+
+def test_lookup():
+    table = np.array(['b', 'a', 'ccc', 'a-much-longer-key'])
+    keys  = np.array(['a', 'x', 'a-much-longer-key', 'ccc', '', 'b', 'a'])
+    assert joins.lookup(keys, table).tolist() == [1, -1, 3, 2, -1, 0, 1]
+
+def test_lookup_matches_dictionary():
+    rng   = np.random.default_rng(0)
+    table = np.array([ 'k%d' % _ for _ in rng.permutation(1000) ])
+    keys  = np.array([ 'k%d' % _ for _ in rng.integers(0, 1500, 5000) ])
+    rows  = { key : n for n, key in enumerate(table.tolist()) }
+    assert joins.lookup(keys, table).tolist() == [ rows.get(key, -1) for key in keys.tolist() ]
+
+def test_lookup_bytes_unicode_and_empty():
+    assert joins.lookup(np.array([b'a', b'b']), np.array(['b', 'a'])).tolist() == [1, 0]
+    assert joins.lookup(np.array(['a']), np.array([], dtype='U1')).tolist() == [-1]
+    assert joins.lookup(np.array([], dtype='U1'), np.array(['a'])).tolist() == []
+
+def test_find_duplicates():
+    assert sorted(joins.find_duplicates(np.array(['a', 'b', 'a', 'c', 'b', 'a'])).tolist()) == ['a', 'b']
+    assert len(joins.find_duplicates(np.array(['a', 'b', 'c']))) == 0
+    assert len(joins.find_duplicates(np.array([], dtype='U1'))) == 0
+
+@pytest.mark.parametrize('columnarFormat', [True, False])
+def test_check_correspondance_of_sample(columnarFormat):
+    ''' The checked-in sample is consistent : every trkID & objectID refers to a row, & every row is referred to'''
+    report = joins.check_correspondance(*_read_sample(columnarFormat))
+    assert joins.report_is_ok(report), joins.summarize_report(report)
+    assert joins.summarize_report(report) == 'no violations'
+
+def test_check_correspondance_finds_violations():
+    detections = _table('detID',    [ {'detID' : 'd1', 'trkID' : 't1'}, {'detID' : 'd2', 'trkID' : 't1'}, {'detID' : 'd3', 'trkID' : 't9'} ])
+    tracklets  = _table('trkID',    [ {'trkID' : 't1', 'objectID' : 'o1'}, {'trkID' : 't2', 'objectID' : 'o9'} ])
+    objects    = _table('objectID', [ {'objectID' : 'o1', 'isNEO' : 'True'}, {'objectID' : 'o2', 'isNEO' : 'False'} ])
+    report = joins.check_correspondance(detections, tracklets, objects)
+    assert report.detTrkIDsNotInTracklets.tolist()   == ['t9']
+    assert report.trkIDsWithoutDetections.tolist()   == ['t2']
+    assert report.trkObjectIDsNotInObjects.tolist()  == ['o9']
+    assert report.objectIDsWithoutTracklets.tolist() == ['o2']
+    assert len(report.duplicateDetIDs) == len(report.duplicateTrkIDs) == len(report.duplicateObjectIDs) == 0
+    assert not joins.report_is_ok(report)
+    assert 'detTrkIDsNotInTracklets' in joins.summarize_report(report)
+
+def test_check_correspondance_finds_duplicate_keys():
+    detections = columnar.ColumnarData({ 'detID' : np.array([b'd1', b'd2', b'd1']), 'trkID' : np.array([b't1', b't1', b't1']) }, 'detID')
+    tracklets  = columnar.ColumnarData({ 'trkID' : np.array([b't1']), 'objectID' : np.array([b'o1']) }, 'trkID')
+    objects    = columnar.ColumnarData({ 'objectID' : np.array([b'o1']), 'isNEO' : np.array([True]) }, 'objectID')
+    report = joins.check_correspondance(detections, tracklets, objects)
+    assert report.duplicateDetIDs.tolist() == [b'd1']
+
+@pytest.mark.parametrize('columnarFormat', [True, False])
+def test_generate_labels_matches_dictionary_lookups(columnarFormat):
+    detections, tracklets, objects = _read_sample(columnarFormat)
+    trackletLabels, detectionLabels, trackletValid, detectionValid = joins.generate_labels(detections, tracklets, objects)
+    assert trackletValid.all() and detectionValid.all()
+    isNEO = { objectID : str(obj['isNEO']) == 'True' for objectID, obj in objects.items() }
+    expectedTracklets = { trkID : isNEO[trk['objectID']] for trkID, trk in tracklets.items() }
+    assert trackletLabels.tolist()  == list(expectedTracklets.values())
+    assert detectionLabels.tolist() == [ expectedTracklets[det['trkID']] for det in detections.values() ]
+
+def test_generate_label_dictionaries_keeps_the_objDict_values():
+    detections, tracklets, objects = _read_sample(False)
+    trackletLabels, detectionLabels = ingest_demo.NEODATA().generate_label_dictionaries(detections, tracklets, objects)
+    expected = { trkID : objects[trk['objectID']]['isNEO'] for trkID, trk in tracklets.items() }
+    assert trackletLabels == expected
+    assert detectionLabels == { detID : expected[det['trkID']] for detID, det in detections.items() }
+    assert set(trackletLabels.values()) <= {'True', 'False'}
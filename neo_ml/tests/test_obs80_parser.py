@@ -0,0 +1,101 @@
+'''
+    Tests of obs80_parser.py : the vectorized parser must agree with the (record-by-record) reference, obs80.parseOpt ...
+    ... & must flag (rather than raise on) the records that cannot be parsed
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import numpy as np
+import pytest
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import obs80_parser
+from inputs import obs80_record, make_raw_data
+
+
+EXAMPLE = "     K17A00Z 5C2014 04 28.98950 13 24 42.05 -19 38 29.3                L~2ClrW84"
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def _records():
+    ''' Well-formed optical records : those of the synthetic raw data, plus the example from the module docstring'''
+    obsLines, orbitLines = make_raw_data(nObjects=30, seed=1, duplicates=False)
+    return [EXAMPLE] + [ line.rstrip('\n').split(',')[3] for line in obsLines ]
+
+
+# -----------------------------------
+# Tests
+# -----------------------------------
+
+def test_matches_reference_parser():
+    o = pytest.importorskip('obs80.obs80')
+    records = _records()
+    columns, ok = obs80_parser.parse_obs80(records)
+    assert ok.all()
+    for n, record in enumerate(records):
+        reference = o.parseOpt(record)
+        assert columns['jdutc'][n] == pytest.approx(reference.jdutc, abs=1e-8)
+        assert columns['ra'][n]    == pytest.approx(reference.ra,    abs=1e-10)
+        assert columns['dec'][n]   == pytest.approx(reference.dec,   abs=1e-10)
+        assert columns['cod'][n]   == reference.cod
+        if reference.mag is None:
+            assert np.isnan(columns['mag'][n])
+        else:
+            assert columns['mag'][n] == pytest.approx(reference.mag)
+
+def test_example_record():
+    columns, ok = obs80_parser.parse_obs80([EXAMPLE, EXAMPLE + '\n'])
+    assert ok.tolist() == [True, True]
+    np.testing.assert_allclose(columns['jdutc'], 2456776.48950)
+    np.testing.assert_allclose(columns['ra'],  13. + 24. / 60. + 42.05 / 3600.)
+    np.testing.assert_allclose(columns['dec'], -(19. + 38. / 60. + 29.3 / 3600.))
+    assert np.isnan(columns['mag']).all()
+    assert columns['cod'].tolist() == ['W84', 'W84']
+
+def test_synthetic_records_round_trip():
+    ''' The parsed values are those from which the records were formatted (to the precision of the format)'''
+    jdutc, ra, dec = 2458123.45678, 7.123456, -33.3456
+    columns, ok = obs80_parser.parse_obs80([ obs80_record('K10A00001Z', jdutc, ra, dec, 18.3, 'F51') ])
+    assert ok.tolist() == [True]
+    assert columns['jdutc'][0] == pytest.approx(jdutc, abs=1e-5)
+    assert columns['ra'][0]    == pytest.approx(ra,    abs=0.01 / 3600.)
+    assert columns['dec'][0]   == pytest.approx(dec,   abs=0.1 / 3600.)
+    assert columns['mag'][0]   == pytest.approx(18.3)
+    assert columns['cod'][0]   == 'F51'
+
+def test_decimal_minutes():
+    ''' RA "HH MM.mmmm" & Dec "sDD MM.mmm" give the same position as the equivalent sexagesimal record'''
+    decimalMinutes = EXAMPLE[:32] + '13 24.7008  -19 38.488  ' + EXAMPLE[56:]
+    assert len(decimalMinutes) == 80
+    columns, ok = obs80_parser.parse_obs80([EXAMPLE, decimalMinutes])
+    assert ok.tolist() == [True, True]
+    assert columns['ra'][1]  == pytest.approx(13. + 24.7008 / 60.)
+    assert columns['dec'][1] == pytest.approx(-(19. + 38.488 / 60.))
+    assert columns['ra'][1]  == pytest.approx(columns['ra'][0],  abs=1e-4 / 60.)
+    assert columns['dec'][1] == pytest.approx(columns['dec'][0], abs=1e-3 / 60.)
+
+def test_bad_records_are_flagged():
+    good = obs80_record('K10A00001Z', 2458123.45678, 7.123456, -33.3456, 18.3, 'F51')
+    bad  = [ good[:60],                                 # truncated
+             good + 'X',                                # too long
+             good[:40] + 'xx' + good[42:],              # non-numeric RA seconds
+             good[:20] + '13' + good[22:],              # month 13
+             good[:32] + '25' + good[34:],              # RA >= 24h
+             good[:44] + '*' + good[45:],               # no sign on the Dec
+             good[:14] + 'R' + good[15:],               # radar
+             good[:65] + ' ab  ' + good[70:],           # non-numeric magnitude
+             '' ]
+    columns, ok = obs80_parser.parse_obs80([good] + bad + [good])
+    assert ok.tolist() == [True] + [False] * len(bad) + [True]
+    assert columns['cod'][-1] == 'F51'
+
+def test_empty_batch():
+    columns, ok = obs80_parser.parse_obs80([])
+    assert len(ok) == 0 and len(columns['jdutc']) == 0
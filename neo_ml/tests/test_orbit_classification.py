@@ -0,0 +1,66 @@
+'''
+    Tests of orbit_classification.py : the parsing & (vectorized) classification of the lines of the raw orbit file ...
+    ... which must cope with missing elements & malformed lines, rather than abort the orbit stage
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import numpy as np
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import data
+import orbit_classification
+from inputs import make_raw_data
+
+
+EXAMPLE = 'K17A00000Z,1.860740581,0.327816993,11.9724421,24.3326162,353.2247911,2459182.9309837\n'
+
+
+# -----------------------------------
+# Tests
+# -----------------------------------
+
+def test_parse_orbit_lines():
+    columns = orbit_classification.parse_orbit_lines([EXAMPLE, ' K17A00001Z,1.,0.1,2.,3.,4.,2459000.5 \r\n'])
+    assert set(columns) == set(orbit_classification.ORBIT_FILE_FIELDS)
+    assert columns['objectID'] == ['K17A00000Z', 'K17A00001Z']
+    assert columns['orbit_q']  == ['1.860740581', '1.']
+    assert columns['orbit_TP'] == ['2459182.9309837', '2459000.5']
+    assert all( column == [] for column in orbit_classification.parse_orbit_lines([]).values() )
+
+def test_classification_matches_row_by_row():
+    ''' The vectorized classification of a block of lines is that of each line on its own'''
+    obsLines, orbitLines = make_raw_data(nObjects=50, duplicates=False)
+    columns = orbit_classification.classify_orbit_lines(orbitLines)
+    for n, line in enumerate(orbitLines):
+        single = orbit_classification.classify_orbit_lines([line])
+        assert (single['isNEO'], single['objectType']) == ([columns['isNEO'][n]], [columns['objectType'][n]])
+    assert all( type(_) is bool for _ in columns['isNEO'] )
+    assert columns['isNEO'] == [ float(line.split(',')[1]) < orbit_classification.Q_NEO for line in orbitLines ]
+
+def test_missing_elements_give_unknown_objectType():
+    lines   = [EXAMPLE, 'K17A00001Z,,0.1,2.,3.,4.,2459000.5\n', 'K17A00002Z,1.,None,2.,3.,4.,\n']
+    columns = orbit_classification.classify_orbit_lines(lines)
+    assert columns['objectID'] == ['K17A00000Z', 'K17A00001Z', 'K17A00002Z']
+    assert columns['objectType'][0] != data.missing_values['int8']
+    assert columns['objectType'][1:] == [data.missing_values['int8']] * 2
+    assert columns['isNEO'][1:] == [False, True]
+
+def test_malformed_lines_are_skipped(capsys):
+    lines   = [EXAMPLE, 'K17A00001Z,1.,0.1\n', '\n', 'K17A00002Z,1.,0.1,2.,3.,4.,2459000.5,extra\n', EXAMPLE.replace('00000', '00003')]
+    columns = orbit_classification.classify_orbit_lines(lines)
+    assert columns['objectID'] == ['K17A00000Z', 'K17A00003Z']
+    assert len(columns['objectType']) == len(columns['isNEO']) == 2
+    assert 'skipping 2 orbit line(s)' in capsys.readouterr().out
+
+def test_object_strings():
+    columns = orbit_classification.classify_orbit_lines([EXAMPLE, EXAMPLE.replace('00000', '00001')])
+    strings = orbit_classification.ObjectStrings(columns, ['objectID', 'isNEO', 'orbit_q'])
+    assert list(strings) == ['K17A00000Z', 'K17A00001Z']
+    assert strings['K17A00001Z'] == 'K17A00001Z , False , 1.860740581'
+    assert 'K17A00002Z' not in strings
+    assert np.isclose(float(strings['K17A00000Z'].split(' , ')[2]), 1.860740581)
@@ -0,0 +1,184 @@
+'''
+    Tests of sample_data_creation.py
+     - the splitting, sorting & fingerprinting of the input lines (which must skip, rather than crash on, malformed lines)
+     - the whole pipeline, run (as a subprocess) on synthetic raw data in a temporary directory ...
+       ... serial vs parallel (incl. the removal of duplicates), & an --incremental update vs a full rebuild
+       (these need the MPC-internal modules, & are skipped when they are not installed)
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import os
+import re
+import json
+import pytest
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import dedup
+import columnar
+import sample_data_creation
+from inputs import MALFORMED_LINES, NUMBER_STRING, make_raw_data, write_raw_data, copy_pipeline, run_pipeline, read_outputs
+
+
+def _requires_mpc_modules():
+    for module in ('MPC_library', 'phys_const', 'obs80.obs80'):
+        pytest.importorskip(module)
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def _pipeline(directory, obsLines, orbitLines):
+    ''' A copy of the pipeline in directory, reading the supplied raw data'''
+    copy_pipeline(str(directory))
+    write_raw_data(str(directory), obsLines, orbitLines)
+    return str(directory)
+
+def _run(directory, *args):
+    result = run_pipeline(directory, *args)
+    assert result.returncode == 0, result.stdout
+    return result
+
+def _as_sets(outputs):
+    ''' The outputs as sets of lines (the order of the rows of an --incremental run differs from that of a full run)'''
+    return { dataType : set(lines) for dataType, lines in outputs.items() }
+
+def _incremental_counts(result):
+    ''' The numbers of tracklets in the input, to be processed & previously processed, as printed by an --incremental run'''
+    match = re.search(r'incremental : (\d+) tracklets in input, (\d+) to be processed \(of which (\d+) previously processed\)', result.stdout)
+    assert match, result.stdout
+    return tuple( int(_) for _ in match.groups() )
+
+def _with_malformed_lines(obsLines):
+    ''' The input lines with the malformed lines at the start, in the middle & at the end'''
+    middle = len(obsLines) // 2
+    return MALFORMED_LINES + obsLines[:middle] + MALFORMED_LINES + obsLines[middle:] + MALFORMED_LINES
+
+
+# -----------------------------------
+# Tests of the handling of the input lines
+# -----------------------------------
+
+def test_split_detection_line():
+    line = 'K10A00001Z,det0000001,0000000010,' + 'x' * 80 + '\n'
+    assert sample_data_creation._split_detection_line(line) == ['K10A00001Z', 'det0000001', '0000000010', 'x' * 80 + '\n']
+    for malformed in MALFORMED_LINES + ['a,b,c,d,e\n', 'a,b,c,' + 'x' * 150 + '\n', '']:
+        assert sample_data_creation._split_detection_line(malformed) is None
+
+def test_detection_sort_key():
+    obsLines, orbitLines = make_raw_data(nObjects=10, duplicates=False)
+    keys = [ sample_data_creation._detection_sort_key(line) for line in obsLines ]
+    assert keys == sorted(keys)
+    # (grouped on orbitID, then trkID)
+    assert [ key[:2] for key in keys ] == sorted( key[:2] for key in keys )
+    for malformed in MALFORMED_LINES:
+        assert sample_data_creation._detection_sort_key(malformed)[0] == malformed
+
+def test_fingerprint_tracklets_skips_malformed_lines():
+    obsLines, orbitLines = make_raw_data(nObjects=20)
+    fingerprints = sample_data_creation._fingerprint_tracklets(obsLines)
+    assert set(fingerprints) == { line.split(',')[2] for line in obsLines }
+    assert sample_data_creation._fingerprint_tracklets(_with_malformed_lines(obsLines)) == fingerprints
+    # (also from a generator, as read from the file)
+    assert sample_data_creation._fingerprint_tracklets( iter(obsLines) ) == fingerprints
+
+def test_fingerprint_tracklets_changes_with_the_tracklet():
+    obsLines, orbitLines = make_raw_data(nObjects=20, duplicates=False)
+    fingerprints = sample_data_creation._fingerprint_tracklets(obsLines)
+    trkID   = obsLines[0].split(',')[2]
+    changed = [obsLines[0].replace('C20', 'C19', 1)] + obsLines[1:]
+    newFingerprints = sample_data_creation._fingerprint_tracklets(changed)
+    assert [ k for k in fingerprints if fingerprints[k] != newFingerprints[k] ] == [trkID]
+    # ... or with its duplicates
+    reasons = { (obsLines[0].split(',')[0], trkID) : [dedup.DUPLICATE_DETID] }
+    newFingerprints = sample_data_creation._fingerprint_tracklets(obsLines, reasons)
+    assert [ k for k in fingerprints if fingerprints[k] != newFingerprints[k] ] == [trkID]
+
+
+# -----------------------------------
+# Tests of the whole pipeline
+# -----------------------------------
+
+def test_serial_and_parallel_give_the_same_output(tmp_path):
+    _requires_mpc_modules()
+    obsLines, orbitLines = make_raw_data()
+    serial   = _pipeline(tmp_path / 'serial',   obsLines, orbitLines)
+    parallel = _pipeline(tmp_path / 'parallel', obsLines, orbitLines)
+    _run(serial)
+    _run(parallel, '--workers', '2')
+    outputs = read_outputs(serial)
+    assert all( lines for lines in outputs.values() )
+    assert read_outputs(parallel) == outputs
+    assert _run(serial, '--compareWorkers', '2').returncode == 0
+
+def test_duplicates_are_removed(tmp_path):
+    _requires_mpc_modules()
+    obsLines, orbitLines = make_raw_data()
+    directory = _pipeline(tmp_path, obsLines, orbitLines)
+    _run(directory)
+    outputs = read_outputs(directory)
+    reasons = { line.split(',')[0].strip() for line in outputs['duplicates'] if not line.startswith('#') }
+    assert reasons == { dedup.DUPLICATE_DETID, dedup.NEAR_DUPLICATE, dedup.DUPLICATE_TRACKLET }
+
+    # every detID is output once, & the (re-used trkID) detections that are not duplicates are kept
+    column = sorted(sample_data_creation.data.detection_field_definitions).index('detID')
+    detIDs = [ columnar.tokenize_line(line)[column] for line in outputs['detections'] if not line.startswith('#') ]
+    assert len(detIDs) == len(set(detIDs))
+    assert sum( detID.startswith('reused') for detID in detIDs ) == sum( line.split(',')[1].startswith('reused') for line in obsLines )
+    # (only the first, in input order, of a detection & its near duplicate is kept)
+    for detID in { line.split(',')[1] for line in obsLines if line.split(',')[1].startswith('near') }:
+        assert (detID in detIDs) != (detID[len('near'):] in detIDs), detID
+
+    # ... whereas --keepDuplicates keeps all of the input lines (incl. the repeated lines)
+    _run(directory, '--keepDuplicates')
+    kept = read_outputs(directory)
+    assert kept['duplicates'] is None or len(kept['duplicates']) <= 1
+    assert len(kept['detections']) - 1 == len(obsLines)
+
+def test_malformed_lines_are_skipped(tmp_path):
+    ''' Serial, parallel & --incremental runs skip the malformed lines, & give the output of the clean input'''
+    _requires_mpc_modules()
+    obsLines, orbitLines = make_raw_data()
+    clean = _pipeline(tmp_path / 'clean', obsLines, orbitLines)
+    _run(clean)
+    expected = read_outputs(clean)
+    for args in ([], ['--workers', '2'], ['--incremental']):
+        directory = _pipeline(tmp_path / ('malformed%s' % ''.join(args)), _with_malformed_lines(obsLines), orbitLines)
+        _run(directory, *args)
+        assert _as_sets(read_outputs(directory)) == _as_sets(expected), args
+
+def test_incremental_update_matches_full_rebuild(tmp_path):
+    ''' A full run on v1 of the input, then an --incremental run on v2 (new, changed & malformed lines), gives the output of a full run on v2'''
+    _requires_mpc_modules()
+    obsLines, orbitLines = make_raw_data(nObjects=60, seed=2)
+    # v1 lacks the last 20 objects (& their orbits), & has a tracklet that is changed in v2
+    v1Objects = { line.split(',')[0] for line in orbitLines[:40] }
+    v1 = [ line for line in obsLines if line.split(',')[0] in v1Objects ]
+    changedTrkID = v1[0].split(',')[2]
+    v1 = [ line.replace('C20', 'C19', 1) if line.split(',')[2] == changedTrkID else line for line in v1 ]
+    v1 = sorted(v1, key=sample_data_creation._detection_sort_key)
+    v2 = _with_malformed_lines(obsLines)
+
+    incremental = _pipeline(tmp_path / 'incremental', v1, orbitLines[:40])
+    _run(incremental)
+    write_raw_data(incremental, v2, orbitLines)
+    nInput, nProcessed, nChanged = _incremental_counts( _run(incremental, '--incremental') )
+    # (the changed tracklet, plus any whose duplicates are changed by the new lines)
+    assert nChanged >= 1 and nProcessed < nInput
+
+    full = _pipeline(tmp_path / 'full', v2, orbitLines)
+    _run(full)
+    expected = _as_sets(read_outputs(full))
+    assert _as_sets(read_outputs(incremental)) == expected
+
+    # the manifest records every tracklet, & a repeated update has nothing to do
+    manifest = json.load(open(os.path.join(incremental, 'sample_data', 'sample_data_%s_real_manifest.json' % NUMBER_STRING)))
+    assert set(manifest['trkIDs']) == set(sample_data_creation._fingerprint_tracklets(v2))
+    assert None not in manifest['trkIDs'].values()
+    assert _incremental_counts( _run(incremental, '--incremental') ) == (nInput, 0, 0)
+    assert _as_sets(read_outputs(incremental)) == expected
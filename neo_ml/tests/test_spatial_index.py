@@ -0,0 +1,106 @@
+'''
+    Tests of spatial_index.py : the binned searches must find exactly the detections that a brute-force scan finds ...
+    ... whatever the search-angle relative to the cellSize, and however the queries are chunked
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import numpy as np
+import pytest
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import spatial_index
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def _detections(N=1500, seed=0):
+    ''' Unit vectors clustered about a few directions (so that there are pairs at all of the tested angles), & times over a few nights'''
+    rng     = np.random.default_rng(seed)
+    centres = rng.normal(size=(8, 3))
+    UV      = centres[rng.integers(len(centres), size=N)] / np.linalg.norm(centres, axis=1).max() + rng.normal(scale=0.05, size=(N, 3))
+    UV     /= np.linalg.norm(UV, axis=1)[:, None]
+    return UV, 2458000. + rng.uniform(0., 3., N)
+
+def _brute_force_pairs(UV, timeUTC, angle, dt):
+    separation = np.arccos(np.clip(UV @ UV.T, -1., 1.))
+    close      = (separation <= angle) & (np.abs(timeUTC[:, None] - timeUTC[None, :]) <= dt)
+    i, j       = np.nonzero(np.triu(close, k=1))
+    return set(zip(i.tolist(), j.tolist()))
+
+def _as_set(i, j):
+    assert len(i) == len(j)
+    pairs = set(zip(i.tolist(), j.tolist()))
+    assert len(pairs) == len(i), 'repeated pairs'
+    return pairs
+
+
+# -----------------------------------
+# Tests
+# -----------------------------------
+
+@pytest.mark.parametrize('angle', [0.005, 0.02, 0.2])
+def test_pairs_within_matches_brute_force(angle):
+    ''' (0.2 radians > 2*cellSize, so is searched on a re-binned index)'''
+    UV, timeUTC = _detections()
+    expected    = _brute_force_pairs(UV, timeUTC, angle, 0.5)
+    assert len(expected) > 0
+    index = spatial_index.DetectionIndex(UV, timeUTC, cellSize=np.radians(1.), timeBinSize=1.)
+    assert _as_set(*index.pairs_within(angle, 0.5)) == expected
+    # ... with the queries & bins chunked
+    assert _as_set(*index.pairs_within(angle, 0.5, batchSize=97, maxBins=1000)) == expected
+
+def test_pairs_within_small_cells_and_time_bins():
+    UV, timeUTC = _detections(N=600, seed=1)
+    index = spatial_index.DetectionIndex(UV, timeUTC, cellSize=0.003, timeBinSize=0.1)
+    assert _as_set(*index.pairs_within(0.005, 0.3)) == _brute_force_pairs(UV, timeUTC, 0.005, 0.3)
+
+def test_cone_search_batch_matches_brute_force():
+    UV, timeUTC = _detections()
+    queryUV, queryTime = _detections(N=50, seed=2)
+    angle, dt = 0.03, 1.
+    index = spatial_index.DetectionIndex(UV, timeUTC)
+    indices, offsets = index.cone_search_batch(queryUV, queryTime, angle, dt)
+    assert len(offsets) == len(queryUV) + 1 and offsets[-1] == len(indices)
+
+    separation = np.arccos(np.clip(queryUV @ UV.T, -1., 1.))
+    close      = (separation <= angle) & (np.abs(queryTime[:, None] - timeUTC[None, :]) <= dt)
+    for k in range(len(queryUV)):
+        assert indices[offsets[k]:offsets[k + 1]].tolist() == np.nonzero(close[k])[0].tolist()
+
+    # chunking does not change the result
+    for batchSize, maxBins in ((1, 2**20), (7, 50), (50, 1)):
+        chunkedIndices, chunkedOffsets = index.cone_search_batch(queryUV, queryTime, angle, dt, batchSize=batchSize, maxBins=maxBins)
+        np.testing.assert_array_equal(chunkedIndices, indices)
+        np.testing.assert_array_equal(chunkedOffsets, offsets)
+
+def test_neighbours_excludes_the_detection_itself():
+    UV, timeUTC = _detections(N=300)
+    index = spatial_index.DetectionIndex(UV, timeUTC)
+    for n in (0, 17, 299):
+        neighbours = index.neighbours(n, 0.05, 1.)
+        assert n not in neighbours
+        separation = np.arccos(np.clip(UV @ UV[n], -1., 1.))
+        expected   = np.nonzero((separation <= 0.05) & (np.abs(timeUTC - timeUTC[n]) <= 1.))[0]
+        assert neighbours.tolist() == [ _ for _ in expected.tolist() if _ != n ]
+
+def test_empty_index_and_queries():
+    index = spatial_index.DetectionIndex(np.zeros((0, 3)), [])
+    assert len(index) == 0
+    i, j = index.pairs_within(0.01, 1.)
+    assert len(i) == len(j) == 0
+    indices, offsets = index.cone_search_batch([[1., 0., 0.]], [2458000.], 0.01, 1.)
+    assert len(indices) == 0 and offsets.tolist() == [0, 0]
+    UV, timeUTC = _detections(N=10)
+    indices, offsets = spatial_index.DetectionIndex(UV, timeUTC).cone_search_batch(np.zeros((0, 3)), [], 0.01, 1.)
+    assert len(indices) == 0 and offsets.tolist() == [0]
+
+def test_chord_from_angle():
+    assert spatial_index.chord_from_angle(np.pi) == pytest.approx(2.)
+    assert spatial_index.chord_from_angle(np.pi / 3.) == pytest.approx(1.)
@@ -0,0 +1,119 @@
+'''
+    Tests of storage.py : the binary (.npy) datasets must hold exactly the data of the csv files ...
+    ... whether they are written in one go (write_columnar), or part-by-part (append_part, move_parts & finalize)
+
+'''
+
+# -----------------------------------
+# Third-party imports
+# -----------------------------------
+import os
+import numpy as np
+import pytest
+
+# -----------------------------------
+# Local imports
+# -----------------------------------
+import data
+import columnar
+import storage
+from inputs import sample_filepath
+
+
+READERS = { 'detections' : (columnar.read_detections_columnar, data.detection_field_definitions, data.detection_field_dtypes, 'detID'),
+            'tracklets'  : (columnar.read_tracklets_columnar,  data.tracklet_field_definitions,  data.tracklet_field_dtypes,  'trkID'),
+            'objects'    : (columnar.read_objects_columnar,    data.object_field_definitions,    data.object_field_dtypes,    'objectID') }
+
+
+# -----------------------------------
+# Define some useful function(s)
+# -----------------------------------
+
+def assert_same_data(a, b):
+    ''' The two ColumnarData objects hold the same rows (in the same order)'''
+    assert a.dataKey == b.dataKey
+    assert set(a.columns) == set(b.columns)
+    assert len(a) == len(b)
+    for key in a.columns:
+        x, y = a.columns[key], b.columns[key]
+        if isinstance(x, columnar.RaggedArray):
+            assert isinstance(y, columnar.RaggedArray), key
+            np.testing.assert_array_equal(x.offsets, y.offsets)
+            np.testing.assert_array_equal(x.values, y.values)
+        else:
+            np.testing.assert_array_equal(np.asarray(x), np.asarray(y), err_msg=key)
+
+def _split_columns(columnarData, boundaries):
+    ''' The columns of the rows [start, end) for each consecutive pair of boundaries'''
+    parts = []
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        part = columnarData.select(np.arange(start, end))
+        parts.append(part.columns)
+    return parts
+
+
+# -----------------------------------
+# Tests
+# -----------------------------------
+
+@pytest.mark.parametrize('dataType', sorted(READERS))
+def test_write_read_round_trip(tmp_path, dataType):
+    read, fieldDefinitions, fieldDtypes, dataKey = READERS[dataType]
+    csvData   = read(sample_filepath(dataType))
+    directory = str(tmp_path / 'data.npy.d')
+    storage.write_columnar(directory, csvData)
+    assert storage.is_binary_dataset(directory)
+    for mmap in (True, False):
+        assert_same_data(storage.read_columnar(directory, mmap=mmap), csvData)
+
+@pytest.mark.parametrize('dataType', sorted(READERS))
+def test_convert_csv_to_binary(tmp_path, dataType):
+    read, fieldDefinitions, fieldDtypes, dataKey = READERS[dataType]
+    directory = storage.convert_csv_to_binary(sample_filepath(dataType), fieldDefinitions, fieldDtypes, dataKey, directory=str(tmp_path / 'data.npy.d'))
+    assert_same_data(storage.read_columnar(directory), read(sample_filepath(dataType)))
+
+@pytest.mark.parametrize('dataType', sorted(READERS))
+def test_parts_then_finalize_matches_csv(tmp_path, dataType):
+    ''' Parts of different sizes (incl. an empty part) combine into the data of the csv file'''
+    read, fieldDefinitions, fieldDtypes, dataKey = READERS[dataType]
+    csvData   = read(sample_filepath(dataType))
+    N         = len(csvData)
+    directory = str(tmp_path / 'data.npy.d')
+    for columns in _split_columns(csvData, [0, 1, N // 3, N // 3, N // 2, N]):
+        storage.append_part(directory, columns, dataKey)
+
+    # the dataset cannot be read until it has been finalized
+    with pytest.raises(AssertionError):
+        storage.read_columnar(directory)
+    storage.finalize(directory)
+    assert not os.path.isdir(os.path.join(directory, storage.PARTS_DIRNAME))
+    assert_same_data(storage.read_columnar(directory), csvData)
+
+def test_finalize_appends_to_existing_dataset(tmp_path):
+    ''' As for an --incremental run : parts finalized onto an existing dataset are appended to it'''
+    csvData   = columnar.read_tracklets_columnar(sample_filepath('tracklets'))
+    N         = len(csvData)
+    directory = str(tmp_path / 'tracklets.npy.d')
+    first, second, third = _split_columns(csvData, [0, N // 4, N // 2, N])
+    storage.append_part(directory, first, 'trkID')
+    storage.finalize(directory)
+    storage.append_part(directory, second, 'trkID')
+    storage.append_part(directory, third, 'trkID')
+    storage.finalize(directory)
+    assert_same_data(storage.read_columnar(directory), csvData)
+
+def test_move_parts_preserves_order(tmp_path):
+    ''' As for the shards of a parallel run : the parts of each shard are moved (in shard order) onto the output'''
+    csvData   = columnar.read_detections_columnar(sample_filepath('detections'))
+    N         = len(csvData)
+    directory = str(tmp_path / 'detections.npy.d')
+    boundaries = [0, N // 5, 2 * N // 5, 3 * N // 5, N]
+    for n, columns in enumerate(_split_columns(csvData, boundaries)):
+        shardDirectory = str(tmp_path / ('shard%d.npy.d' % n))
+        # (two parts per shard)
+        half = len(columns['detID']) // 2
+        storage.append_part(shardDirectory, { key : col[:half] for key, col in columns.items() }, 'detID')
+        storage.append_part(shardDirectory, { key : col[half:] for key, col in columns.items() }, 'detID')
+        storage.move_parts(shardDirectory, directory)
+    storage.finalize(directory)
+    assert_same_data(storage.read_columnar(directory), csvData)